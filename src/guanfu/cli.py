@@ -6,6 +6,7 @@ import sys
 from guanfu import __version__
 from guanfu.buildspec_rebuild import run_buildspec_rebuild
 from guanfu.koji_rebuild.command import run_koji_rpm_rebuild
+from guanfu.koji_rebuild.reassess import run_assess
 
 
 def build_parser():
@@ -47,6 +48,13 @@ def build_parser():
         "--rpm-name",
         help="Published RPM filename, for example zlib-1.2.13-3.an23.x86_64.rpm",
     )
+    source.add_argument(
+        "--rpm-list",
+        help=(
+            "File with one published RPM filename per line ('#' starts a comment). Each RPM "
+            "gets its own run directory and report; VM rebuilds share a warm VM pool."
+        ),
+    )
     source.add_argument(
         "--slsa-provenance",
         help="RPM SLSA provenance file. Reserved for the second implementation phase.",
@@ -61,11 +69,90 @@ def build_parser():
         default="https://build.openanolis.cn/kojifiles",
         help="Koji topurl for repos and mock-config",
     )
+    koji.add_argument(
+        "--koji-multicall-batch-size",
+        type=int,
+        default=int(os.environ.get("GUANFU_KOJI_MULTICALL_BATCH_SIZE", "100")),
+        help=(
+            "Maximum number of Koji calls sent in one system.multicall request. "
+            "Set to 1 to disable multicall batching."
+        ),
+    )
+    koji.add_argument(
+        "--koji-cache",
+        choices=("sqlite", "none"),
+        default=os.environ.get("GUANFU_KOJI_CACHE", "sqlite"),
+        help=(
+            "Cache for Koji metadata lookups. sqlite keeps immutable build, buildroot, "
+            "and task metadata under <workdir>/cache across runs; none always queries the hub."
+        ),
+    )
+    koji.add_argument(
+        "--koji-download-transport",
+        choices=("auto", "xmlrpc"),
+        default=os.environ.get("GUANFU_KOJI_DOWNLOAD_TRANSPORT", "auto"),
+        help=(
+            "How Koji task outputs and dependency RPMs are fetched. auto streams files "
+            "published under --koji-topurl over HTTP and falls back to downloadTaskOutput; "
+            "xmlrpc always uses downloadTaskOutput."
+        ),
+    )
+    koji.add_argument(
+        "--input-workers",
+        type=int,
+        default=int(os.environ.get("GUANFU_INPUT_WORKERS", "4")),
+        help=(
+            "Number of threads used to probe repodata, download published and Koji "
+            "inputs, and generate mock.cfg concurrently. Set to 1 to run them in order."
+        ),
+    )
+    koji.add_argument(
+        "--compare-scope",
+        choices=("target", "build"),
+        default=os.environ.get("GUANFU_COMPARE_SCOPE", "target"),
+        help=(
+            "target compares only --rpm-name with its published RPM. build also downloads the "
+            "published counterpart of every rebuilt subpackage and reports one assessment per "
+            "RPM plus a build-level verdict under build_comparison."
+        ),
+    )
+    koji.add_argument(
+        "--compare-workers",
+        type=int,
+        default=int(os.environ.get("GUANFU_COMPARE_WORKERS", "4")),
+        help="Number of processes used by --compare-scope build.",
+    )
+    koji.add_argument(
+        "--assessment-policy",
+        default=os.environ.get("GUANFU_ASSESSMENT_POLICY"),
+        help=(
+            "JSON file with the path categories used to classify file differences. "
+            "It replaces the built-in policy; see docs/local_rebuild_guide.md for the format."
+        ),
+    )
+    koji.add_argument(
+        "--artifact-store",
+        choices=("shared", "none"),
+        default=os.environ.get("GUANFU_ARTIFACT_STORE", "shared"),
+        help=(
+            "Content-addressed store for downloaded RPMs, SRPMs and logs under "
+            "<workdir>/cache/artifacts. shared links files into each run directory "
+            "instead of downloading them again; none disables the store."
+        ),
+    )
     koji.add_argument(
         "--binary-rpm-base-url",
         default="https://mirrors.openanolis.cn/anolis/23/os/x86_64/os/Packages/",
         help="Base URL for published binary RPMs",
     )
+    koji.add_argument(
+        "--debug-rpm-base-url",
+        default=os.environ.get("GUANFU_DEBUG_RPM_BASE_URL"),
+        help=(
+            "Base URL for published -debuginfo and -debugsource RPMs, used by --compare-scope build. "
+            "Without it they are looked up under --binary-rpm-base-url."
+        ),
+    )
     koji.add_argument(
         "--source-rpm-base-url",
         default="https://mirrors.openanolis.cn/anolis/23/os/source/Packages/",
@@ -93,6 +180,14 @@ def build_parser():
             "23.4 x86_64 GA qcow2 image. Can also be set with GUANFU_VM_IMAGE."
         ),
     )
+    koji.add_argument(
+        "--vm-image-sha256",
+        default=os.environ.get("GUANFU_VM_IMAGE_SHA256"),
+        help=(
+            "Published sha256 of the --vm-image URL. Downloads and cached images that "
+            "do not match are discarded. Can also be set with GUANFU_VM_IMAGE_SHA256."
+        ),
+    )
     koji.add_argument(
         "--vm-image-format",
         default=os.environ.get("GUANFU_VM_IMAGE_FORMAT", "auto"),
@@ -132,11 +227,27 @@ def build_parser():
     koji.add_argument(
         "--vm-share-mode",
         default=os.environ.get("GUANFU_VM_SHARE_MODE", "auto"),
-        choices=("auto", "9p", "image-copy"),
+        choices=("auto", "virtiofs", "9p", "image-copy", "job-disk"),
         help=(
-            "How host inputs/results are exchanged with the VM. auto uses 9p when QEMU "
-            "supports it, otherwise copies inputs into the qcow2 overlay and copies "
-            "results back after shutdown."
+            "How host inputs/results are exchanged with the VM. auto uses virtiofs when "
+            "QEMU supports vhost-user-fs-pci and virtiofsd starts on this host, then 9p, otherwise "
+            "copies inputs into the qcow2 overlay and copies results back after shutdown. job-disk attaches a "
+            "NoCloud cidata seed (iso9660 or vfat), an ext4 disk with the inputs and an empty results disk, "
+            "built with e2fsprogs and genisoimage/xorriso or dosfstools instead of libguestfs."
+        ),
+    )
+    koji.add_argument(
+        "--vm-virtiofsd-binary",
+        default=os.environ.get("GUANFU_VIRTIOFSD_BINARY"),
+        help="virtiofsd binary path used by --vm-share-mode virtiofs.",
+    )
+    koji.add_argument(
+        "--vm-share-benchmark",
+        action="store_true",
+        default=os.environ.get("GUANFU_VM_SHARE_BENCHMARK", "").lower() in ("1", "true", "yes", "on"),
+        help=(
+            "Before mock starts, let the guest read every shared input once and record the time "
+            "in executor.transfer.guest_read."
         ),
     )
     koji.add_argument(
@@ -147,6 +258,16 @@ def build_parser():
             "Set to an empty string to skip. Defaults to mock,rpm-build."
         ),
     )
+    koji.add_argument(
+        "--vm-golden-image",
+        default=os.environ.get("GUANFU_VM_GOLDEN_IMAGE", "cache"),
+        choices=("cache", "none"),
+        help=(
+            "cache installs --vm-prepare-packages once into a read-only golden qcow2 under "
+            "vm-cache/golden/, keyed by base image sha256, package set and VM profile, and "
+            "backs every run overlay with it. none installs the packages into each overlay."
+        ),
+    )
     koji.add_argument(
         "--vm-virt-copy-in-binary",
         default=os.environ.get("GUANFU_VIRT_COPY_IN_BINARY"),
@@ -188,6 +309,69 @@ def build_parser():
         default="/mnt/guanfu-work",
         help="Path where the GuanFu run directory is mounted inside the VM.",
     )
+    koji.add_argument(
+        "--vm-pool-size",
+        type=int,
+        default=int(os.environ.get("GUANFU_VM_POOL_SIZE", "1")),
+        help=(
+            "Number of booted guests kept warm for --rpm-list. Guests run a job agent over "
+            "virtio-serial and need --vm-share-mode virtiofs or 9p. 0 boots one VM per RPM."
+        ),
+    )
+    koji.add_argument(
+        "--vm-guest-jobs",
+        type=int,
+        default=int(os.environ.get("GUANFU_VM_GUEST_JOBS", "1")),
+        help=(
+            "Concurrent --rpm-list rebuilds per pool guest. Each runs its own mock root (--uniqueext) "
+            "while sharing the buildroot's root cache. 0 uses one job per guest vCPU (--vm-smp)."
+        ),
+    )
+    koji.add_argument(
+        "--vm-pool-recycle-after",
+        type=int,
+        default=int(os.environ.get("GUANFU_VM_POOL_RECYCLE_AFTER", "10")),
+        help="Replace a pool guest with a fresh overlay after this many jobs; failed jobs always recycle it.",
+    )
+    koji.add_argument(
+        "--vm-snapshot",
+        default=os.environ.get("GUANFU_VM_SNAPSHOT", "none"),
+        choices=("none", "ready"),
+        help=(
+            "ready saves the guest once it has booted to the idle job agent (RAM and device state plus "
+            "its disk, under vm-cache/snapshots/) and restores later guests from it instead of booting. "
+            "Keyed by image, VM profile, QEMU version and -smp/-m; needs a qcow2 image and 9p sharing."
+        ),
+    )
+    koji.add_argument(
+        "--vm-fanout",
+        type=int,
+        default=int(os.environ.get("GUANFU_VM_FANOUT", "1")),
+        help=(
+            "With --vm-pool-size 0, rebuild up to this many --rpm-list packages at once, each in its own "
+            "VM. VMs are only started while the host has free cores, memory and scratch disk for them; "
+            "the rest queue. 0 leaves the limit to the host resources alone."
+        ),
+    )
+    koji.add_argument(
+        "--vm-sizing",
+        default=os.environ.get("GUANFU_VM_SIZING", "fixed"),
+        choices=("fixed", "koji", "cost"),
+        help=(
+            "VM size for each rebuild: fixed uses --vm-smp/--vm-memory, koji copies the CPU count and "
+            "memory of the Koji builder from hw_info.log, cost sizes by SRPM size. koji falls back to cost "
+            "when hw_info.log is missing. Pool guests always use the fixed size."
+        ),
+    )
+    koji.add_argument(
+        "--vm-pin-cpus",
+        action="store_true",
+        default=os.environ.get("GUANFU_VM_PIN_CPUS", "").lower() in ("1", "true", "yes", "on"),
+        help=(
+            "Pin each batch VM to its reserved host CPUs, preferring a single NUMA node "
+            "(numactl --physcpubind/--membind, or taskset)."
+        ),
+    )
     koji.add_argument(
         "--vm-require-kvm",
         action="store_true",
@@ -217,6 +401,38 @@ def build_parser():
     )
     koji.set_defaults(func=run_koji_rpm_rebuild)
 
+    assess = subparsers.add_parser(
+        "assess",
+        help="Re-run the assessment of stored koji-rpm run directories",
+        description=(
+            "Recompute the assessment sections of report.json for existing run directories "
+            "from their stored inputs/ and results/result-run-1/ RPMs, without rebuilding. "
+            "Runs whose RPM digests and assessment policy are unchanged are skipped."
+        ),
+    )
+    assess.add_argument(
+        "paths",
+        nargs="+",
+        help="Run directories, or workdirs searched recursively for report.json",
+    )
+    assess.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("GUANFU_ASSESS_WORKERS", "4")),
+        help="Number of processes assessing run directories in parallel.",
+    )
+    assess.add_argument(
+        "--assessment-policy",
+        default=os.environ.get("GUANFU_ASSESSMENT_POLICY"),
+        help="JSON policy file used to classify file differences (default: built-in policy).",
+    )
+    assess.add_argument(
+        "--force",
+        action="store_true",
+        help="Reassess every run even if its fingerprint is unchanged.",
+    )
+    assess.set_defaults(func=run_assess)
+
     return parser
 
 
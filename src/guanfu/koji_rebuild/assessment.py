@@ -1,7 +1,11 @@
+from guanfu.koji_rebuild.policy import RISK_LEVELS, default_policy
+
+
 MAX_AFFECTED_FILES = 20
-ASSESSMENT_VERSION = "1.0.0"
+# Bump whenever the same inputs can produce a different assessment, so that
+# `guanfu assess` re-evaluates runs made by an older engine.
+ASSESSMENT_VERSION = "1.1.0"
 
-RISK_LEVELS = ["none", "low", "medium", "high", "critical"]
 RISK_VALUES = dict((level, index) for index, level in enumerate(RISK_LEVELS))
 
 HEADER_SIGNATURE_FIELDS = set(["RSAHEADER", "SIGPGP", "SIGGPG", "DSAHEADER"])
@@ -16,56 +20,17 @@ HEADER_METADATA_FIELDS = set([
 HEADER_COMPRESSION_FIELDS = set(["PAYLOADCOMPRESSOR", "PAYLOADFLAGS"])
 HEADER_IDENTITY_FIELDS = set(["NVRA", "SOURCERPM", "SIZE"])
 
-UNSUPPORTED_PRECISE_TYPES = ["BINARY_CODE", "BINARY_BUILDID"]
-
-SENSITIVE_PATH_PREFIXES = (
-    "/bin/",
-    "/sbin/",
-    "/usr/bin/",
-    "/usr/sbin/",
-    "/usr/lib/systemd/",
-    "/usr/lib64/systemd/",
-    "/etc/systemd/",
-    "/etc/cron",
-    "/etc/pam.d/",
-)
-HIGHLY_SENSITIVE_PATHS = (
-    "/etc/ld.so.preload",
-    "/etc/profile",
-    "/etc/sudoers",
-)
-
-DOC_PATH_PREFIXES = (
-    "/usr/share/doc/",
-    "/usr/share/info/",
-    "/usr/share/licenses/",
-    "/usr/share/man/",
-)
-DEBUG_PATH_PREFIXES = (
-    "/usr/lib/debug/",
-    "/usr/lib64/debug/",
-)
-SCRIPT_EXTENSIONS = (
-    ".bash",
-    ".csh",
-    ".fish",
-    ".ksh",
-    ".lua",
-    ".pl",
-    ".py",
-    ".rb",
-    ".sh",
-    ".zsh",
+# Analyses a comparison can run; the report marks which ones actually ran to
+# completion for this package.
+ANALYSIS_CAPABILITIES = (
+    "rpm_header",
+    "rpm_file_manifest",
+    "rpm_scriptlet",
+    "path_based_classification",
+    "elf_section_compare",
+    "elf_buildid_compare",
+    "payload_decompression_compare",
 )
-COMPRESSED_EXTENSIONS = (
-    ".bz2",
-    ".gz",
-    ".lzma",
-    ".xz",
-    ".zst",
-    ".zip",
-)
-
 
 def _risk_at_least(left, right):
     if RISK_VALUES[left] >= RISK_VALUES[right]:
@@ -132,45 +97,63 @@ def _affected_count(item):
     return item.get("affected_file_count", 1)
 
 
-def _is_buildid_path(path):
-    return "/.build-id/" in path or path.endswith("/.build-id")
+class _PathClassifier:
+    # Looks up each path's policy categories once per assessment.
+    def __init__(self, policy):
+        self.policy = policy
+        self._cache = {}
+
+    def categories(self, path):
+        categories = self._cache.get(path)
+        if categories is None:
+            categories = self._cache[path] = self.policy.categories(path)
+        return categories
+
+    def risk(self, paths, default_risk="medium"):
+        risk = default_risk
+        for path in paths:
+            for category in self.categories(path):
+                if category in self.policy.risks:
+                    risk = _risk_at_least(self.policy.risks[category], risk)
+        return risk
+
+    def security_relevant(self, paths):
+        return any(self.categories(path) & self.policy.security_relevant for path in paths)
+
+    def content_diff_type(self, path):
+        categories = self.categories(path)
+        for category, diff_type in self.policy.diff_types:
+            if category in categories:
+                return category, diff_type
+        return None
+
 
+def _is_buildid_path(categories):
+    return "buildid" in categories
 
-def _is_doc_path(path, item=None):
+
+def _is_doc_path(categories, item=None):
     if item and item.get("isdoc") == "1":
         return True
-    return path.startswith(DOC_PATH_PREFIXES)
+    return "doc" in categories
 
 
-def _is_config_path(path, item=None):
+def _is_config_path(categories, item=None):
     if item and item.get("isconfig") == "1":
         return True
-    return path.startswith("/etc/")
-
+    return "config" in categories
 
-def _is_debug_path(path):
-    return (
-        path.startswith(DEBUG_PATH_PREFIXES)
-        or "/.debug/" in path
-        or path.endswith(".debug")
-        or ".gnu_debug" in path
-    )
 
+def _is_debug_path(categories):
+    return "debug" in categories
 
-def _is_script_path(path):
-    return (
-        path.endswith(SCRIPT_EXTENSIONS)
-        or path.startswith("/etc/init.d/")
-        or path.startswith("/etc/profile.d/")
-    )
 
+def _is_script_path(categories):
+    return "script" in categories
 
-def _is_compressed_path(path):
-    return path.endswith(COMPRESSED_EXTENSIONS)
 
-
-def _is_sensitive_path(path):
-    return path.startswith(SENSITIVE_PATH_PREFIXES) or path in HIGHLY_SENSITIVE_PATHS
+def _is_compressed_path(categories):
+    return "compressed" in categories
 
 
 def _mode_int(value):
@@ -188,56 +171,47 @@ def _has_special_exec_bit(item):
     return bool(_mode_int(item.get("mode")) & 0o6000)
 
 
-def _is_binary_candidate(path, published, rebuilt):
-    if _is_doc_path(path, published) or _is_doc_path(path, rebuilt):
+def _is_binary_candidate(categories, published, rebuilt):
+    if _is_doc_path(categories, published) or _is_doc_path(categories, rebuilt):
         return False
-    if _is_config_path(path, published) or _is_config_path(path, rebuilt):
+    if _is_config_path(categories, published) or _is_config_path(categories, rebuilt):
         return False
-    if _is_debug_path(path) or _is_script_path(path):
+    if _is_debug_path(categories) or _is_script_path(categories):
         return False
     if _has_exec_bit(published) or _has_exec_bit(rebuilt):
         return True
-    library_prefixes = ("/lib/", "/lib64/", "/usr/lib/", "/usr/lib64/")
-    return path.startswith(library_prefixes) and (
-        ".so" in path or path.endswith((".a", ".o"))
-    )
+    return "library_dir" in categories and "library_file" in categories
 
 
-def _path_risk(paths, default_risk="medium"):
-    risk = default_risk
-    for path in paths:
-        if path in HIGHLY_SENSITIVE_PATHS:
-            risk = _risk_at_least("critical", risk)
-        elif _is_sensitive_path(path):
-            risk = _risk_at_least("high", risk)
-    return risk
-
-
-def _paths_security_relevant(paths):
-    return any(_is_sensitive_path(path) for path in paths)
-
-
-def _permission_risk(entries):
+def _permission_risk(entries, classifier):
     risk = "low"
     for entry in entries:
         if _has_special_exec_bit(entry["rebuilt"]) and not _has_special_exec_bit(entry["published"]):
             return "critical"
         if _has_special_exec_bit(entry["published"]) or _has_special_exec_bit(entry["rebuilt"]):
             risk = _risk_at_least("high", risk)
-        elif _is_sensitive_path(entry["path"]):
+        elif classifier.security_relevant([entry["path"]]):
             risk = _risk_at_least("medium", risk)
     return risk
 
 
-def _permission_security_relevant(entries):
+def _permission_security_relevant(entries, classifier):
     for entry in entries:
         if _has_special_exec_bit(entry["published"]) or _has_special_exec_bit(entry["rebuilt"]):
             return True
-        if _is_sensitive_path(entry["path"]):
+        if classifier.security_relevant([entry["path"]]):
             return True
     return False
 
 
+def _classify_digest_mismatch(fields):
+    # Both headers record the same digest but the bytes hash differently, so
+    # at least one package does not match its own header.
+    if not fields:
+        return []
+    return [_new_diff_item("OTHER", "critical", fields=fields, security_relevant=True)]
+
+
 def _classify_header_differences(header_diff):
     if not header_diff or not header_diff.get("different"):
         return []
@@ -294,7 +268,7 @@ def _classify_header_differences(header_diff):
     return items
 
 
-def _classify_file_differences(files_diff, file_analysis):
+def _classify_file_differences(files_diff, file_analysis, elf_analysis=None, policy=None):
     if not files_diff or files_diff.get("status") != "compared":
         return [_new_diff_item(
             "OTHER",
@@ -306,12 +280,14 @@ def _classify_file_differences(files_diff, file_analysis):
         return []
 
     items = []
+    classifier = _PathClassifier(policy or default_policy())
+    categories = classifier.categories
     only_in_published = file_analysis["only_in_published"]
     only_in_rebuilt = file_analysis["only_in_rebuilt"]
-    buildid_added = [path for path in only_in_rebuilt if _is_buildid_path(path)]
-    buildid_removed = [path for path in only_in_published if _is_buildid_path(path)]
-    added = [path for path in only_in_rebuilt if not _is_buildid_path(path)]
-    removed = [path for path in only_in_published if not _is_buildid_path(path)]
+    buildid_added = [path for path in only_in_rebuilt if _is_buildid_path(categories(path))]
+    buildid_removed = [path for path in only_in_published if _is_buildid_path(categories(path))]
+    added = [path for path in only_in_rebuilt if not _is_buildid_path(categories(path))]
+    removed = [path for path in only_in_published if not _is_buildid_path(categories(path))]
 
     if buildid_added or buildid_removed:
         items.append(_new_diff_item(
@@ -323,18 +299,18 @@ def _classify_file_differences(files_diff, file_analysis):
     if added:
         items.append(_new_diff_item(
             "FILE_ADDED",
-            _path_risk(added, "medium"),
+            classifier.risk(added, "medium"),
             affected_files=added,
             unexpected=True,
-            security_relevant=_paths_security_relevant(added),
+            security_relevant=classifier.security_relevant(added),
         ))
     if removed:
         items.append(_new_diff_item(
             "FILE_REMOVED",
-            _path_risk(removed, "medium"),
+            classifier.risk(removed, "medium"),
             affected_files=removed,
             unexpected=True,
-            security_relevant=_paths_security_relevant(removed),
+            security_relevant=classifier.security_relevant(removed),
         ))
 
     mtime_only = []
@@ -349,6 +325,7 @@ def _classify_file_differences(files_diff, file_analysis):
     binary_candidates = []
     other_content = []
     other_metadata = []
+    policy_content = {}
 
     for entry in file_analysis["changed"]:
         path = entry["path"]
@@ -360,8 +337,9 @@ def _classify_file_differences(files_diff, file_analysis):
             mtime_only.append(path)
             continue
 
+        path_categories = categories(path)
         if "linkto" in fields:
-            if _is_buildid_path(path):
+            if _is_buildid_path(path_categories):
                 buildid_symlink_paths.append(path)
             else:
                 symlink_paths.append(path)
@@ -370,19 +348,22 @@ def _classify_file_differences(files_diff, file_analysis):
             permission_entries.append(entry)
 
         if fields & set(["digest", "size"]):
-            if _is_buildid_path(path):
+            policy_type = classifier.content_diff_type(path)
+            if policy_type:
+                policy_content.setdefault(policy_type, []).append(path)
+            elif _is_buildid_path(path_categories):
                 buildid_symlink_paths.append(path)
-            elif _is_debug_path(path):
+            elif _is_debug_path(path_categories):
                 debug_content.append(path)
-            elif _is_compressed_path(path) and _is_doc_path(path, published):
+            elif _is_compressed_path(path_categories) and _is_doc_path(path_categories, published):
                 compressed_content.append(path)
-            elif _is_doc_path(path, published):
+            elif _is_doc_path(path_categories, published):
                 doc_content.append(path)
-            elif _is_config_path(path, published):
+            elif _is_config_path(path_categories, published):
                 config_content.append(path)
-            elif _is_script_path(path):
+            elif _is_script_path(path_categories):
                 script_content.append(path)
-            elif _is_binary_candidate(path, published, rebuilt):
+            elif _is_binary_candidate(path_categories, published, rebuilt):
                 binary_candidates.append(path)
             else:
                 other_content.append(path)
@@ -391,6 +372,24 @@ def _classify_file_differences(files_diff, file_analysis):
         if metadata_only:
             other_metadata.append(path)
 
+    # Section-level ELF analysis settles differences that path rules cannot.
+    elf_analysis = elf_analysis or {}
+    elf_buildid = []
+    elf_code = []
+    unanalyzed = set()
+    for path in binary_candidates + other_content:
+        classification = elf_analysis.get(path, {}).get("classification")
+        if classification == "buildid":
+            elf_buildid.append(path)
+        elif classification == "debug":
+            debug_content.append(path)
+        elif classification == "code":
+            elf_code.append(path)
+        else:
+            unanalyzed.add(path)
+    binary_candidates = [path for path in binary_candidates if path in unanalyzed]
+    other_content = [path for path in other_content if path in unanalyzed]
+
     if mtime_only:
         items.append(_new_diff_item(
             "FILE_TIMESTAMP",
@@ -401,10 +400,10 @@ def _classify_file_differences(files_diff, file_analysis):
     if permission_entries:
         items.append(_new_diff_item(
             "FILE_PERMISSION",
-            _permission_risk(permission_entries),
+            _permission_risk(permission_entries, classifier),
             affected_files=[entry["path"] for entry in permission_entries],
             unexpected=True,
-            security_relevant=_permission_security_relevant(permission_entries),
+            security_relevant=_permission_security_relevant(permission_entries, classifier),
         ))
     if buildid_symlink_paths:
         items.append(_new_diff_item(
@@ -416,11 +415,11 @@ def _classify_file_differences(files_diff, file_analysis):
     if symlink_paths:
         items.append(_new_diff_item(
             "SYMLINK_TARGET",
-            _path_risk(symlink_paths, "low"),
+            classifier.risk(symlink_paths, "low"),
             affected_files=symlink_paths,
-            explained=not _paths_security_relevant(symlink_paths),
-            unexpected=_paths_security_relevant(symlink_paths),
-            security_relevant=_paths_security_relevant(symlink_paths),
+            explained=not classifier.security_relevant(symlink_paths),
+            unexpected=classifier.security_relevant(symlink_paths),
+            security_relevant=classifier.security_relevant(symlink_paths),
         ))
     if compressed_content:
         items.append(_new_diff_item(
@@ -431,6 +430,16 @@ def _classify_file_differences(files_diff, file_analysis):
             unexpected=True,
             needs_deep_analysis=True,
         ))
+    for (_, diff_type), paths in sorted(policy_content.items()):
+        # Site policy routed these paths; their category vouches for the change.
+        items.append(_new_diff_item(
+            diff_type,
+            classifier.risk(paths, "low"),
+            affected_files=paths,
+            explained=not classifier.security_relevant(paths),
+            unexpected=classifier.security_relevant(paths),
+            security_relevant=classifier.security_relevant(paths),
+        ))
     if doc_content:
         items.append(_new_diff_item(
             "DOC_CONTENT",
@@ -441,15 +450,15 @@ def _classify_file_differences(files_diff, file_analysis):
     if config_content:
         items.append(_new_diff_item(
             "CONFIG_CONTENT",
-            _path_risk(config_content, "low"),
+            classifier.risk(config_content, "low"),
             affected_files=config_content,
             unexpected=True,
-            security_relevant=_paths_security_relevant(config_content),
+            security_relevant=classifier.security_relevant(config_content),
         ))
     if script_content:
         items.append(_new_diff_item(
             "SCRIPT_CONTENT",
-            _path_risk(script_content, "medium"),
+            classifier.risk(script_content, "medium"),
             affected_files=script_content,
             security_relevant=True,
         ))
@@ -460,6 +469,21 @@ def _classify_file_differences(files_diff, file_analysis):
             affected_files=debug_content,
             explained=True,
         ))
+    if elf_buildid:
+        items.append(_new_diff_item(
+            "BINARY_BUILDID",
+            "none",
+            affected_files=elf_buildid,
+            expected_environment=True,
+        ))
+    if elf_code:
+        items.append(_new_diff_item(
+            "BINARY_CODE",
+            classifier.risk(elf_code, "medium"),
+            affected_files=elf_code,
+            unexpected=True,
+            security_relevant=classifier.security_relevant(elf_code),
+        ))
     if binary_candidates:
         items.append(_new_diff_item(
             "OTHER",
@@ -598,16 +622,17 @@ def _build_overall_assessment(rpm_file_sha256_equal, items):
     }
 
 
-def _analysis_capabilities():
-    return {
-        "rpm_header": True,
-        "rpm_file_manifest": True,
-        "rpm_scriptlet": True,
-        "path_based_classification": True,
-        "elf_section_compare": False,
-        "elf_buildid_compare": False,
-        "payload_decompression_compare": False,
-    }
+def analysis_capabilities(performed=()):
+    return dict((name, name in performed) for name in ANALYSIS_CAPABILITIES)
+
+
+def _unsupported_precise_types(items):
+    # Diff types this run could only guess at, e.g. ELF files whose sections
+    # were never compared.
+    types = set()
+    for item in items:
+        types.update(item.get("possible_diff_types") or [])
+    return sorted(types)
 
 
 def build_light_assessment(
@@ -618,11 +643,17 @@ def build_light_assessment(
     requires_equal,
     provides_equal,
     scripts_equal,
+    elf_analysis=None,
+    policy=None,
+    digest_mismatch_fields=None,
+    performed=(),
 ):
+    policy = policy or default_policy()
     internal_items = []
     if not rpm_file_sha256_equal:
+        internal_items.extend(_classify_digest_mismatch(digest_mismatch_fields))
         internal_items.extend(_classify_header_differences(header_diff))
-        internal_items.extend(_classify_file_differences(files_diff, file_analysis))
+        internal_items.extend(_classify_file_differences(files_diff, file_analysis, elf_analysis, policy))
         internal_items.extend(_classify_dependency_and_scriptlet_differences(
             requires_equal,
             provides_equal,
@@ -632,8 +663,9 @@ def build_light_assessment(
     return {
         "analysis": {
             "mode": "light",
-            "capabilities": _analysis_capabilities(),
-            "unsupported_precise_types": UNSUPPORTED_PRECISE_TYPES,
+            "capabilities": analysis_capabilities(performed),
+            "unsupported_precise_types": _unsupported_precise_types(internal_items),
+            "policy": policy.summary(),
         },
         "overall_assessment": _build_overall_assessment(
             rpm_file_sha256_equal,
@@ -642,3 +674,44 @@ def build_light_assessment(
         "diff_items": _public_diff_items(internal_items),
         "summary_stats": _summarize_diff_items(internal_items),
     }
+
+
+TRUST_LEVELS = ["L0", "L1", "L2", "L3", "L4"]
+# Highest build-level trust while some rebuilt package had no published
+# counterpart: it was never checked, so the build needs a review.
+MISSING_PUBLISHED_TRUST_CAP = "L1"
+
+
+def build_level_assessment(packages):
+    compared = [item for item in packages if item.get("status") == "compared"]
+    assessments = [item["overall_assessment"] for item in compared]
+    counts = {
+        "total": len(packages),
+        "compared": len(compared),
+        "reproducible": len([item for item in assessments if item.get("reproducible")]),
+        "missing_published": len([item for item in packages if item.get("status") == "missing_published"]),
+        "errors": len([item for item in packages if item.get("status") == "error"]),
+    }
+    if not assessments:
+        return {
+            "risk_level": "critical",
+            "action": "reject",
+            "reproducible": False,
+            "confidence": 0.5,
+            "trust_level": "L0",
+            "packages": counts,
+        }
+
+    trust_level = min((item["trust_level"] for item in assessments), key=TRUST_LEVELS.index)
+    if counts["missing_published"]:
+        trust_level = min(trust_level, MISSING_PUBLISHED_TRUST_CAP, key=TRUST_LEVELS.index)
+    if counts["errors"]:
+        trust_level = "L0"
+    return {
+        "risk_level": _highest_risk(assessments),
+        "action": _action_for_trust_level(trust_level),
+        "reproducible": counts["reproducible"] == counts["total"],
+        "confidence": min(item["confidence"] for item in assessments),
+        "trust_level": trust_level,
+        "packages": counts,
+    }
@@ -1,34 +1,150 @@
+import threading
 import xmlrpc.client
 
+from guanfu.koji_rebuild.metadata_cache import MISSING
+
+
+DEFAULT_MULTICALL_BATCH_SIZE = 100
+
 
 class KojiClient:
-    def __init__(self, server_url):
+    def __init__(self, server_url, multicall_batch_size=DEFAULT_MULTICALL_BATCH_SIZE, cache=None):
         self.server_url = server_url
-        self.session = xmlrpc.client.ServerProxy(server_url, allow_none=True)
+        self.multicall_batch_size = multicall_batch_size
+        self.cache = cache
+        self._local = threading.local()
+        self._shared_session = None
+
+    @property
+    def session(self):
+        # ServerProxy reuses one HTTP connection and is not thread-safe, so
+        # every thread talks to the hub through its own proxy.
+        if self._shared_session is not None:
+            return self._shared_session
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = xmlrpc.client.ServerProxy(self.server_url, allow_none=True)
+            self._local.session = session
+        return session
+
+    @session.setter
+    def session(self, session):
+        self._shared_session = session
 
     def get_rpm(self, rpm_info):
-        return self.session.getRPM(rpm_info, True, False)
+        return self._call("getRPM", (rpm_info, True, False))
 
     def get_rpm_optional(self, rpm_info):
-        return self.session.getRPM(rpm_info, False, False)
+        return self._call("getRPM", (rpm_info, False, False))
 
     def get_external_repo_list(self, tag_info, event=None):
-        return self.session.getExternalRepoList(tag_info, event)
+        return self._call("getExternalRepoList", (tag_info, event))
 
     def get_build(self, build_id):
-        return self.session.getBuild(build_id, True)
+        return self._call("getBuild", (build_id, True))
 
     def get_buildroot(self, buildroot_id):
-        return self.session.getBuildroot(buildroot_id, True)
+        return self._call("getBuildroot", (buildroot_id, True))
 
     def get_task_children(self, task_id):
-        return self.session.getTaskChildren(task_id)
+        return self._call("getTaskChildren", (task_id,))
 
     def get_task_result(self, task_id):
-        return self.session.getTaskResult(task_id, False)
+        return self._call("getTaskResult", (task_id, False))
 
     def list_task_output(self, task_id):
-        return self.session.listTaskOutput(task_id, True)
+        return self._call("listTaskOutput", (task_id, True))
 
     def download_task_output(self, task_id, filename, offset, size):
         return self.session.downloadTaskOutput(task_id, filename, offset, size)
+
+    def multicall(self, calls):
+        # Returns one (result, error) pair per (method, params) call, in order.
+        calls = list(calls)
+        results = [None] * len(calls)
+        pending = []
+        for index, (method, params) in enumerate(calls):
+            cached = self._cache_lookup(method, params)
+            if cached is not MISSING:
+                results[index] = (cached, None)
+            else:
+                pending.append(index)
+
+        batch_size = self.multicall_batch_size or 0
+        if batch_size <= 1:
+            for index in pending:
+                results[index] = self._single_call(*calls[index])
+        else:
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start : start + batch_size]
+                payload = [
+                    {"methodName": calls[index][0], "params": list(calls[index][1])}
+                    for index in batch
+                ]
+                batch_results = list(self.session.system.multicall(payload))
+                if len(batch_results) > len(batch):
+                    raise RuntimeError(
+                        "Koji multicall returned %d results for %d calls" % (len(batch_results), len(batch))
+                    )
+                for index, item in zip(batch, batch_results):
+                    results[index] = _multicall_item(item)
+                # A truncated response must not leave holes; ask for the rest one by one.
+                for index in batch[len(batch_results) :]:
+                    results[index] = self._single_call(*calls[index])
+
+        for index in pending:
+            value, error = results[index]
+            if error is None:
+                self._cache_store(calls[index][0], calls[index][1], value)
+        return results
+
+    def get_rpms_optional(self, rpm_infos):
+        return self.multicall(("getRPM", (rpm_info, False, False)) for rpm_info in rpm_infos)
+
+    def get_builds(self, build_ids):
+        return self.multicall(("getBuild", (build_id, True)) for build_id in build_ids)
+
+    def get_tasks_children(self, task_ids):
+        return self.multicall(("getTaskChildren", (task_id,)) for task_id in task_ids)
+
+    def get_task_results(self, task_ids):
+        return self.multicall(("getTaskResult", (task_id, False)) for task_id in task_ids)
+
+    def list_tasks_output(self, task_ids):
+        return self.multicall(("listTaskOutput", (task_id, True)) for task_id in task_ids)
+
+    def cache_summary(self):
+        if self.cache is None:
+            return None
+        return self.cache.summary()
+
+    def _call(self, method, params):
+        cached = self._cache_lookup(method, params)
+        if cached is not MISSING:
+            return cached
+        value = getattr(self.session, method)(*params)
+        self._cache_store(method, params, value)
+        return value
+
+    def _single_call(self, method, params):
+        try:
+            return getattr(self.session, method)(*params), None
+        except Exception as exc:
+            return None, exc
+
+    def _cache_lookup(self, method, params):
+        if self.cache is None:
+            return MISSING
+        return self.cache.lookup(self.server_url, method, params)
+
+    def _cache_store(self, method, params, value):
+        if self.cache is not None:
+            self.cache.store(self.server_url, method, params, value)
+
+
+def _multicall_item(item):
+    if isinstance(item, dict):
+        return None, xmlrpc.client.Fault(item.get("faultCode"), item.get("faultString"))
+    if isinstance(item, (list, tuple)) and len(item) == 1:
+        return item[0], None
+    return None, RuntimeError("unexpected multicall result: %r" % (item,))
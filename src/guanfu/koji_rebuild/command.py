@@ -1,12 +1,16 @@
+import copy
+import os
 import re
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from guanfu.koji_rebuild.assessment import ASSESSMENT_VERSION
-from guanfu.koji_rebuild.client import KojiClient
-from guanfu.koji_rebuild.compare import compare_published_and_rebuilt, compare_srpms
+from guanfu.koji_rebuild.artifact_store import ArtifactStore
+from guanfu.koji_rebuild.assessment import ASSESSMENT_VERSION, analysis_capabilities
+from guanfu.koji_rebuild.client import DEFAULT_MULTICALL_BATCH_SIZE, KojiClient
+from guanfu.koji_rebuild.compare import compare_build, compare_published_and_rebuilt, compare_srpms
 from guanfu.koji_rebuild.vm_executor import (
     detect_target_os,
     is_supported_target_os,
@@ -15,20 +19,30 @@ from guanfu.koji_rebuild.vm_executor import (
     vm_executor_summary,
 )
 from guanfu.koji_rebuild.downloader import (
-    download_task_output,
+    download_koji_file,
     join_url,
+    koji_build_url,
+    koji_task_output_url,
     summarize_file,
     try_download_url,
 )
+from guanfu.koji_rebuild.manifest import MANIFEST_DIFF_NAME
+from guanfu.koji_rebuild.metadata_cache import KojiMetadataCache
 from guanfu.koji_rebuild.mock_config import generate_mock_config, probe_repodata
 from guanfu.koji_rebuild.mock_runner import run_rebuild
+from guanfu.koji_rebuild.policy import load_policy
+from guanfu.koji_rebuild.reassess import assessment_fingerprint
 from guanfu.koji_rebuild.report import write_json
 from guanfu.koji_rebuild.repo_fallback import (
+    open_published_repo_index,
     prepare_installed_pkgs_fallback,
+    published_package_url,
     summarize_fallback_report,
 )
 from guanfu.koji_rebuild.resolver import resolve_koji_build
 from guanfu.koji_rebuild.rpm_name import parse_rpm_filename, rpm_filename
+from guanfu.koji_rebuild.vm_pool import DEFAULT_POOL_SIZE, DEFAULT_RECYCLE_AFTER, VmPool
+from guanfu.koji_rebuild.vm_scheduler import VmScheduler, detect_host_capacity
 
 
 def _safe_name(name):
@@ -50,22 +64,217 @@ def _run_dir(workdir, rpm_name):
     return path
 
 
-def _download_koji_logs(client, task_id, outputs, inputs_dir):
-    downloads = []
-    for log_name in ("build.log", "root.log", "installed_pkgs.log", "mock_output.log", "hw_info.log", "state.log"):
-        if log_name in outputs:
-            path = download_task_output(client, task_id, log_name, inputs_dir / log_name)
-            downloads.append(summarize_file(path, label="koji_task_log"))
-    return downloads
+def _task_output_size(outputs, filename):
+    if isinstance(outputs, dict):
+        return (outputs.get(filename) or {}).get("st_size")
+    return None
+
+
+def _koji_output_urls(koji_topurl, resolution, filename, build_subdir=None):
+    if not koji_topurl:
+        return []
+    task_id = resolution.buildarch_task["id"]
+    urls = [koji_task_output_url(koji_topurl, task_id, filename)]
+    if build_subdir:
+        urls.append(koji_build_url(koji_topurl, resolution.build, *(build_subdir + (filename,))))
+    return urls
+
+
+def _download_koji_output(
+    client, resolution, filename, dest, label, koji_topurl=None, build_subdir=None, store=None
+):
+    path, transfer = download_koji_file(
+        client,
+        resolution.buildarch_task["id"],
+        filename,
+        dest,
+        urls=_koji_output_urls(koji_topurl, resolution, filename, build_subdir),
+        expected_size=_task_output_size(resolution.outputs, filename),
+        store=store,
+    )
+    summary = summarize_file(path, label=label, url=transfer.get("url"))
+    summary["transport"] = transfer["transport"]
+    return path, summary
+
+
+def _download_topurl(args):
+    if getattr(args, "koji_download_transport", "auto") == "xmlrpc":
+        return None
+    return args.koji_topurl
+
+
+DEFAULT_COMPARE_WORKERS = 4
+KOJI_LOG_NAMES = ("build.log", "root.log", "installed_pkgs.log", "mock_output.log", "hw_info.log", "state.log")
+DEFAULT_INPUT_WORKERS = 4
+DEFAULT_VM_FANOUT = 1
 
 
-def _download_task_srpm(client, task_id, srpm_name, inputs_dir):
-    path = download_task_output(client, task_id, srpm_name, inputs_dir / f"koji-task-{srpm_name}")
-    return path, summarize_file(path, label="koji_task_srpm")
+def _koji_log_names(resolution):
+    return [log_name for log_name in KOJI_LOG_NAMES if log_name in resolution.outputs]
+
+
+def _download_koji_log(client, resolution, inputs_dir, log_name, koji_topurl=None, store=None):
+    _, summary = _download_koji_output(
+        client,
+        resolution,
+        log_name,
+        inputs_dir / log_name,
+        "koji_task_log",
+        koji_topurl=koji_topurl,
+        build_subdir=("data", "logs", resolution.buildarch_task.get("arch") or resolution.buildroot["arch"]),
+        store=store,
+    )
+    return summary
+
+
+def _run_acquisition_stage(tasks, workers=DEFAULT_INPUT_WORKERS):
+    # Runs independent (name, callable) input steps on a bounded thread pool.
+    # Returns {name: (value, error)} plus a timing summary in task order.
+    def run(name, func):
+        started = time.monotonic()
+        try:
+            value, error = func(), None
+        except Exception as exc:
+            value, error = None, exc
+        return value, error, round(time.monotonic() - started, 3)
+
+    started = time.monotonic()
+    results = {}
+    items = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [(name, pool.submit(run, name, func)) for name, func in tasks]
+        for name, future in futures:
+            value, error, seconds = future.result()
+            results[name] = (value, error)
+            items.append(
+                _without_none(
+                    {
+                        "name": name,
+                        "status": "error" if error else "ok",
+                        "seconds": seconds,
+                        "error": repr(error) if error else None,
+                    }
+                )
+            )
+    summary = {
+        "workers": max(1, workers),
+        "wall_seconds": round(time.monotonic() - started, 3),
+        "items": items,
+    }
+    return results, summary
 
 
-def _download_published(url, dest, label):
-    path, error = try_download_url(url, dest)
+def _acquired(results, name):
+    value, error = results[name]
+    if error is not None:
+        raise error
+    return value
+
+
+def _compare_build_outputs(
+    args,
+    result_rpms,
+    target_rpm_name,
+    target_comparison,
+    inputs_dir,
+    metadata_dir,
+    store=None,
+    policy=None,
+):
+    repo_index, repo_summary = open_published_repo_index(
+        args.binary_rpm_base_url,
+        metadata_dir,
+        _cache_dir(args) / "repodata",
+    )
+    debug_base_url = getattr(args, "debug_rpm_base_url", None)
+    debug_index, debug_summary = None, None
+    items = []
+    tasks = []
+    try:
+        if debug_base_url:
+            # debuginfo/debugsource packages are published in a separate repo.
+            debug_index, debug_summary = open_published_repo_index(
+                debug_base_url,
+                metadata_dir,
+                _cache_dir(args) / "repodata",
+                name="debug-repo",
+            )
+        for rebuilt in result_rpms:
+            name = Path(rebuilt).name
+            if name.endswith(".src.rpm"):
+                continue
+            item = {"package_name": name, "rebuilt": str(rebuilt)}
+            items.append(item)
+            if name == target_rpm_name:
+                item["comparison"] = target_comparison
+                continue
+            try:
+                rpm = parse_rpm_filename(name)
+            except ValueError as exc:
+                item["error"] = repr(exc)
+                continue
+            if debug_base_url and _is_debug_package(rpm["name"]):
+                url = published_package_url(debug_index, debug_summary, debug_base_url, rpm)
+            else:
+                url = published_package_url(repo_index, repo_summary, args.binary_rpm_base_url, rpm)
+            item["reference_url"] = url
+            tasks.append(
+                (
+                    name,
+                    lambda url=url, name=name: _download_published(
+                        url, inputs_dir / "published" / name, "published_rpm", store=store
+                    ),
+                )
+            )
+    finally:
+        for index in (repo_index, debug_index):
+            if index is not None:
+                index.close()
+
+    acquired, acquisition = _run_acquisition_stage(tasks, workers=getattr(args, "input_workers", DEFAULT_INPUT_WORKERS))
+    for item in items:
+        if item["package_name"] not in acquired:
+            continue
+        value, error = acquired[item["package_name"]]
+        if error is not None:
+            item["error"] = repr(error)
+        elif value[0]:
+            item["published"] = str(value[0])
+        else:
+            item["error"] = value[1].get("error")
+
+    comparison = compare_build(
+        items,
+        workers=getattr(args, "compare_workers", DEFAULT_COMPARE_WORKERS),
+        policy=policy,
+    )
+    comparison["published_repo"] = repo_summary
+    if debug_summary is not None:
+        comparison["debug_repo"] = debug_summary
+    comparison["acquisition"] = acquisition
+    return comparison
+
+
+def _is_debug_package(name):
+    return name.endswith(("-debuginfo", "-debugsource"))
+
+
+def _download_task_srpm(client, resolution, inputs_dir, koji_topurl=None, store=None):
+    srpm_name = resolution.task_srpm_name
+    return _download_koji_output(
+        client,
+        resolution,
+        srpm_name,
+        inputs_dir / f"koji-task-{srpm_name}",
+        "koji_task_srpm",
+        koji_topurl=koji_topurl,
+        build_subdir=("src",),
+        store=store,
+    )
+
+
+def _download_published(url, dest, label, store=None):
+    path, error = try_download_url(url, dest, store=store)
     if error:
         return None, {"label": label, "url": url, "error": error}
     return path, summarize_file(path, label=label, url=url)
@@ -79,7 +288,7 @@ def _public_artifact(summary, source_type=None, url=None, task_id=None):
     if not summary:
         return None
     artifact = {}
-    for key in ("file", "url", "size", "sha256", "error"):
+    for key in ("file", "url", "size", "sha256", "transport", "error"):
         if key in summary:
             artifact[key] = summary[key]
     if url:
@@ -218,21 +427,47 @@ def _unavailable_assessment(field, confidence=0.9):
 
 
 def _analysis_summary():
+    # Reports without a comparison: no analysis has run.
     return {
         "mode": "light",
-        "capabilities": {
-            "rpm_header": True,
-            "rpm_file_manifest": True,
-            "rpm_scriptlet": True,
-            "path_based_classification": True,
-            "elf_section_compare": False,
-            "elf_buildid_compare": False,
-            "payload_decompression_compare": False,
-        },
-        "unsupported_precise_types": ["BINARY_CODE", "BINARY_BUILDID"],
+        "capabilities": analysis_capabilities(),
+        "unsupported_precise_types": [],
     }
 
 
+def _koji_client(args):
+    cache = None
+    if getattr(args, "koji_cache", "sqlite") == "sqlite":
+        cache = KojiMetadataCache(_cache_dir(args) / "koji-metadata.sqlite3")
+    return KojiClient(
+        args.koji_server,
+        multicall_batch_size=getattr(args, "koji_multicall_batch_size", DEFAULT_MULTICALL_BATCH_SIZE),
+        cache=cache,
+    )
+
+
+def _artifact_store(args):
+    if getattr(args, "artifact_store", "shared") == "none":
+        return None
+    return ArtifactStore(_cache_dir(args) / "artifacts")
+
+
+def _cache_dir(args):
+    return Path(args.workdir).expanduser() / "cache"
+
+
+def _write_report(run_dir, report, client=None, store=None):
+    # The final report of a run: summarize and close the shared caches.
+    cache_summary = client.cache_summary() if client else None
+    if cache_summary:
+        report.setdefault("build_environment", {})["koji_metadata_cache"] = cache_summary
+        client.cache.close()
+    if store is not None:
+        report.setdefault("build_environment", {})["artifact_store"] = store.summary()
+        store.close()
+    return write_json(run_dir / "report.json", report)
+
+
 def _find_report_paths(workdir, rpm_name):
     base = Path(workdir).expanduser().resolve() / _safe_name(Path(rpm_name).name)
     if not base.exists():
@@ -273,6 +508,7 @@ def _input_artifacts_summary(
     source_rpm_url=None,
     task_id=None,
     srpm_cross_check=None,
+    acquisition=None,
 ):
     artifacts = {
         "reference_rpm": _public_artifact(
@@ -295,11 +531,89 @@ def _input_artifacts_summary(
             for item in (log_summaries or [])
         ],
         "source_rpm_cross_check": _srpm_cross_check_summary(srpm_cross_check),
+        "acquisition": acquisition,
     }
     return _without_none(artifacts)
 
 
-def run_koji_rpm_rebuild(args):
+def _read_rpm_list(path):
+    names = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                names.append(line)
+    return names
+
+
+def run_koji_rpm_batch(args):
+    names = _read_rpm_list(args.rpm_list)
+    if not names:
+        print("--rpm-list %s does not name any RPM" % args.rpm_list, file=sys.stderr)
+        return 2
+    pool = None
+    scheduler = None
+    pool_size = getattr(args, "vm_pool_size", DEFAULT_POOL_SIZE)
+    if getattr(args, "executor", "vm") == "vm":
+        # Every VM of the batch, pooled or not, is admitted against the
+        # host's free cores, memory and scratch disk.
+        scheduler = VmScheduler(detect_host_capacity(args.workdir), pin_cpus=getattr(args, "vm_pin_cpus", False))
+    if scheduler is not None and pool_size > 0:
+        pool = VmPool(
+            args,
+            size=pool_size,
+            recycle_after=getattr(args, "vm_pool_recycle_after", DEFAULT_RECYCLE_AFTER),
+            scheduler=scheduler,
+        )
+
+    def rebuild(index, name):
+        item_args = copy.copy(args)
+        item_args.rpm_name = name
+        item_args.rpm_list = None
+        print(f"[guanfu] Rebuilding {name} ({index}/{len(names)})")
+        return run_koji_rpm_rebuild(item_args, vm_pool=pool, vm_scheduler=scheduler)
+
+    # Every pool slot (guests x jobs per guest) takes one package at a time;
+    # without a pool up to --vm-fanout packages each boot their own VM once
+    # the scheduler admits it. Each package still gets its own report.json.
+    # --vm-fanout 0 is bounded by the host CPUs, since every VM takes one.
+    if pool is not None:
+        workers = pool.slots
+    elif getattr(args, "vm_fanout", DEFAULT_VM_FANOUT):
+        workers = min(args.vm_fanout, len(names))
+    else:
+        host_cpus = len(scheduler.capacity["cpus"]) if scheduler is not None else os.cpu_count() or 1
+        workers = min(host_cpus, len(names))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(rebuild, index, name) for index, name in enumerate(names, 1)]
+            results = [(name, future.result()) for name, future in zip(names, futures)]
+    finally:
+        if pool is not None:
+            pool.close()
+
+    for name, exit_code in results:
+        print(f"[guanfu] {name}: exit {exit_code}")
+    if pool is not None:
+        print("[guanfu] VM pool: %s" % ", ".join("%s=%s" % item for item in sorted(pool.summary().items())))
+    if scheduler is not None:
+        print("[guanfu] VM scheduler: %s" % ", ".join("%s=%s" % item for item in sorted(scheduler.summary().items())))
+    return max(exit_code for _name, exit_code in results)
+
+
+def run_koji_rpm_rebuild(args, vm_pool=None, vm_scheduler=None):
+    if getattr(args, "rpm_list", None):
+        return run_koji_rpm_batch(args)
+
+    if vm_pool is None and getattr(args, "executor", "vm") == "vm" and getattr(args, "vm_snapshot", "none") == "ready":
+        # Restoring a ready snapshot goes through the pool guest agent, even
+        # for a single RPM.
+        vm_pool = VmPool(args, size=1)
+        try:
+            return run_koji_rpm_rebuild(args, vm_pool=vm_pool)
+        finally:
+            vm_pool.close()
+
     if args.slsa_provenance:
         print(
             "RPM SLSA provenance input is reserved but not implemented yet. "
@@ -334,9 +648,13 @@ def run_koji_rpm_rebuild(args):
         "analysis": _analysis_summary(),
     }
 
+    client = None
+    store = None
     try:
         rpm_info = parse_rpm_filename(args.rpm_name)
-        client = KojiClient(args.koji_server)
+        policy = load_policy(getattr(args, "assessment_policy", None))
+        client = _koji_client(args)
+        store = _artifact_store(args)
         resolution = resolve_koji_build(client, rpm_info)
         target_rpm_name = rpm_filename(resolution.rpm)
         target_os = detect_target_os(rpm_info, resolution.buildroot)
@@ -362,7 +680,7 @@ def run_koji_rpm_rebuild(args):
                 "analysis": _analysis_summary(),
             }
             report.update(_unavailable_assessment("unsupported_target"))
-            write_json(run_dir / "report.json", report)
+            _write_report(run_dir, report, client, store)
             print(
                 "[guanfu] Unsupported Koji RPM target for VM executor: "
                 f"tag={resolution.buildroot.get('tag_name')!r}",
@@ -376,37 +694,66 @@ def run_koji_rpm_rebuild(args):
         write_json(metadata_dir / "buildarch-task.json", resolution.buildarch_task)
         write_json(metadata_dir / "task-result.json", resolution.task_result)
 
-        repo_probe = probe_repodata(args.koji_topurl, resolution.buildroot)
-        write_json(metadata_dir / "repo-probe.json", repo_probe)
-
         published_rpm_url = join_url(args.binary_rpm_base_url, target_rpm_name)
-        published_rpm, published_rpm_summary = _download_published(
-            published_rpm_url,
-            inputs_dir / target_rpm_name,
-            "published_rpm",
+        published_srpm_url = join_url(args.source_rpm_base_url, resolution.task_srpm_name)
+        download_topurl = _download_topurl(args)
+        mock_cfg = inputs_dir / "mock.cfg"
+        log_names = _koji_log_names(resolution)
+        acquisition_tasks = [
+            ("repo_probe", lambda: probe_repodata(args.koji_topurl, resolution.buildroot)),
+            (
+                "published_rpm",
+                lambda: _download_published(
+                    published_rpm_url,
+                    inputs_dir / target_rpm_name,
+                    "published_rpm",
+                    store=store,
+                ),
+            ),
+            (
+                "published_srpm",
+                lambda: _download_published(
+                    published_srpm_url,
+                    inputs_dir / resolution.task_srpm_name,
+                    "published_srpm",
+                    store=store,
+                ),
+            ),
+            (
+                "koji_task_srpm",
+                lambda: _download_task_srpm(client, resolution, inputs_dir, koji_topurl=download_topurl, store=store),
+            ),
+        ]
+        for log_name in log_names:
+            acquisition_tasks.append(
+                (
+                    "koji_log:%s" % log_name,
+                    lambda log_name=log_name: _download_koji_log(
+                        client, resolution, inputs_dir, log_name, koji_topurl=download_topurl, store=store
+                    ),
+                )
+            )
+        acquisition_tasks.append(
+            (
+                "mock_config",
+                lambda: generate_mock_config(args.koji_server, args.koji_topurl, resolution.buildroot["id"], mock_cfg),
+            )
         )
+        acquired, acquisition = _run_acquisition_stage(
+            acquisition_tasks,
+            workers=getattr(args, "input_workers", DEFAULT_INPUT_WORKERS),
+        )
+
+        repo_probe = _acquired(acquired, "repo_probe")
+        write_json(metadata_dir / "repo-probe.json", repo_probe)
+
+        published_rpm, published_rpm_summary = _acquired(acquired, "published_rpm")
         if not published_rpm:
             raise RuntimeError(f"failed to download published RPM: {published_rpm_summary}")
 
-        published_srpm_url = join_url(args.source_rpm_base_url, resolution.task_srpm_name)
-        published_srpm, published_srpm_summary = _download_published(
-            published_srpm_url,
-            inputs_dir / resolution.task_srpm_name,
-            "published_srpm",
-        )
-
-        task_srpm, task_srpm_summary = _download_task_srpm(
-            client,
-            resolution.buildarch_task["id"],
-            resolution.task_srpm_name,
-            inputs_dir,
-        )
-        log_summaries = _download_koji_logs(
-            client,
-            resolution.buildarch_task["id"],
-            resolution.outputs,
-            inputs_dir,
-        )
+        published_srpm, published_srpm_summary = _acquired(acquired, "published_srpm")
+        task_srpm, task_srpm_summary = _acquired(acquired, "koji_task_srpm")
+        log_summaries = [_acquired(acquired, "koji_log:%s" % log_name) for log_name in log_names]
         koji_recorded_env = parse_koji_recorded_environment(resolution, inputs_dir)
 
         srpm_for_rebuild = published_srpm
@@ -421,13 +768,7 @@ def run_koji_rpm_rebuild(args):
 
         srpm_cross_check = compare_srpms(published_srpm, task_srpm)
 
-        mock_cfg = inputs_dir / "mock.cfg"
-        generate_mock_config(
-            args.koji_server,
-            args.koji_topurl,
-            resolution.buildroot["id"],
-            mock_cfg,
-        )
+        _acquired(acquired, "mock_config")
         active_mock_cfg = mock_cfg
         repo_fallback = None
 
@@ -451,6 +792,7 @@ def run_koji_rpm_rebuild(args):
                         source_rpm_url=source_rpm_url,
                         task_id=resolution.buildarch_task["id"],
                         srpm_cross_check=srpm_cross_check,
+                        acquisition=acquisition,
                     ),
                     "build_environment": _build_environment_summary(
                         args,
@@ -471,7 +813,7 @@ def run_koji_rpm_rebuild(args):
                     "analysis": _analysis_summary(),
                 }
                 report.update(_unavailable_assessment("historical_repo"))
-                write_json(run_dir / "report.json", report)
+                _write_report(run_dir, report, client, store)
                 print(f"[guanfu] Historical repo is not available: {repo_probe.get('url')}", file=sys.stderr)
                 return 3
 
@@ -504,6 +846,9 @@ def run_koji_rpm_rebuild(args):
                         run_dir / "fallback-repo",
                         metadata_dir,
                         resolution.buildarch_task["id"],
+                        koji_topurl=download_topurl,
+                        repodata_cache_dir=_cache_dir(args) / "repodata",
+                        store=store,
                     )
                 except Exception as exc:
                     repo_fallback = {
@@ -548,6 +893,7 @@ def run_koji_rpm_rebuild(args):
                         source_rpm_url=source_rpm_url,
                         task_id=resolution.buildarch_task["id"],
                         srpm_cross_check=srpm_cross_check,
+                        acquisition=acquisition,
                     ),
                     "build_environment": _build_environment_summary(
                         args,
@@ -569,7 +915,7 @@ def run_koji_rpm_rebuild(args):
                     "analysis": _analysis_summary(),
                 }
                 report.update(_unavailable_assessment("dependency_recovery"))
-                write_json(run_dir / "report.json", report)
+                _write_report(run_dir, report, client, store)
                 print(
                     "[guanfu] Historical repo is not available and installed_pkgs fallback is incomplete",
                     file=sys.stderr,
@@ -588,6 +934,8 @@ def run_koji_rpm_rebuild(args):
                 results_dir,
                 target_os,
                 koji_recorded=koji_recorded_env,
+                pool=vm_pool,
+                scheduler=vm_scheduler,
             )
             rebuilds = vm_result["rebuilds"]
             executor_details = vm_result["executor"]
@@ -613,7 +961,21 @@ def run_koji_rpm_rebuild(args):
                 first_run_rpms,
                 target_rpm_name,
                 reference_url=published_rpm_url,
+                manifest_diff_path=run_dir / MANIFEST_DIFF_NAME,
+                policy=policy,
             )
+            build_comparison = None
+            if getattr(args, "compare_scope", "target") == "build":
+                build_comparison = _compare_build_outputs(
+                    args,
+                    first_run_rpms,
+                    target_rpm_name,
+                    comparison,
+                    inputs_dir,
+                    metadata_dir,
+                    store=store,
+                    policy=policy,
+                )
             if len(rebuilds) > 1:
                 first = [(rpm["file"], rpm["sha256"]) for rpm in rebuilds[0]["rpms"]]
                 repeatable = all(
@@ -633,6 +995,7 @@ def run_koji_rpm_rebuild(args):
                     source_rpm_url=source_rpm_url,
                     task_id=resolution.buildarch_task["id"],
                     srpm_cross_check=srpm_cross_check,
+                    acquisition=acquisition,
                 ),
                 "build_environment": _build_environment_summary(
                     args,
@@ -653,6 +1016,12 @@ def run_koji_rpm_rebuild(args):
                 "diff_items": comparison["diff_items"],
                 "summary_stats": comparison["summary_stats"],
             }
+            if build_comparison:
+                report["build_comparison"] = build_comparison
+            fingerprint_inputs = [published_rpm] + first_run_rpms
+            if build_comparison:
+                fingerprint_inputs.extend(sorted((inputs_dir / "published").glob("*.rpm")))
+            report["assessment_fingerprint"] = assessment_fingerprint(run_dir, fingerprint_inputs, policy)
         else:
             report = {
                 "version": ASSESSMENT_VERSION,
@@ -672,6 +1041,7 @@ def run_koji_rpm_rebuild(args):
                     source_rpm_url=source_rpm_url,
                     task_id=resolution.buildarch_task["id"],
                     srpm_cross_check=srpm_cross_check,
+                    acquisition=acquisition,
                 ),
                 "build_environment": _build_environment_summary(
                     args,
@@ -686,13 +1056,13 @@ def run_koji_rpm_rebuild(args):
             }
             report.update(_unavailable_assessment("mock_rebuild", confidence=0.8))
 
-        write_json(run_dir / "report.json", report)
+        _write_report(run_dir, report, client, store)
         print(f"[guanfu] Koji RPM rebuild report: {run_dir / 'report.json'}")
         return 0 if successful else 1
     except Exception as exc:
         report["rebuild"] = _rebuild_summary(args, "error", error=repr(exc))
         report.update(_unavailable_assessment("rebuild_pipeline", confidence=0.7))
-        write_json(run_dir / "report.json", report)
+        _write_report(run_dir, report, client, store)
         print(f"[guanfu] ERROR: {exc}", file=sys.stderr)
         print(f"[guanfu] Partial report: {run_dir / 'report.json'}", file=sys.stderr)
         return 1
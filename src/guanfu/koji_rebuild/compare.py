@@ -1,9 +1,30 @@
+import lzma
 import subprocess
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from guanfu.koji_rebuild.assessment import ASSESSMENT_VERSION, build_light_assessment
+from guanfu.koji_rebuild.assessment import (
+    ASSESSMENT_VERSION,
+    analysis_capabilities,
+    build_level_assessment,
+    build_light_assessment,
+)
 from guanfu.koji_rebuild.downloader import sha256_file
+from guanfu.koji_rebuild.elf_compare import ELF_WORKERS, ElfMemberAnalyzer
+from guanfu.koji_rebuild.manifest import (
+    Manifest,
+    ManifestDiffWriter,
+    diff_manifests,
+    public_change,
+    record_from_dump_line,
+    record_from_file,
+)
+from guanfu.koji_rebuild.payload import compare_payloads
+from guanfu.koji_rebuild.rpm_header import payload_digest_file, read_package, sigmd5_file
 
 
 MAX_DIFF_ITEMS = 50
@@ -20,7 +41,68 @@ def _analysis_time():
     return datetime.now().astimezone().isoformat()
 
 
+# Same fields, in the same order, as the `rpm -qp --qf` query in _rpm_query.
+QUERY_TAGS = (
+    "NVRA",
+    "BUILDTIME",
+    "BUILDHOST",
+    "SOURCERPM",
+    "PAYLOADDIGEST",
+    "PAYLOADCOMPRESSOR",
+    "PAYLOADFLAGS",
+    "SIGMD5",
+    "SHA256HEADER",
+    "RSAHEADER",
+    "SIZE",
+)
+
+
+def _native_package(path):
+    # Parsed in-process; callers fall back to the rpm CLI when this returns None.
+    try:
+        return read_package(path)
+    except (OSError, ValueError):
+        return None
+
+
+def _native_query(package):
+    result = {}
+    for tag in QUERY_TAGS:
+        if tag == "NVRA":
+            result[tag] = package.nevra()
+        elif tag == "RSAHEADER":
+            result[tag] = package.pgpsig(tag)
+        else:
+            result[tag] = package.format_tag(tag)
+    return result
+
+
+def _native_command_lines(package, option):
+    if option == "--requires":
+        return package.dependencies("requires")
+    if option == "--provides":
+        return package.dependencies("provides")
+    if option == "--scripts":
+        lines = []
+        # Same shapes as rpm's --scripts query format.
+        for scriptlet in package.scriptlets():
+            if scriptlet["script"] is None:
+                lines.append("%s program: %s" % (scriptlet["name"], scriptlet["program"]))
+                continue
+            using = " (using %s)" % scriptlet["program"] if scriptlet["program"] else ""
+            lines.append("%s scriptlet%s:" % (scriptlet["name"], using))
+            lines.extend(scriptlet["script"].splitlines())
+        return lines
+    return None
+
+
 def _rpm_query(path):
+    package = _native_package(path)
+    if package is not None:
+        try:
+            return _native_query(package)
+        except ValueError:
+            pass
     query = (
         "NVRA=%{NAME}-%{VERSION}-%{RELEASE}.%{ARCH}\\n"
         "BUILDTIME=%{BUILDTIME}\\n"
@@ -46,46 +128,32 @@ def _rpm_query(path):
 
 
 def _rpm_command_lines(path, option):
+    package = _native_package(path)
+    lines = _native_command_lines(package, option) if package is not None else None
+    if lines is not None:
+        return sorted(lines)
     out, err = _run_text(["rpm", "-qp", option, str(path)])
     if err:
         return {"error": err}
     return sorted(out.splitlines())
 
 
-def _rpm_dump_map(path):
+def _rpm_manifest(path):
+    package = _native_package(path)
+    if package is not None:
+        return Manifest([record_from_file(item) for item in package.files()]), None
     out, err = _run_text(["rpm", "-qp", "--dump", str(path)])
     if err:
         return None, err
-
-    files = {}
+    records = []
     unparsed = []
     for line in out.splitlines():
-        parsed = _parse_dump_line(line)
-        if not parsed:
+        record = record_from_dump_line(line)
+        if record is None:
             unparsed.append(line)
-            continue
-        files[parsed["path"]] = parsed
-    return {"files": files, "unparsed": unparsed}, None
-
-
-def _parse_dump_line(line):
-    parts = line.split()
-    if len(parts) < 11:
-        return None
-    path = parts[0]
-    return {
-        "path": path,
-        "size": parts[1],
-        "mtime": parts[2],
-        "digest": parts[3],
-        "mode": parts[4],
-        "owner": parts[5],
-        "group": parts[6],
-        "isconfig": parts[7],
-        "isdoc": parts[8],
-        "rdev": parts[9],
-        "linkto": " ".join(parts[10:]),
-    }
+        else:
+            records.append(record)
+    return Manifest(records, unparsed), None
 
 
 def _find_rebuilt_rpm(result_rpms, target_filename):
@@ -112,49 +180,6 @@ def _diff_headers(published_headers, rebuilt_headers):
     }
 
 
-def _file_brief(item):
-    return {
-        "size": item.get("size"),
-        "mtime": item.get("mtime"),
-        "digest": item.get("digest"),
-        "mode": item.get("mode"),
-        "owner": item.get("owner"),
-        "group": item.get("group"),
-        "isconfig": item.get("isconfig"),
-        "isdoc": item.get("isdoc"),
-        "rdev": item.get("rdev"),
-        "linkto": item.get("linkto"),
-    }
-
-
-def _diff_file_entry(published, rebuilt):
-    compared_fields = [
-        "size",
-        "mtime",
-        "digest",
-        "mode",
-        "owner",
-        "group",
-        "isconfig",
-        "isdoc",
-        "rdev",
-        "linkto",
-    ]
-    changed_fields = [
-        field
-        for field in compared_fields
-        if published.get(field) != rebuilt.get(field)
-    ]
-    if not changed_fields:
-        return None
-    return {
-        "path": published["path"],
-        "changed_fields": changed_fields,
-        "published": _file_brief(published),
-        "rebuilt": _file_brief(rebuilt),
-    }
-
-
 def _limit_items(items, limit=MAX_DIFF_ITEMS):
     return {
         "count": len(items),
@@ -163,9 +188,9 @@ def _limit_items(items, limit=MAX_DIFF_ITEMS):
     }
 
 
-def _diff_files(published_rpm, rebuilt_rpm):
-    published_dump, published_err = _rpm_dump_map(published_rpm)
-    rebuilt_dump, rebuilt_err = _rpm_dump_map(rebuilt_rpm)
+def _diff_files(published_rpm, rebuilt_rpm, sidecar=None):
+    published_manifest, published_err = _rpm_manifest(published_rpm)
+    rebuilt_manifest, rebuilt_err = _rpm_manifest(rebuilt_rpm)
     if published_err or rebuilt_err:
         return {
             "status": "error",
@@ -173,65 +198,205 @@ def _diff_files(published_rpm, rebuilt_rpm):
             "rebuilt_error": rebuilt_err,
         }, None
 
-    published_files = published_dump["files"]
-    rebuilt_files = rebuilt_dump["files"]
-    published_paths = set(published_files)
-    rebuilt_paths = set(rebuilt_files)
-
-    only_in_published = sorted(published_paths - rebuilt_paths)
-    only_in_rebuilt = sorted(rebuilt_paths - published_paths)
-
-    changed = []
-    for path in sorted(published_paths & rebuilt_paths):
-        diff = _diff_file_entry(published_files[path], rebuilt_files[path])
-        if diff:
-            changed.append(diff)
-
-    mtime_only = [
-        item
-        for item in changed
-        if item["changed_fields"] == ["mtime"]
-    ]
-    non_mtime = [
-        item
-        for item in changed
-        if set(item["changed_fields"]) - {"mtime"}
-    ]
-    content_related = [
-        item
-        for item in changed
-        if set(item["changed_fields"]) & {"digest", "size", "linkto"}
-    ]
-
+    diff = {"only_in_published": [], "only_in_rebuilt": [], "changed": []}
+    mtime_only_count = 0
+    non_mtime_count = 0
+    content_related_count = 0
+    for kind, value in diff_manifests(published_manifest, rebuilt_manifest):
+        if sidecar is not None:
+            sidecar.write(kind, value)
+        if kind != "changed":
+            diff[kind].append(value.path)
+            continue
+        diff["changed"].append(value)
+        fields = set(value["changed_fields"])
+        if fields == {"mtime"}:
+            mtime_only_count += 1
+        else:
+            non_mtime_count += 1
+        if fields & {"digest", "size", "linkto"}:
+            content_related_count += 1
+
+    changed = diff["changed"]
+    public_changed = _limit_items(changed)
+    public_changed["items"] = [public_change(entry) for entry in public_changed["items"]]
     public_diff = {
         "status": "compared",
-        "published_file_count": len(published_files),
-        "rebuilt_file_count": len(rebuilt_files),
-        "only_in_published": _limit_items(only_in_published),
-        "only_in_rebuilt": _limit_items(only_in_rebuilt),
-        "changed": _limit_items(changed),
-        "mtime_only_changed_count": len(mtime_only),
-        "non_mtime_changed_count": len(non_mtime),
-        "content_related_changed_count": len(content_related),
+        "published_file_count": len(published_manifest),
+        "rebuilt_file_count": len(rebuilt_manifest),
+        "only_in_published": _limit_items(diff["only_in_published"]),
+        "only_in_rebuilt": _limit_items(diff["only_in_rebuilt"]),
+        "changed": public_changed,
+        "mtime_only_changed_count": mtime_only_count,
+        "non_mtime_changed_count": non_mtime_count,
+        "content_related_changed_count": content_related_count,
         "files_equal_ignoring_mtime": (
-            not only_in_published
-            and not only_in_rebuilt
-            and len(non_mtime) == 0
+            not diff["only_in_published"]
+            and not diff["only_in_rebuilt"]
+            and non_mtime_count == 0
         ),
         "unparsed": {
-            "published_count": len(published_dump["unparsed"]),
-            "rebuilt_count": len(rebuilt_dump["unparsed"]),
+            "published_count": len(published_manifest.unparsed),
+            "rebuilt_count": len(rebuilt_manifest.unparsed),
         },
     }
-    analysis_input = {
-        "only_in_published": only_in_published,
-        "only_in_rebuilt": only_in_rebuilt,
-        "changed": changed,
-    }
-    return public_diff, analysis_input
+    # Changed entries keep references to the manifest records rather than copies.
+    return public_diff, diff
+
 
+def _record_tier(tiers, name, started, outcome):
+    tiers.append({"tier": name, "outcome": outcome, "seconds": round(time.monotonic() - started, 6)})
 
-def compare_published_and_rebuilt(published_rpm, result_rpms, target_filename, reference_url=None):
+
+def _header_digest_equal(published_headers, rebuilt_headers, field):
+    value = published_headers.get(field)
+    return bool(value) and value != "(none)" and value == rebuilt_headers.get(field)
+
+
+def _verified_digest_equal(published, rebuilt, published_headers, field, digest_file):
+    # The tags come from headers nothing has verified yet, so equal tags only
+    # count when both files really hash to the recorded value.
+    value = published_headers[field].lower()
+    return digest_file(published) == value and digest_file(rebuilt) == value
+
+
+def _compare_differing_rpms(
+    published,
+    rebuilt,
+    tiers,
+    elf_workers=ELF_WORKERS,
+    manifest_diff_path=None,
+    policy=None,
+):
+    # Tiers run cheapest first and stop once the outcome is settled.
+    started = time.monotonic()
+    published_headers = _rpm_query(published)
+    rebuilt_headers = _rpm_query(rebuilt)
+    header_diff = _diff_headers(published_headers, rebuilt_headers)
+    sigmd5_claimed = _header_digest_equal(published_headers, rebuilt_headers, "SIGMD5")
+    payload_claimed = _header_digest_equal(published_headers, rebuilt_headers, "PAYLOADDIGEST")
+    sigmd5_equal = sigmd5_claimed and _verified_digest_equal(
+        published, rebuilt, published_headers, "SIGMD5", sigmd5_file
+    )
+    payload_equal = (
+        not sigmd5_equal
+        and payload_claimed
+        and _verified_digest_equal(published, rebuilt, published_headers, "PAYLOADDIGEST", payload_digest_file)
+    )
+    if sigmd5_equal:
+        outcome = "sigmd5_equal"
+    elif payload_equal:
+        outcome = "payload_digest_equal"
+    elif sigmd5_claimed or payload_claimed:
+        # Equal tags over bytes that hash differently: the payload must be
+        # compared even when the header manifests agree.
+        outcome = "digest_mismatch"
+    else:
+        outcome = "different"
+    mismatch_fields = None
+    if outcome == "digest_mismatch":
+        mismatch_fields = [
+            field for field, claimed in (("SIGMD5", sigmd5_claimed), ("PAYLOADDIGEST", payload_claimed)) if claimed
+        ]
+    _record_tier(tiers, "header_digest", started, outcome)
+    if sigmd5_equal:
+        # Header and payload are byte-identical; only the signature header differs.
+        return build_light_assessment(
+            False, header_diff, {"status": "compared"}, None, True, True, True, policy=policy, performed=("rpm_header",)
+        )
+
+    started = time.monotonic()
+    requires_equal = _rpm_command_lines(published, "--requires") == _rpm_command_lines(rebuilt, "--requires")
+    provides_equal = _rpm_command_lines(published, "--provides") == _rpm_command_lines(rebuilt, "--provides")
+    scripts_equal = _rpm_command_lines(published, "--scripts") == _rpm_command_lines(rebuilt, "--scripts")
+    sidecar = ManifestDiffWriter(manifest_diff_path) if manifest_diff_path else None
+    try:
+        files_diff, file_analysis = _diff_files(published, rebuilt, sidecar)
+    finally:
+        if sidecar is not None:
+            sidecar.close()
+    manifest_equal = (
+        files_diff.get("status") == "compared"
+        and not (file_analysis or {}).get("changed")
+        and not (file_analysis or {}).get("only_in_published")
+        and not (file_analysis or {}).get("only_in_rebuilt")
+    )
+    _record_tier(tiers, "manifest", started, "equal" if manifest_equal else "different")
+
+    started = time.monotonic()
+    payload_compare = None
+    elf_analysis = {}
+    if payload_equal:
+        outcome = "equal"
+    elif manifest_equal and not mismatch_fields:
+        outcome = "skipped"
+    else:
+        payload_compare, elf_analysis = _compare_payload_content(published, rebuilt, elf_workers)
+        if payload_compare["status"] != "compared":
+            outcome = "error"
+        elif any(payload_compare["members"][key] for key in ("different", "only_in_published", "only_in_rebuilt")):
+            outcome = "different"
+        else:
+            outcome = "equal"
+    _record_tier(tiers, "content", started, outcome)
+    performed = ["rpm_header", "rpm_scriptlet"]
+    if files_diff.get("status") == "compared":
+        performed.append("rpm_file_manifest")
+    if file_analysis is not None:
+        performed.append("path_based_classification")
+    if payload_compare and payload_compare["status"] == "compared":
+        performed.append("payload_decompression_compare")
+        if all(item.get("status") == "compared" for item in elf_analysis.values()):
+            performed.extend(["elf_section_compare", "elf_buildid_compare"])
+    assessment = build_light_assessment(
+        False,
+        header_diff,
+        files_diff,
+        file_analysis,
+        requires_equal,
+        provides_equal,
+        scripts_equal,
+        elf_analysis,
+        policy,
+        digest_mismatch_fields=mismatch_fields,
+        performed=performed,
+    )
+    if sidecar is not None:
+        assessment["analysis"]["manifest_diff"] = {"path": str(sidecar.path), "records": sidecar.records}
+    if payload_compare:
+        assessment["analysis"]["payload_compare"] = payload_compare
+    if elf_analysis:
+        assessment["analysis"]["elf_compare"] = [elf_analysis[path] for path in sorted(elf_analysis)][:MAX_DIFF_ITEMS]
+    return assessment
+
+
+def _compare_payload_content(published, rebuilt, elf_workers):
+    analyzer = ElfMemberAnalyzer(elf_workers)
+    try:
+        with tempfile.TemporaryDirectory(prefix="guanfu-payload-") as spool_dir:
+            try:
+                result = compare_payloads(
+                    read_package(published),
+                    read_package(rebuilt),
+                    spool_dir=spool_dir,
+                    elf_member=analyzer.submit,
+                )
+            finally:
+                elf_analysis = analyzer.close()
+    except (OSError, ValueError, EOFError, lzma.LZMAError, zlib.error) as exc:
+        return {"status": "error", "error": str(exc)}, {}
+    return result, elf_analysis
+
+
+def compare_published_and_rebuilt(
+    published_rpm,
+    result_rpms,
+    target_filename,
+    reference_url=None,
+    elf_workers=ELF_WORKERS,
+    manifest_diff_path=None,
+    policy=None,
+):
     published = Path(published_rpm)
     rebuilt = _find_rebuilt_rpm(result_rpms, target_filename)
     if not rebuilt:
@@ -273,36 +438,24 @@ def compare_published_and_rebuilt(published_rpm, result_rpms, target_filename, r
             },
             "analysis": {
                 "mode": "light",
-                "capabilities": {},
+                "capabilities": analysis_capabilities(),
                 "unsupported_precise_types": [],
             },
         }
 
-    published_requires = _rpm_command_lines(published, "--requires")
-    rebuilt_requires = _rpm_command_lines(rebuilt, "--requires")
-    published_provides = _rpm_command_lines(published, "--provides")
-    rebuilt_provides = _rpm_command_lines(rebuilt, "--provides")
-    published_scripts = _rpm_command_lines(published, "--scripts")
-    rebuilt_scripts = _rpm_command_lines(rebuilt, "--scripts")
-    published_headers = _rpm_query(published)
-    rebuilt_headers = _rpm_query(rebuilt)
-    header_diff = _diff_headers(published_headers, rebuilt_headers)
-    files_diff, file_analysis = _diff_files(published, rebuilt)
+    tiers = []
+    started = time.monotonic()
     published_sha256 = sha256_file(published)
     rebuilt_sha256 = sha256_file(rebuilt)
-    rpm_file_sha256_equal = published_sha256 == rebuilt_sha256
-    requires_equal = published_requires == rebuilt_requires
-    provides_equal = published_provides == rebuilt_provides
-    scripts_equal = published_scripts == rebuilt_scripts
-    assessment = build_light_assessment(
-        rpm_file_sha256_equal,
-        header_diff,
-        files_diff,
-        file_analysis,
-        requires_equal,
-        provides_equal,
-        scripts_equal,
+    rpm_file_sha256_equal = (
+        published.stat().st_size == rebuilt.stat().st_size and published_sha256 == rebuilt_sha256
     )
+    _record_tier(tiers, "file_digest", started, "equal" if rpm_file_sha256_equal else "different")
+    if rpm_file_sha256_equal:
+        assessment = build_light_assessment(True, None, None, None, True, True, True, policy=policy)
+    else:
+        assessment = _compare_differing_rpms(published, rebuilt, tiers, elf_workers, manifest_diff_path, policy)
+    assessment["analysis"]["tiers"] = tiers
 
     result = {
         "version": ASSESSMENT_VERSION,
@@ -331,3 +484,73 @@ def compare_srpms(published_srpm, task_srpm):
         "published_headers": _rpm_query(published),
         "koji_task_headers": _rpm_query(task),
     }
+
+
+def _compare_build_package(item, elf_workers=ELF_WORKERS, policy=None):
+    comparison = compare_published_and_rebuilt(
+        item["published"],
+        [item["rebuilt"]],
+        item["package_name"],
+        reference_url=item.get("reference_url"),
+        elf_workers=elf_workers,
+        policy=policy,
+    )
+    return summarize_build_package(comparison)
+
+
+def summarize_build_package(comparison):
+    result = dict(comparison["metadata"])
+    result.pop("analysis_time", None)
+    result["status"] = "compared"
+    for key in ("overall_assessment", "diff_items", "summary_stats"):
+        result[key] = comparison[key]
+    return result
+
+
+def compare_build(items, workers=1, policy=None):
+    # items: [{"package_name", "rebuilt", "published" (None if missing), "reference_url", "error"}];
+    # an item may carry an already computed "comparison" for the target RPM.
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        if item.get("comparison"):
+            results[index] = summarize_build_package(item["comparison"])
+            continue
+        if item.get("published"):
+            pending.append(index)
+            continue
+        results[index] = {
+            "package_name": item["package_name"],
+            "reference_url": item.get("reference_url"),
+            "status": "missing_published",
+            "error": item.get("error"),
+        }
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            # Packages already fan out across processes; analyze their ELF files inline.
+            futures = [(index, pool.submit(_compare_build_package, items[index], 1, policy)) for index in pending]
+            for index, future in futures:
+                results[index] = _build_package_result(items[index], future)
+    else:
+        for index in pending:
+            results[index] = _build_package_result(items[index], None, policy)
+
+    return {
+        "status": "compared",
+        "workers": workers,
+        "packages": results,
+        "overall_assessment": build_level_assessment(results),
+    }
+
+
+def _build_package_result(item, future, policy=None):
+    try:
+        return future.result() if future is not None else _compare_build_package(item, policy=policy)
+    except Exception as exc:
+        return {
+            "package_name": item["package_name"],
+            "reference_url": item.get("reference_url"),
+            "status": "error",
+            "error": repr(exc),
+        }
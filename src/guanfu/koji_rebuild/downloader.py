@@ -1,18 +1,81 @@
 import base64
 import hashlib
+import json
+import os
+import re
+import threading
 import urllib.error
 import urllib.parse
 import urllib.request
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from guanfu.koji_rebuild.rpm_header import sigmd5_file
+
+USER_AGENT = "guanfu-koji-rebuild/0.1"
+# Artifacts at least this large are fetched with parallel HTTP Range requests
+# into a resumable "<dest>.part" file when the server advertises byte ranges.
+SEGMENTED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+SEGMENT_SIZE = 16 * 1024 * 1024
+SEGMENT_WORKERS = 4
+SEGMENT_RETRIES = 3
+
+# sha256 digests of files already hashed in this process, keyed by
+# (device, inode, size, mtime_ns) so a rewritten file is never served stale.
+_DIGEST_CACHE = {}
+_DIGEST_LOCK = threading.Lock()
+
+
+def _digest_key(path):
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def remember_sha256(path, digest):
+    key = _digest_key(path)
+    with _DIGEST_LOCK:
+        _DIGEST_CACHE[key] = digest
+    return digest
+
 
 def sha256_file(path):
+    key = _digest_key(path)
+    with _DIGEST_LOCK:
+        digest = _DIGEST_CACHE.get(key)
+    if digest:
+        return digest
     h = hashlib.sha256()
     with open(path, "rb") as f:
         for chunk in iter(lambda: f.read(1024 * 1024), b""):
             h.update(chunk)
-    return h.hexdigest()
+    digest = h.hexdigest()
+    if _digest_key(path) == key:
+        with _DIGEST_LOCK:
+            _DIGEST_CACHE[key] = digest
+    return digest
+
+
+def persistent_sha256(path):
+    # sha256_file with the digest also kept in "<path>.sha256", keyed by size
+    # and mtime, so large cached files are not re-hashed on every run.
+    path = Path(path)
+    sidecar = path.with_name(path.name + ".sha256")
+    st = path.stat()
+    try:
+        state = json.loads(sidecar.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        state = {}
+    if state.get("size") == st.st_size and state.get("mtime_ns") == st.st_mtime_ns and state.get("sha256"):
+        return remember_sha256(path, state["sha256"])
+    digest = sha256_file(path)
+    tmp = sidecar.with_name("%s.%d.%d.tmp" % (sidecar.name, os.getpid(), threading.get_ident()))
+    tmp.write_text(
+        json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}, sort_keys=True),
+        encoding="utf-8",
+    )
+    os.replace(str(tmp), str(sidecar))
+    return digest
 
 
 def summarize_file(path, label=None, url=None):
@@ -36,23 +99,213 @@ def join_url(base_url, filename):
     return urllib.parse.urljoin(base_url, urllib.parse.quote(filename))
 
 
-def download_url(url, dest):
-    dest = Path(dest)
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    request = urllib.request.Request(url, headers={"User-Agent": "guanfu-koji-rebuild/0.1"})
+def _unlink_existing(dest):
+    # Store-backed files are hard links into the shared artifact store; never
+    # write through them.
+    if dest.exists() or dest.is_symlink():
+        dest.unlink()
+
+
+def _part_paths(dest):
+    return dest.with_name(dest.name + ".part"), dest.with_name(dest.name + ".part.json")
+
+
+def _check_sha256(url, actual, expected_sha256):
+    if expected_sha256 and actual != expected_sha256.lower():
+        raise RuntimeError("sha256 mismatch for %s: expected %s, got %s" % (url, expected_sha256, actual))
+
+
+def _md5_etag(etag):
+    # Single-part object stores publish the body md5 as a strong ETag.
+    match = re.match(r'^"?([0-9a-fA-F]{32})"?$', etag or "")
+    return match.group(1).lower() if match else None
+
+
+def _load_part_state(state_path, url, size, validator):
+    try:
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if state.get("url") != url or state.get("size") != size or state.get("validator") != validator:
+        return None
+    return state
+
+
+def _write_part_state(state_path, state):
+    tmp = state_path.with_name(state_path.name + ".tmp")
+    tmp.write_text(json.dumps(state, sort_keys=True), encoding="utf-8")
+    os.replace(str(tmp), str(state_path))
+
+
+def _fetch_segment(url, part, start, end, validator):
+    headers = {"User-Agent": USER_AGENT, "Range": "bytes=%d-%d" % (start, end)}
+    if validator:
+        headers["If-Range"] = validator
+    request = urllib.request.Request(url, headers=headers)
     with urllib.request.urlopen(request, timeout=60) as response:
-        with open(dest, "wb") as f:
+        if response.status != 206:
+            raise RuntimeError("%s changed on the server or ignored the Range request" % url)
+        offset = start
+        with open(part, "r+b") as f:
+            f.seek(offset)
             while True:
                 chunk = response.read(1024 * 1024)
                 if not chunk:
                     break
                 f.write(chunk)
+                offset += len(chunk)
+    if offset != end + 1:
+        raise RuntimeError("short read for %s bytes %d-%d" % (url, start, end))
+
+
+def download_segmented(url, dest, size, validator=None, expected_sha256=None):
+    dest = Path(dest)
+    part, state_path = _part_paths(dest)
+    # Without a validator a changed file cannot be told apart, so start over.
+    state = _load_part_state(state_path, url, size, validator) if part.exists() and validator else None
+    if state is None:
+        state = {"url": url, "size": size, "validator": validator, "done": []}
+        with open(part, "wb") as f:
+            f.truncate(size)
+        _write_part_state(state_path, state)
+
+    done = set(state["done"])
+    segments = [
+        (index, start, min(start + SEGMENT_SIZE, size) - 1)
+        for index, start in enumerate(range(0, size, SEGMENT_SIZE))
+        if index not in done
+    ]
+    lock = threading.Lock()
+
+    def fetch(segment):
+        index, start, end = segment
+        for attempt in range(SEGMENT_RETRIES):
+            try:
+                _fetch_segment(url, part, start, end, validator)
+                break
+            except urllib.error.HTTPError:
+                raise
+            except Exception:
+                if attempt == SEGMENT_RETRIES - 1:
+                    raise
+        with lock:
+            state["done"].append(index)
+            _write_part_state(state_path, state)
+
+    with ThreadPoolExecutor(max_workers=SEGMENT_WORKERS) as pool:
+        for future in [pool.submit(fetch, segment) for segment in segments]:
+            future.result()
+
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(part, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+    try:
+        _check_sha256(url, sha256.hexdigest(), expected_sha256)
+        etag_md5 = _md5_etag(validator)
+        if etag_md5 and md5.hexdigest() != etag_md5:
+            raise RuntimeError("ETag md5 mismatch for %s: expected %s, got %s" % (url, etag_md5, md5.hexdigest()))
+    except RuntimeError:
+        part.unlink()
+        state_path.unlink()
+        raise
+    os.replace(str(part), str(dest))
+    state_path.unlink()
+    remember_sha256(dest, sha256.hexdigest())
+    return dest
+
+
+def _head(url):
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT}, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.headers
+    except Exception:
+        return None
+
+
+def _validator(headers):
+    if headers is None:
+        return None
+    return headers.get("ETag") or headers.get("Last-Modified")
+
+
+def _probe(url, headers=None):
+    # HEAD tells whether a segmented download is possible without pulling the
+    # body; servers that refuse HEAD just get a plain download.
+    headers = headers if headers is not None else _head(url)
+    if headers is None:
+        return None
+    size = int(headers.get("Content-Length") or 0)
+    ranged = headers.get("Accept-Ranges", "").lower() == "bytes"
+    # Resuming is only safe when If-Range can tell that the file changed.
+    validator = _validator(headers)
+    if ranged and validator and size >= SEGMENTED_DOWNLOAD_THRESHOLD:
+        return size, validator
+    return None
+
+
+def download_url(url, dest, store=None, store_key=None, expected_sha256=None):
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    headers = None
+    if store is not None and not store_key:
+        if expected_sha256:
+            store_key = "url:%s" % url
+        else:
+            # The same URL can be republished with new bytes: a stored copy only
+            # stands in for it while the server reports the same ETag or
+            # Last-Modified, so the key carries that validator.
+            headers = _head(url)
+            validator = _validator(headers)
+            store_key = "url:%s:%s" % (url, validator) if validator else None
+    if store is not None and store_key:
+        fetched = store.fetch(store_key, dest)
+        if fetched and (not expected_sha256 or fetched == expected_sha256.lower()):
+            return dest
+    _unlink_existing(dest)
+    part, state_path = _part_paths(dest)
+    segmented = _probe(url, headers)
+    if segmented:
+        size, validator = segmented
+        download_segmented(url, dest, size, validator=validator, expected_sha256=expected_sha256)
+        sha256 = sha256_file(dest)
+    else:
+        h = hashlib.sha256()
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response, open(part, "wb") as f:
+                length = response.headers.get("Content-Length")
+                received = 0
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    f.write(chunk)
+                    received += len(chunk)
+            if length is not None and received != int(length):
+                raise RuntimeError("short read for %s: expected %s bytes, got %d" % (url, length, received))
+            sha256 = h.hexdigest()
+            _check_sha256(url, sha256, expected_sha256)
+        except BaseException:
+            if part.exists():
+                part.unlink()
+            raise
+        os.replace(str(part), str(dest))
+        if state_path.exists():
+            state_path.unlink()
+        remember_sha256(dest, sha256)
+    if store is not None:
+        store.add(dest, key=store_key, sha256=sha256)
     return dest
 
 
-def try_download_url(url, dest):
+def try_download_url(url, dest, store=None, store_key=None):
     try:
-        return download_url(url, dest), None
+        return download_url(url, dest, store=store, store_key=store_key), None
     except urllib.error.HTTPError as exc:
         return None, f"HTTP {exc.code}: {exc.reason}"
     except Exception as exc:
@@ -72,16 +325,91 @@ def _decode_xmlrpc_chunk(chunk):
 def download_task_output(client, task_id, filename, dest):
     dest = Path(dest)
     dest.parent.mkdir(parents=True, exist_ok=True)
+    _unlink_existing(dest)
     offset = 0
     size = 1024 * 1024
+    h = hashlib.sha256()
     with open(dest, "wb") as f:
         while True:
             chunk = client.download_task_output(task_id, filename, offset, size)
             data = _decode_xmlrpc_chunk(chunk)
             if not data:
                 break
+            h.update(data)
             f.write(data)
             offset += len(data)
             if len(data) < size:
                 break
+    remember_sha256(dest, h.hexdigest())
     return dest
+
+
+def koji_task_output_url(koji_topurl, task_id, filename):
+    return join_url(
+        "%s/work/tasks/%s/%s/" % (koji_topurl.rstrip("/"), int(task_id) % 10000, task_id),
+        filename,
+    )
+
+
+def koji_build_url(koji_topurl, build, *parts):
+    base = "%s/packages/%s/%s/%s/" % (
+        koji_topurl.rstrip("/"),
+        urllib.parse.quote(build["name"]),
+        urllib.parse.quote(build["version"]),
+        urllib.parse.quote(build["release"]),
+    )
+    return join_url(base + "".join("%s/" % urllib.parse.quote(part) for part in parts[:-1]), parts[-1])
+
+
+def _verify_koji_file(path, expected_size=None, expected_sigmd5=None):
+    if expected_size is not None and path.stat().st_size != int(expected_size):
+        return "size mismatch: expected %s, got %s" % (expected_size, path.stat().st_size)
+    if expected_sigmd5:
+        actual = sigmd5_file(path)
+        if actual.lower() != str(expected_sigmd5).lower():
+            return "sigmd5 mismatch: expected %s, got %s" % (expected_sigmd5, actual)
+    return None
+
+
+def download_koji_file(
+    client,
+    task_id,
+    filename,
+    dest,
+    urls=(),
+    expected_size=None,
+    expected_sigmd5=None,
+    store=None,
+):
+    dest = Path(dest)
+    if expected_sigmd5:
+        store_key = "koji-rpm:%s:%s" % (str(expected_sigmd5).lower(), filename)
+    else:
+        store_key = "koji-task-output:%s:%s:%s" % (getattr(client, "server_url", ""), task_id, filename)
+    if store is not None and store.fetch(store_key, dest):
+        return dest, {"transport": "store"}
+
+    attempts = []
+    transfer = None
+    for url in urls:
+        path, error = try_download_url(url, dest)
+        if not error:
+            error = _verify_koji_file(path, expected_size, expected_sigmd5)
+        if not error:
+            transfer = {"transport": "http", "url": url, "attempts": attempts}
+            break
+        attempts.append({"transport": "http", "url": url, "error": error})
+        if dest.exists():
+            dest.unlink()
+
+    if transfer is None:
+        path = download_task_output(client, task_id, filename, dest)
+        error = _verify_koji_file(path, expected_size, expected_sigmd5)
+        if error:
+            raise RuntimeError(
+                "Koji task output %s of task %s failed verification: %s" % (filename, task_id, error)
+            )
+        transfer = {"transport": "xmlrpc", "attempts": attempts}
+    if store is not None:
+        store.add(dest, key=store_key)
+    return dest, transfer
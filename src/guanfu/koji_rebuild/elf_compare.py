@@ -0,0 +1,211 @@
+import hashlib
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+
+ELF_MAGIC = b"\x7fELF"
+ELF_WORKERS = 4
+MAX_SECTIONS = 20
+
+SHT_NOBITS = 8
+SHN_XINDEX = 0xFFFF
+
+BUILDID_SECTIONS = set([".note.gnu.build-id", ".gnu_debuglink", ".gnu_debugaltlink"])
+DEBUG_SECTION_PREFIXES = (".debug_", ".zdebug_")
+
+# Offsets of e_phoff, e_shoff and e_ehsize (followed by e_phentsize, e_phnum,
+# e_shentsize, e_shnum and e_shstrndx), and the section header layout, per
+# ELF class.
+_LAYOUTS = {
+    1: (0x1C, 0x20, 0x28, "IIIIIIIIII"),
+    2: (0x20, 0x28, 0x34, "IIQQQQIIQQ"),
+}
+PN_XNUM = 0xFFFF
+# Pseudo sections for the bytes no section header describes. Any difference in
+# them is a real binary change.
+ELF_HEADER = "<elf header>"
+PROGRAM_HEADERS = "<program headers>"
+UNCOVERED_BYTES = "<uncovered bytes>"
+
+
+def is_elf(data):
+    return data[:4] == ELF_MAGIC
+
+
+def elf_sections(data):
+    # Returns [(name, type, sha256, size)] in section header order, followed by
+    # the ELF header, the program header table and the bytes outside every
+    # section. A section's digest covers its header fields except sh_offset.
+    if not is_elf(data) or len(data) < 0x40:
+        raise ValueError("not an ELF file")
+    elf_class = data[4]
+    if elf_class not in _LAYOUTS or data[5] not in (1, 2):
+        raise ValueError("unsupported ELF class or data encoding")
+    order = "<" if data[5] == 1 else ">"
+    phoff_at, shoff_at, ehsize_at, entry_format = _LAYOUTS[elf_class]
+    word = order + ("I" if elf_class == 1 else "Q")
+    phoff = struct.unpack_from(word, data, phoff_at)[0]
+    shoff = struct.unpack_from(word, data, shoff_at)[0]
+    ehsize, phentsize, phnum, shentsize, shnum, shstrndx = struct.unpack_from(order + "HHHHHH", data, ehsize_at)
+    entry = struct.Struct(order + entry_format)
+
+    def header(index):
+        return entry.unpack_from(data, shoff + index * shentsize)
+
+    headers = []
+    if shoff:
+        if shnum == 0:
+            shnum = header(0)[5]
+        if shstrndx == SHN_XINDEX:
+            shstrndx = header(0)[6]
+        headers = [header(index) for index in range(shnum)]
+    if phnum == PN_XNUM and headers:
+        phnum = headers[0][7]
+    strtab_offset = headers[shstrndx][4] if shstrndx < len(headers) else 0
+
+    sections = []
+    covered = [(0, max(ehsize, ehsize_at + 12)), (phoff, phoff + phnum * phentsize)]
+    if shoff:
+        covered.append((shoff, shoff + len(headers) * shentsize))
+    for item in headers:
+        sh_name, sh_type, _, _, sh_offset, sh_size = item[:6]
+        end = data.find(b"\0", strtab_offset + sh_name)
+        name = data[strtab_offset + sh_name : end].decode("utf-8", "replace") if strtab_offset else ""
+        # Section headers move when an earlier section grows; only the offset
+        # is left out of the digest.
+        digest = hashlib.sha256(entry.pack(*(item[:4] + (0,) + item[5:])))
+        if sh_type != SHT_NOBITS:
+            if sh_offset + sh_size > len(data):
+                raise ValueError("section %s extends past end of file" % name)
+            digest.update(data[sh_offset : sh_offset + sh_size])
+            covered.append((sh_offset, sh_offset + sh_size))
+        sections.append((name, sh_type, digest.hexdigest(), sh_size))
+
+    elf_header = bytearray(data[: covered[0][1]])
+    # e_shoff, e_shnum and e_shstrndx only locate the section headers, which
+    # are compared above.
+    struct.pack_into(word, elf_header, shoff_at, 0)
+    struct.pack_into(order + "HH", elf_header, ehsize_at + 8, 0, 0)
+    sections.append((ELF_HEADER, None, hashlib.sha256(elf_header).hexdigest(), len(elf_header)))
+    if phoff + phnum * phentsize > len(data):
+        raise ValueError("program headers extend past end of file")
+    program_headers = data[phoff : phoff + phnum * phentsize] if phnum else b""
+    sections.append((PROGRAM_HEADERS, None, hashlib.sha256(program_headers).hexdigest(), len(program_headers)))
+    sections.append(_uncovered_bytes(data, covered))
+    return sections
+
+
+def _uncovered_bytes(data, covered):
+    # Zero padding between sections shifts with their sizes; anything else
+    # outside them is hashed.
+    digest = hashlib.sha256()
+    size = 0
+    position = 0
+    for start, end in sorted(covered) + [(len(data), len(data))]:
+        if start > position:
+            gap = data[position:start].strip(b"\0")
+            if gap:
+                digest.update(struct.pack(">Q", len(gap)) + gap)
+                size += len(gap)
+        position = max(position, end)
+    return UNCOVERED_BYTES, None, digest.hexdigest(), size
+
+
+def _keyed_sections(sections):
+    # Section names are not unique (e.g. COMDAT groups), so key by occurrence.
+    seen = {}
+    keyed = {}
+    for name, sh_type, digest, size in sections:
+        occurrence = seen.get(name, 0)
+        seen[name] = occurrence + 1
+        keyed[(name, occurrence)] = (sh_type, digest, size)
+    return keyed
+
+
+def _is_debug_section(name):
+    return name.startswith(DEBUG_SECTION_PREFIXES)
+
+
+def compare_elf_sections(published_sections, rebuilt_sections):
+    published = _keyed_sections(published_sections)
+    rebuilt = _keyed_sections(rebuilt_sections)
+    different = sorted(key for key in set(published) & set(rebuilt) if published[key] != rebuilt[key])
+    only_in_published = sorted(set(published) - set(rebuilt))
+    only_in_rebuilt = sorted(set(rebuilt) - set(published))
+    names = [name for name, _ in different + only_in_published + only_in_rebuilt]
+    if not names:
+        classification = "identical"
+    elif all(name in BUILDID_SECTIONS for name in names):
+        classification = "buildid"
+    elif all(name in BUILDID_SECTIONS or _is_debug_section(name) for name in names):
+        classification = "debug"
+    else:
+        classification = "code"
+    return {
+        "status": "compared",
+        "classification": classification,
+        "sections": {"published": len(published_sections), "rebuilt": len(rebuilt_sections)},
+        "different_sections": [name for name, _ in different][:MAX_SECTIONS],
+        "only_in_published": [name for name, _ in only_in_published][:MAX_SECTIONS],
+        "only_in_rebuilt": [name for name, _ in only_in_rebuilt][:MAX_SECTIONS],
+    }
+
+
+def _mapped_sections(path):
+    with open(path, "rb") as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return elf_sections(data)
+
+
+def analyze_elf_member(member):
+    path, published_file, rebuilt_file = member
+    try:
+        result = compare_elf_sections(_mapped_sections(published_file), _mapped_sections(rebuilt_file))
+    except (OSError, ValueError, struct.error, IndexError) as exc:
+        result = {"status": "error", "error": str(exc)}
+    result["path"] = path
+    return result
+
+
+class ElfMemberAnalyzer:
+    # Analyzes (path, published file, rebuilt file) pairs as the payload
+    # stream spools them and deletes each pair once analyzed, so at most
+    # `workers` pairs are on disk at a time.
+    def __init__(self, workers=ELF_WORKERS):
+        self.workers = workers
+        self.results = {}
+        self._pool = None
+        self._pending = []
+
+    def submit(self, member):
+        if self.workers <= 1:
+            self._store(member, analyze_elf_member(member))
+            return
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        while len(self._pending) >= self.workers:
+            self._wait_oldest()
+        self._pending.append((member, self._pool.submit(analyze_elf_member, member)))
+
+    def close(self):
+        try:
+            while self._pending:
+                self._wait_oldest()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+        return self.results
+
+    def _wait_oldest(self):
+        member, future = self._pending.pop(0)
+        self._store(member, future.result())
+
+    def _store(self, member, result):
+        for path in member[1:]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.results[result["path"]] = result
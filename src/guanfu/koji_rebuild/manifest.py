@@ -0,0 +1,139 @@
+import json
+import sys
+
+
+# Complete manifest diff, written next to report.json.
+MANIFEST_DIFF_NAME = "manifest-diff.jsonl"
+
+FILE_FIELDS = (
+    "size",
+    "mtime",
+    "digest",
+    "mode",
+    "owner",
+    "group",
+    "isconfig",
+    "isdoc",
+    "rdev",
+    "linkto",
+)
+
+
+class FileRecord:
+    # One file of an RPM manifest, as the string columns of `rpm -qp --dump`.
+    # Repeated values (owner, group, mode, ...) are interned and shared.
+    __slots__ = ("path",) + FILE_FIELDS
+
+    def __init__(self, path, size, mtime, digest, mode, owner, group, isconfig, isdoc, rdev, linkto):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+        self.mode = sys.intern(mode)
+        self.owner = sys.intern(owner)
+        self.group = sys.intern(group)
+        self.isconfig = sys.intern(isconfig)
+        self.isdoc = sys.intern(isdoc)
+        self.rdev = sys.intern(rdev)
+        self.linkto = linkto
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def brief(self):
+        return dict((field, getattr(self, field)) for field in FILE_FIELDS)
+
+
+def record_from_dump_line(line):
+    parts = line.split()
+    if len(parts) < 11:
+        return None
+    return FileRecord(parts[0], parts[1], parts[2], parts[3], parts[4], parts[5], parts[6], parts[7], parts[8],
+                      parts[9], " ".join(parts[10:]))
+
+
+def record_from_file(item):
+    # Formats native header values exactly like `rpm -qp --dump`.
+    return FileRecord(
+        item["path"],
+        str(item["size"]),
+        str(item["mtime"]),
+        item["digest"],
+        "0%o" % item["mode"],
+        item["owner"],
+        item["group"],
+        str(item["isconfig"]),
+        str(item["isdoc"]),
+        str(item["rdev"]),
+        item["linkto"] or "X",
+    )
+
+
+class Manifest:
+    def __init__(self, records, unparsed=None):
+        # Sorted by path; a repeated path keeps its last record, like a dict would.
+        by_path = {}
+        for record in records:
+            by_path[record.path] = record
+        self.records = [by_path[path] for path in sorted(by_path)]
+        self.unparsed = unparsed or []
+
+    def __len__(self):
+        return len(self.records)
+
+
+def diff_manifests(published, rebuilt):
+    # Merge-joins two path-sorted manifests, yielding
+    # ("only_in_published", record), ("only_in_rebuilt", record) or
+    # ("changed", {"path", "changed_fields", "published", "rebuilt"}).
+    left = published.records
+    right = rebuilt.records
+    i = j = 0
+    while i < len(left) or j < len(right):
+        if j >= len(right) or (i < len(left) and left[i].path < right[j].path):
+            yield "only_in_published", left[i]
+            i += 1
+        elif i >= len(left) or right[j].path < left[i].path:
+            yield "only_in_rebuilt", right[j]
+            j += 1
+        else:
+            changed_fields = [
+                field for field in FILE_FIELDS if getattr(left[i], field) != getattr(right[j], field)
+            ]
+            if changed_fields:
+                yield "changed", {
+                    "path": left[i].path,
+                    "changed_fields": changed_fields,
+                    "published": left[i],
+                    "rebuilt": right[j],
+                }
+            i += 1
+            j += 1
+
+
+def public_change(entry):
+    return {
+        "path": entry["path"],
+        "changed_fields": entry["changed_fields"],
+        "published": entry["published"].brief(),
+        "rebuilt": entry["rebuilt"].brief(),
+    }
+
+
+class ManifestDiffWriter:
+    # Writes the complete, untruncated manifest diff as JSON lines.
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._handle = open(path, "w", encoding="utf-8")
+
+    def write(self, kind, value):
+        if kind == "changed":
+            line = dict(public_change(value), kind=kind)
+        else:
+            line = {"kind": kind, "path": value.path}
+        self._handle.write(json.dumps(line, sort_keys=True) + "\n")
+        self.records += 1
+
+    def close(self):
+        self._handle.close()
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+CACHE_SCHEMA_VERSION = 1
+FOREVER = None
+MUTABLE_TTL_SECONDS = 300
+NEGATIVE_TTL_SECONDS = 6 * 3600
+
+# Koji build states: BUILDING=0, COMPLETE=1, DELETED=2, FAILED=3, CANCELED=4.
+FINAL_BUILD_STATES = (1, 2, 3, 4)
+# Koji buildroot states: INIT=0, WAITING=1, BUILDING=2, EXPIRED=3.
+FINAL_BUILDROOT_STATES = (3,)
+# Koji task states: FREE=0, OPEN=1, CLOSED=2, CANCELED=3, ASSIGNED=4, FAILED=5.
+FINAL_TASK_STATES = (2, 3, 5)
+
+CACHEABLE_METHODS = (
+    "getRPM",
+    "getBuild",
+    "getBuildroot",
+    "getTaskResult",
+    "getTaskChildren",
+    "listTaskOutput",
+    "getExternalRepoList",
+)
+# Methods whose None result means "no such object" and may be cached as a miss.
+NEGATIVE_CACHEABLE_METHODS = ("getRPM",)
+
+MISSING = object()
+
+
+class KojiMetadataCache:
+    def __init__(self, path, mutable_ttl=MUTABLE_TTL_SECONDS, negative_ttl=NEGATIVE_TTL_SECONDS):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.mutable_ttl = mutable_ttl
+        self.negative_ttl = negative_ttl
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "stored": 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS koji_calls ("
+            "server TEXT NOT NULL, method TEXT NOT NULL, params TEXT NOT NULL, "
+            "value TEXT NOT NULL, negative INTEGER NOT NULL, expires REAL, "
+            "PRIMARY KEY (server, method, params))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS closed_tasks ("
+            "server TEXT NOT NULL, task_id INTEGER NOT NULL, PRIMARY KEY (server, task_id))"
+        )
+        self._db.execute("PRAGMA user_version=%d" % CACHE_SCHEMA_VERSION)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, server, method, params):
+        if method not in CACHEABLE_METHODS:
+            return MISSING
+        key = _params_key(params)
+        if key is None:
+            return MISSING
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, negative, expires FROM koji_calls "
+                "WHERE server = ? AND method = ? AND params = ?",
+                (server, method, key),
+            ).fetchone()
+            if row is None or (row[2] is not None and row[2] < time.time()):
+                self.stats["misses"] += 1
+                return MISSING
+            self.stats["negative_hits" if row[1] else "hits"] += 1
+        return json.loads(row[0])
+
+    def store(self, server, method, params, value):
+        if method not in CACHEABLE_METHODS:
+            return
+        key = _params_key(params)
+        if key is None:
+            return
+        try:
+            encoded = json.dumps(value, sort_keys=True)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._record_closed_tasks(server, method, params, value)
+            ttl = self._ttl(server, method, params, value)
+            expires = None if ttl is FOREVER else time.time() + ttl
+            self._db.execute(
+                "INSERT OR REPLACE INTO koji_calls (server, method, params, value, negative, expires) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (server, method, key, encoded, int(_is_negative(method, value)), expires),
+            )
+            self._db.commit()
+            self.stats["stored"] += 1
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["negative_hits"] + self.stats["misses"]
+        hits = self.stats["hits"] + self.stats["negative_hits"]
+        summary = dict(self.stats)
+        summary["backend"] = "sqlite"
+        summary["lookups"] = lookups
+        summary["hit_rate"] = round(hits / lookups, 4) if lookups else None
+        return summary
+
+    def _ttl(self, server, method, params, value):
+        if _is_negative(method, value):
+            return self.negative_ttl
+        if value is None:
+            return self.mutable_ttl
+        if method == "getRPM":
+            return FOREVER
+        if method == "getBuild":
+            return FOREVER if value.get("state") in FINAL_BUILD_STATES else self.mutable_ttl
+        if method == "getBuildroot":
+            return FOREVER if value.get("state") in FINAL_BUILDROOT_STATES else self.mutable_ttl
+        if method == "getTaskResult":
+            return FOREVER
+        if method == "getTaskChildren":
+            if value and all(child.get("state") in FINAL_TASK_STATES for child in value):
+                return FOREVER
+            return self.mutable_ttl
+        if method == "listTaskOutput":
+            return FOREVER if self._task_closed(server, params[0]) else self.mutable_ttl
+        if method == "getExternalRepoList":
+            return FOREVER if len(params) > 1 and params[1] is not None else self.mutable_ttl
+        return self.mutable_ttl
+
+    def _record_closed_tasks(self, server, method, params, value):
+        task_ids = []
+        if method == "getTaskResult":
+            task_ids.append(params[0])
+        elif method == "getBuild" and value and value.get("state") in FINAL_BUILD_STATES:
+            task_ids.append(value.get("task_id"))
+        elif method == "getTaskChildren":
+            task_ids.extend(
+                child.get("id") for child in value or [] if child.get("state") in FINAL_TASK_STATES
+            )
+        self._db.executemany(
+            "INSERT OR IGNORE INTO closed_tasks (server, task_id) VALUES (?, ?)",
+            [(server, task_id) for task_id in task_ids if isinstance(task_id, int)],
+        )
+
+    def _task_closed(self, server, task_id):
+        row = self._db.execute(
+            "SELECT 1 FROM closed_tasks WHERE server = ? AND task_id = ?",
+            (server, task_id),
+        ).fetchone()
+        return row is not None
+
+
+def _is_negative(method, value):
+    return value is None and method in NEGATIVE_CACHEABLE_METHODS
+
+
+def _params_key(params):
+    try:
+        return json.dumps(list(params), sort_keys=True)
+    except (TypeError, ValueError):
+        return None
@@ -1,11 +1,23 @@
+import re
 import subprocess
 import time
+from datetime import datetime
 from pathlib import Path
 
 from guanfu.koji_rebuild.downloader import summarize_file
 
 _LOG_FILES = ("root.log", "build.log", "state.log")
 _LOG_TAIL_BYTES = 128 * 1024
+# state.log stage names and the timeline phase each one is reported as;
+# rpmbuild covers %prep through writing the binary RPMs.
+_MOCK_STAGES = (
+    ("chroot init", "mock_root_init"),
+    ("build setup for ", "build_setup"),
+    ("rpmbuild ", "rpmbuild"),
+)
+_STATE_LOG_LINE = re.compile(
+    r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) - (Start|Finish)(\(bootstrap\))?: (.+?)\s*$"
+)
 _RUNTIME_CRASH_MARKERS = (
     "scriptlet failed, signal 11",
     "scriptlet failed, signal 4",
@@ -42,6 +54,9 @@ def run_rebuild(mock_cfg, srpm, resultdir, isolation="simple"):
         "command": cmd,
         "rpms": [summarize_file(path) for path in _list_result_rpms(resultdir)],
     }
+    stages = mock_stage_timings(resultdir)
+    if stages:
+        result["stages"] = stages
     if proc.returncode != 0:
         diagnosis = _diagnose_mock_failure(resultdir)
         if diagnosis:
@@ -49,6 +64,42 @@ def run_rebuild(mock_cfg, srpm, resultdir, isolation="simple"):
     return result
 
 
+def mock_stage_timings(resultdir):
+    # Stage durations from mock's state.log, with start/end in seconds after
+    # its first entry. Bootstrap chroot stages get a "bootstrap_" prefix.
+    path = Path(resultdir) / "state.log"
+    if not path.exists():
+        return []
+    origin = None
+    started = {}
+    stages = []
+    for line in path.read_text(errors="replace").splitlines():
+        match = _STATE_LOG_LINE.match(line)
+        if not match:
+            continue
+        stamp = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp() + int(match.group(2)) / 1000.0
+        if origin is None:
+            origin = stamp
+        for prefix, phase in _MOCK_STAGES:
+            if match.group(5).startswith(prefix):
+                if match.group(4):
+                    phase = "bootstrap_" + phase
+                if match.group(3) == "Start":
+                    started.setdefault(phase, stamp - origin)
+                elif phase in started:
+                    start = started.pop(phase)
+                    stages.append(
+                        {
+                            "stage": phase,
+                            "start": round(start, 3),
+                            "end": round(stamp - origin, 3),
+                            "seconds": round(stamp - origin - start, 3),
+                        }
+                    )
+                break
+    return stages
+
+
 def _diagnose_mock_failure(resultdir):
     evidence = _runtime_crash_evidence(resultdir)
     if not evidence:
@@ -0,0 +1,339 @@
+import bz2
+import contextlib
+import gzip
+import hashlib
+import lzma
+import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    import zstandard
+except ImportError:  # optional; the zstd CLI is used instead
+    zstandard = None
+
+from guanfu.koji_rebuild.elf_compare import ELF_MAGIC
+
+
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = 4096
+MAX_DIFF_FILES = 50
+MAX_DIFF_RANGES = 8
+RANGE_SAMPLE_BYTES = 32
+# Identical leading bytes of an ELF pair held in memory before spooling.
+SPOOL_PREFIX_BYTES = 64 * 1024 * 1024
+# Differences closer than this are reported as one range.
+RANGE_MERGE_GAP = 16
+
+CPIO_NEWC_MAGICS = (b"070701", b"070702")
+CPIO_STRIPPED_MAGIC = b"07070X"
+CPIO_TRAILER = "TRAILER!!!"
+
+
+@contextlib.contextmanager
+def payload_stream(package):
+    # Yields a readable stream of the decompressed cpio payload.
+    payload_format = package.format_tag("PAYLOADFORMAT")
+    if payload_format not in ("cpio", "(none)"):
+        raise ValueError("unsupported RPM payload format: %s" % payload_format)
+    compressor = package.format_tag("PAYLOADCOMPRESSOR")
+    with open(package.path, "rb") as raw:
+        raw.seek(package.payload_offset)
+        if compressor in ("(none)", "none", ""):
+            yield raw
+        elif compressor == "gzip":
+            with gzip.GzipFile(fileobj=raw) as stream:
+                yield stream
+        elif compressor in ("xz", "lzma"):
+            with lzma.LZMAFile(raw) as stream:
+                yield stream
+        elif compressor == "bzip2":
+            with bz2.BZ2File(raw) as stream:
+                yield stream
+        elif compressor == "zstd" and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+                yield stream
+        elif compressor == "zstd":
+            with _zstd_cli_stream(raw) as stream:
+                yield stream
+        else:
+            raise ValueError("unsupported RPM payload compressor: %s" % compressor)
+
+
+@contextlib.contextmanager
+def _zstd_cli_stream(raw):
+    zstd = shutil.which("zstd")
+    if not zstd:
+        raise ValueError("zstd payload requires the zstandard module or the zstd CLI")
+    proc = subprocess.Popen([zstd, "-dc"], stdin=raw, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+class _Reader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.offset = 0
+
+    def read_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                raise ValueError("truncated cpio payload")
+            data += chunk
+        self.offset += size
+        return data
+
+    def skip_padding(self):
+        padding = -self.offset % 4
+        if padding:
+            self.read_exact(padding)
+
+
+class CpioMember:
+    def __init__(self, reader, path, size, mode):
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self._reader = reader
+        self._remaining = size
+
+    def read(self, size=CHUNK_SIZE):
+        size = min(size, self._remaining)
+        if size <= 0:
+            return b""
+        data = self._reader.read_exact(size)
+        self._remaining -= len(data)
+        return data
+
+    def drain(self):
+        while self.read():
+            pass
+
+
+def _normalize_path(name):
+    if name.startswith("./"):
+        name = name[1:]
+    elif not name.startswith("/"):
+        name = "/" + name
+    return name
+
+
+def iter_cpio(stream, package):
+    # Handles both the newc format and rpm's stripped "07070X" format, which
+    # keeps only a file index and takes the metadata from the header.
+    reader = _Reader(stream)
+    files = None
+    while True:
+        magic = reader.read_exact(6)
+        if magic == CPIO_STRIPPED_MAGIC:
+            index = int(reader.read_exact(8), 16)
+            if files is None:
+                files = package.files()
+            entry = files[index]
+            member = CpioMember(reader, entry["path"], entry["size"], entry["mode"])
+        elif magic in CPIO_NEWC_MAGICS:
+            fields = reader.read_exact(104)
+            values = [int(fields[offset : offset + 8], 16) for offset in range(0, 104, 8)]
+            mode, size, namesize = values[1], values[6], values[11]
+            name = reader.read_exact(namesize)[:-1].decode("utf-8", "surrogateescape")
+            reader.skip_padding()
+            if name == CPIO_TRAILER:
+                return
+            member = CpioMember(reader, _normalize_path(name), size, mode)
+        else:
+            raise ValueError("bad cpio magic %r" % magic)
+        yield member
+        member.drain()
+        reader.skip_padding()
+
+
+def _diff_ranges(left, right, base, ranges, limit):
+    # Appends (offset, end) ranges where left and right differ; returns False
+    # once the range limit is exceeded.
+    for block in range(0, max(len(left), len(right)), BLOCK_SIZE):
+        a = left[block : block + BLOCK_SIZE]
+        b = right[block : block + BLOCK_SIZE]
+        if a == b:
+            continue
+        for index in range(max(len(a), len(b))):
+            if index < len(a) and index < len(b) and a[index] == b[index]:
+                continue
+            offset = base + block + index
+            if ranges and offset - ranges[-1][1] <= RANGE_MERGE_GAP:
+                ranges[-1][1] = offset + 1
+            elif len(ranges) >= limit:
+                return False
+            else:
+                ranges.append([offset, offset + 1])
+    return True
+
+
+def _start_spool(spool_dir, prefix, prefix_file):
+    # Opens one spool file per side at the first differing chunk and
+    # back-fills the identical prefix read so far.
+    files = []
+    for side in ("published", "rebuilt"):
+        handle, path = tempfile.mkstemp(prefix=side + "-", dir=spool_dir)
+        files.append((os.fdopen(handle, "wb"), path))
+    if prefix_file is not None:
+        prefix_file[0].close()
+        for handle, _ in files:
+            with open(prefix_file[1], "rb") as source:
+                shutil.copyfileobj(source, handle, CHUNK_SIZE)
+        os.unlink(prefix_file[1])
+    for chunk in prefix:
+        for handle, _ in files:
+            handle.write(chunk)
+    return files
+
+
+def _compare_members(published, rebuilt, max_ranges, spool_dir=None):
+    # Differing ELF members are also spooled to spool_dir so the section
+    # analyzer can memory-map them. Spooling starts at the first differing
+    # chunk; the identical prefix before it is kept once, in memory up to
+    # SPOOL_PREFIX_BYTES, so identical members never reach the disk.
+    published_hash = hashlib.sha256()
+    rebuilt_hash = hashlib.sha256()
+    ranges = []
+    samples = []
+    complete = True
+    offset = 0
+    elf = False
+    prefix = []
+    prefix_size = 0
+    prefix_file = None
+    spool = None
+    while True:
+        left = published.read()
+        right = rebuilt.read()
+        if not left and not right:
+            break
+        published_hash.update(left)
+        rebuilt_hash.update(right)
+        if offset == 0:
+            elf = bool(spool_dir) and left[:4] == ELF_MAGIC and right[:4] == ELF_MAGIC
+        if elf and spool is None:
+            if left != right:
+                spool = _start_spool(spool_dir, prefix, prefix_file)
+                prefix, prefix_file = [], None
+            elif prefix_file is not None:
+                prefix_file[0].write(left)
+            else:
+                prefix.append(left)
+                prefix_size += len(left)
+                if prefix_size > SPOOL_PREFIX_BYTES:
+                    # Very large members: keep the shared prefix on disk once.
+                    handle, path = tempfile.mkstemp(prefix="prefix-", dir=spool_dir)
+                    prefix_file = (os.fdopen(handle, "wb"), path)
+                    for chunk in prefix:
+                        prefix_file[0].write(chunk)
+                    prefix = []
+        if spool:
+            spool[0][0].write(left)
+            spool[1][0].write(right)
+        if left != right and complete:
+            before = len(ranges)
+            complete = _diff_ranges(left, right, offset, ranges, max_ranges)
+            for start, end in ranges[before:]:
+                samples.append((start, left[start - offset : start - offset + RANGE_SAMPLE_BYTES],
+                                right[start - offset : start - offset + RANGE_SAMPLE_BYTES]))
+        offset += max(len(left), len(right))
+    if prefix_file is not None:
+        prefix_file[0].close()
+        os.unlink(prefix_file[1])
+    if spool:
+        for handle, _ in spool:
+            handle.close()
+    if published_hash.digest() == rebuilt_hash.digest():
+        if spool:
+            for _, path in spool:
+                os.unlink(path)
+        return None
+    sample_by_start = dict((start, (left, right)) for start, left, right in samples)
+    return {
+        "path": published.path,
+        "published_size": published.size,
+        "rebuilt_size": rebuilt.size,
+        "published_sha256": published_hash.hexdigest(),
+        "rebuilt_sha256": rebuilt_hash.hexdigest(),
+        "ranges": [
+            {
+                "offset": start,
+                "length": end - start,
+                "published": sample_by_start.get(start, (b"", b""))[0].hex(),
+                "rebuilt": sample_by_start.get(start, (b"", b""))[1].hex(),
+            }
+            for start, end in ranges
+        ],
+        "ranges_truncated": not complete,
+        "_spooled": (spool[0][1], spool[1][1]) if spool else None,
+    }
+
+
+def _next_member(members):
+    return next(members, None)
+
+
+def compare_payloads(
+    published_package,
+    rebuilt_package,
+    max_files=MAX_DIFF_FILES,
+    max_ranges=MAX_DIFF_RANGES,
+    spool_dir=None,
+    elf_member=None,
+):
+    # Streams both payloads side by side; members are merge-joined by path.
+    # With spool_dir and elf_member, each differing ELF member is spooled
+    # there and handed to elf_member((path, published file, rebuilt file))
+    # as soon as it is complete; the callback owns the files from then on.
+    counts = {"compared": 0, "identical": 0, "different": 0, "only_in_published": 0, "only_in_rebuilt": 0}
+    different = []
+    only_in_published = []
+    only_in_rebuilt = []
+    with payload_stream(published_package) as published_stream, payload_stream(rebuilt_package) as rebuilt_stream:
+        published_members = iter_cpio(published_stream, published_package)
+        rebuilt_members = iter_cpio(rebuilt_stream, rebuilt_package)
+        left = _next_member(published_members)
+        right = _next_member(rebuilt_members)
+        while left is not None or right is not None:
+            if right is None or (left is not None and left.path < right.path):
+                counts["only_in_published"] += 1
+                only_in_published.append(left.path)
+                left = _next_member(published_members)
+            elif left is None or right.path < left.path:
+                counts["only_in_rebuilt"] += 1
+                only_in_rebuilt.append(right.path)
+                right = _next_member(rebuilt_members)
+            else:
+                counts["compared"] += 1
+                diff = _compare_members(left, right, max_ranges, spool_dir if elf_member else None)
+                if diff:
+                    counts["different"] += 1
+                    different.append(diff)
+                    spooled = diff.pop("_spooled")
+                    if spooled:
+                        elf_member((diff["path"],) + spooled)
+                else:
+                    counts["identical"] += 1
+                left = _next_member(published_members)
+                right = _next_member(rebuilt_members)
+    return {
+        "status": "compared",
+        "compressors": {
+            "published": published_package.format_tag("PAYLOADCOMPRESSOR"),
+            "rebuilt": rebuilt_package.format_tag("PAYLOADCOMPRESSOR"),
+        },
+        "members": counts,
+        "different_files": different[:max_files],
+        "different_files_truncated": len(different) > max_files,
+        "only_in_published": only_in_published[:max_files],
+        "only_in_rebuilt": only_in_rebuilt[:max_files],
+    }
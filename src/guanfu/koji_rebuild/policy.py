@@ -0,0 +1,181 @@
+import fnmatch
+import hashlib
+import json
+import re
+
+
+# Path categories used by assessment. A category matches a path through any of
+# "paths" (exact), "prefixes", "extensions", "contains" or "globs" (fnmatch,
+# "*" also matches "/"). "risk" raises the risk of files in the category,
+# "security_relevant" marks their changes as security relevant, and
+# "diff_type" routes content changes of those files to that diff type.
+DEFAULT_POLICY = {
+    "name": "builtin",
+    "version": "1",
+    "categories": {
+        "highly_sensitive": {
+            "paths": ["/etc/ld.so.preload", "/etc/profile", "/etc/sudoers"],
+            "risk": "critical",
+            "security_relevant": True,
+        },
+        "sensitive": {
+            "prefixes": [
+                "/bin/",
+                "/sbin/",
+                "/usr/bin/",
+                "/usr/sbin/",
+                "/usr/lib/systemd/",
+                "/usr/lib64/systemd/",
+                "/etc/systemd/",
+                "/etc/cron",
+                "/etc/pam.d/",
+            ],
+            "risk": "high",
+            "security_relevant": True,
+        },
+        "doc": {
+            "prefixes": ["/usr/share/doc/", "/usr/share/info/", "/usr/share/licenses/", "/usr/share/man/"],
+        },
+        "config": {
+            "prefixes": ["/etc/"],
+        },
+        "debug": {
+            "prefixes": ["/usr/lib/debug/", "/usr/lib64/debug/"],
+            "contains": ["/.debug/", ".gnu_debug"],
+            "extensions": [".debug"],
+        },
+        "buildid": {
+            "contains": ["/.build-id/"],
+            "extensions": ["/.build-id"],
+        },
+        "script": {
+            "prefixes": ["/etc/init.d/", "/etc/profile.d/"],
+            "extensions": [".bash", ".csh", ".fish", ".ksh", ".lua", ".pl", ".py", ".rb", ".sh", ".zsh"],
+        },
+        "compressed": {
+            "extensions": [".bz2", ".gz", ".lzma", ".xz", ".zst", ".zip"],
+        },
+        "library_dir": {
+            "prefixes": ["/lib/", "/lib64/", "/usr/lib/", "/usr/lib64/"],
+        },
+        "library_file": {
+            "contains": [".so"],
+            "extensions": [".a", ".o"],
+        },
+    },
+}
+
+RISK_LEVELS = ["none", "low", "medium", "high", "critical"]
+# Diff types an assessment item can carry; "diff_type" must name one of them.
+DIFF_TYPES = set([
+    "BINARY_BUILDID",
+    "BINARY_CODE",
+    "BUILDID_SYMLINK",
+    "COMPRESSION",
+    "CONFIG_CONTENT",
+    "DEBUG_INFO",
+    "DOC_CONTENT",
+    "FILE_ADDED",
+    "FILE_PERMISSION",
+    "FILE_REMOVED",
+    "FILE_TIMESTAMP",
+    "OTHER",
+    "RPM_METADATA",
+    "RPM_SIGNATURE",
+    "SCRIPT_CONTENT",
+    "SYMLINK_TARGET",
+])
+RULE_KEYS = set(["paths", "prefixes", "extensions", "contains", "globs", "risk", "security_relevant", "diff_type"])
+_TERMINAL = ""
+
+
+class CompiledPolicy:
+    # Exact paths and prefixes live in a character trie; extensions, substrings
+    # and globs are folded into one regex with an optional lookahead group per
+    # category, so a single match reports every category at once.
+    def __init__(self, policy, source=None):
+        self.name = policy.get("name", "custom")
+        self.version = str(policy.get("version", "1"))
+        self.source = source
+        self.digest = hashlib.sha256(json.dumps(policy, sort_keys=True).encode("utf-8")).hexdigest()
+        self.risks = {}
+        self.security_relevant = set()
+        self.diff_types = []
+        self._exact = {}
+        self._trie = {}
+        groups = []
+        self._group_categories = {}
+        for index, (category, rule) in enumerate(policy.get("categories", {}).items()):
+            unknown = set(rule) - RULE_KEYS
+            if unknown:
+                raise ValueError("unknown keys in policy category %s: %s" % (category, ", ".join(sorted(unknown))))
+            if rule.get("risk") and rule["risk"] not in RISK_LEVELS:
+                raise ValueError(
+                    "assessment policy %s: category %s has unknown risk %r (expected one of %s)"
+                    % (source or self.name, category, rule["risk"], ", ".join(RISK_LEVELS))
+                )
+            if rule.get("diff_type") and rule["diff_type"] not in DIFF_TYPES:
+                raise ValueError(
+                    "assessment policy %s: category %s has unknown diff_type %r"
+                    % (source or self.name, category, rule["diff_type"])
+                )
+            if rule.get("risk"):
+                self.risks[category] = rule["risk"]
+            if rule.get("security_relevant"):
+                self.security_relevant.add(category)
+            if rule.get("diff_type"):
+                self.diff_types.append((category, rule["diff_type"]))
+            for path in rule.get("paths", []):
+                self._exact.setdefault(path, set()).add(category)
+            for prefix in rule.get("prefixes", []):
+                node = self._trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(_TERMINAL, set()).add(category)
+            patterns = [".*" + re.escape(value) + r"\Z" for value in rule.get("extensions", [])]
+            patterns.extend(".*" + re.escape(value) for value in rule.get("contains", []))
+            patterns.extend(fnmatch.translate(glob) for glob in rule.get("globs", []))
+            if patterns:
+                group = "c%d" % index
+                self._group_categories[group] = category
+                groups.append("(?=(?P<%s>%s))?" % (group, "|".join(patterns)))
+        self._regex = re.compile("".join(groups), re.DOTALL) if groups else None
+
+    def categories(self, path):
+        found = set(self._exact.get(path, ()))
+        node = self._trie
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            found.update(node.get(_TERMINAL, ()))
+        if self._regex is not None:
+            match = self._regex.match(path)
+            for group, value in match.groupdict().items():
+                if value is not None:
+                    found.add(self._group_categories[group])
+        return found
+
+    def summary(self):
+        return {"name": self.name, "version": self.version, "source": self.source, "sha256": self.digest}
+
+
+_DEFAULT = None
+
+
+def default_policy():
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = CompiledPolicy(DEFAULT_POLICY)
+    return _DEFAULT
+
+
+def load_policy(path=None):
+    # A site policy file replaces the built-in categories entirely.
+    if not path:
+        return default_policy()
+    with open(path, encoding="utf-8") as handle:
+        policy = json.load(handle)
+    if not isinstance(policy, dict) or not isinstance(policy.get("categories"), dict):
+        raise ValueError("assessment policy %s must be a JSON object with a categories object" % path)
+    return CompiledPolicy(policy, source=str(path))
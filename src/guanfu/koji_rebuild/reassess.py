@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from guanfu.koji_rebuild.assessment import ASSESSMENT_VERSION
+from guanfu.koji_rebuild.compare import compare_build, compare_published_and_rebuilt
+from guanfu.koji_rebuild.downloader import remember_sha256, sha256_file
+from guanfu.koji_rebuild.manifest import MANIFEST_DIFF_NAME
+from guanfu.koji_rebuild.policy import load_policy
+from guanfu.koji_rebuild.report import write_json
+
+
+DEFAULT_ASSESS_WORKERS = 4
+# Run directory children that never contain other run directories.
+SKIP_DIRS = set(["inputs", "results", "metadata", "cache"])
+
+
+def assessment_fingerprint(run_dir, paths, policy, previous=None):
+    # Digests are reused from the previous fingerprint when size and mtime
+    # are unchanged, so unchanged runs are recognized without rehashing.
+    run_dir = Path(run_dir).resolve()
+    known = (previous or {}).get("inputs", {})
+    inputs = {}
+    for path in sorted(Path(item).resolve() for item in paths):
+        stat = path.stat()
+        try:
+            name = str(path.relative_to(run_dir))
+        except ValueError:
+            name = str(path)
+        old = known.get(name)
+        if old and old.get("size") == stat.st_size and old.get("mtime_ns") == stat.st_mtime_ns:
+            digest = old["sha256"]
+            remember_sha256(path, digest)
+        else:
+            digest = sha256_file(path)
+        inputs[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+    material = {
+        "assessment_version": ASSESSMENT_VERSION,
+        "policy_sha256": policy.digest,
+        "inputs": dict((name, item["sha256"]) for name, item in inputs.items()),
+    }
+    return {
+        "sha256": hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest(),
+        "assessment_version": ASSESSMENT_VERSION,
+        "policy_sha256": policy.digest,
+        "inputs": inputs,
+    }
+
+
+def find_run_dirs(paths):
+    found = []
+    for root in paths:
+        for dirpath, dirnames, filenames in os.walk(root):
+            if "report.json" in filenames:
+                found.append(Path(dirpath))
+            dirnames[:] = sorted(name for name in dirnames if name not in SKIP_DIRS)
+    return sorted(set(found))
+
+
+def _run_inputs(run_dir, report):
+    target = (report.get("metadata") or {}).get("package_name")
+    if not target:
+        return None, None, "report.json has no metadata.package_name"
+    published = run_dir / "inputs" / target
+    if not published.is_file():
+        return None, None, "published RPM %s is not stored in inputs/" % target
+    rebuilt = sorted((run_dir / "results" / "result-run-1").glob("*.rpm"))
+    if not rebuilt:
+        return None, None, "no rebuilt RPMs under results/result-run-1/"
+    return published, rebuilt, None
+
+
+def _build_items(run_dir, report, rebuilt, target, comparison):
+    references = dict(
+        (item["package_name"], item.get("reference_url"))
+        for item in report["build_comparison"].get("packages", [])
+    )
+    items = []
+    for path in rebuilt:
+        if path.name.endswith(".src.rpm"):
+            continue
+        item = {"package_name": path.name, "rebuilt": str(path), "reference_url": references.get(path.name)}
+        if path.name == target:
+            item["comparison"] = comparison
+        elif (run_dir / "inputs" / "published" / path.name).is_file():
+            item["published"] = str(run_dir / "inputs" / "published" / path.name)
+        else:
+            item["error"] = "published RPM is not stored in inputs/published/"
+        items.append(item)
+    return items
+
+
+def reassess_run(run_dir, policy, force=False):
+    run_dir = Path(run_dir)
+    report_path = run_dir / "report.json"
+    try:
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+        published, rebuilt, reason = _run_inputs(run_dir, report)
+        if reason:
+            return {"run_dir": str(run_dir), "status": "skipped", "reason": reason}
+        build_scope = bool(report.get("build_comparison"))
+        paths = [published] + rebuilt
+        if build_scope:
+            paths.extend(sorted((run_dir / "inputs" / "published").glob("*.rpm")))
+        fingerprint = assessment_fingerprint(run_dir, paths, policy, report.get("assessment_fingerprint"))
+        unchanged = (
+            fingerprint["sha256"] == (report.get("assessment_fingerprint") or {}).get("sha256")
+            and report.get("version") == ASSESSMENT_VERSION
+        )
+        if unchanged and not force:
+            return {"run_dir": str(run_dir), "status": "unchanged"}
+
+        target = report["metadata"]["package_name"]
+        comparison = compare_published_and_rebuilt(
+            published,
+            rebuilt,
+            target,
+            reference_url=report["metadata"].get("reference_url"),
+            elf_workers=1,
+            manifest_diff_path=run_dir / MANIFEST_DIFF_NAME,
+            policy=policy,
+        )
+        for key in ("version", "metadata", "analysis", "overall_assessment", "diff_items", "summary_stats"):
+            report[key] = comparison[key]
+        if build_scope:
+            build = compare_build(_build_items(run_dir, report, rebuilt, target, comparison), workers=1, policy=policy)
+            report["build_comparison"].update(build)
+        report["assessment_fingerprint"] = fingerprint
+        write_json(report_path, report)
+    except Exception as exc:
+        return {"run_dir": str(run_dir), "status": "error", "error": repr(exc)}
+    return {
+        "run_dir": str(run_dir),
+        "status": "reassessed",
+        "trust_level": report["overall_assessment"].get("trust_level"),
+    }
+
+
+def run_assess(args):
+    policy = load_policy(getattr(args, "assessment_policy", None))
+    run_dirs = find_run_dirs(args.paths)
+    if not run_dirs:
+        print("[guanfu] No run directories with report.json found", file=sys.stderr)
+        return 1
+    workers = max(1, getattr(args, "workers", DEFAULT_ASSESS_WORKERS))
+    force = getattr(args, "force", False)
+    if workers > 1 and len(run_dirs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(run_dirs))) as pool:
+            results = list(pool.map(reassess_run, run_dirs, [policy] * len(run_dirs), [force] * len(run_dirs)))
+    else:
+        results = [reassess_run(run_dir, policy, force) for run_dir in run_dirs]
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        detail = result.get("trust_level") or result.get("reason") or result.get("error") or ""
+        print(f"[guanfu] {result['status']}: {result['run_dir']} {detail}".rstrip())
+    print("[guanfu] Assessed %d run directories: %s" % (
+        len(results),
+        ", ".join("%s=%d" % (status, count) for status, count in sorted(counts.items())),
+    ))
+    return 1 if counts.get("error") else 0
@@ -1,5 +1,6 @@
 import bz2
 import gzip
+import hashlib
 import lzma
 import os
 import re
@@ -11,7 +12,16 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 from xml.sax.saxutils import escape
 
-from guanfu.koji_rebuild.downloader import download_task_output, download_url, summarize_file
+from guanfu.koji_rebuild.downloader import (
+    download_koji_file,
+    download_url,
+    join_url,
+    koji_build_url,
+    koji_task_output_url,
+    summarize_file,
+)
+from guanfu.koji_rebuild.repodata_index import build_index_from_packages, install_primary_db, open_index
+from guanfu.koji_rebuild.rpm_header import read_package
 from guanfu.koji_rebuild.rpm_name import rpm_filename
 
 
@@ -85,10 +95,10 @@ def _local_name(element):
     return element.tag.rsplit("}", 1)[-1]
 
 
-def _find_primary_location(repomd_path):
+def _find_repomd_data(repomd_path, data_type):
     tree = ET.parse(repomd_path)
     for data in tree.getroot():
-        if _local_name(data) != "data" or data.get("type") != "primary":
+        if _local_name(data) != "data" or data.get("type") != data_type:
             continue
         location = None
         checksum = None
@@ -103,7 +113,14 @@ def _find_primary_location(repomd_path):
                 open_checksum = {"type": child.get("type"), "value": child.text}
         if location:
             return {"href": location, "checksum": checksum, "open_checksum": open_checksum}
-    raise RuntimeError("external repo repomd.xml does not contain primary metadata")
+    return None
+
+
+def _find_primary_location(repomd_path):
+    primary = _find_repomd_data(repomd_path, "primary")
+    if not primary:
+        raise RuntimeError("external repo repomd.xml does not contain primary metadata")
+    return primary
 
 
 def _parse_primary_packages(primary_path):
@@ -137,7 +154,16 @@ def _parse_primary_packages(primary_path):
             package.clear()
 
 
+HEADER_QUERY_TAGS = ("NAME", "VERSION", "RELEASE", "ARCH", "BUILDTIME", "SIZE", "SIGMD5", "SOURCERPM", "VENDOR", "PACKAGER")
+
+
 def _rpm_query(path):
+    try:
+        package = read_package(path)
+    except (OSError, ValueError):
+        package = None
+    if package is not None:
+        return dict((tag.lower(), package.format_tag(tag)) for tag in HEADER_QUERY_TAGS)
     query = (
         "NAME=%{NAME}\\n"
         "VERSION=%{VERSION}\\n"
@@ -190,48 +216,152 @@ def _task_output_has_file(outputs, filename):
     return filename in (outputs or [])
 
 
-def _find_task_output(client, build_task_id, filename, cache):
-    if build_task_id in cache:
-        task_outputs = cache[build_task_id]
-    else:
+def _multicall_values(results):
+    values = []
+    for value, error in results:
+        if error is not None:
+            raise error
+        values.append(value)
+    return values
+
+
+def _prefetch_task_outputs(client, build_task_ids, cache):
+    build_task_ids = [task_id for task_id in dict.fromkeys(build_task_ids) if task_id not in cache]
+    if not build_task_ids:
+        return
+    members_by_task = {}
+    for build_task_id, children in zip(
+        build_task_ids,
+        _multicall_values(client.get_tasks_children(build_task_ids)),
+    ):
+        members_by_task[build_task_id] = [build_task_id] + [
+            child["id"] for child in children or [] if child.get("id") is not None
+        ]
+    task_ids = [task_id for members in members_by_task.values() for task_id in members]
+    outputs_by_task = dict(zip(task_ids, client.list_tasks_output(task_ids)))
+    for build_task_id, members in members_by_task.items():
         task_outputs = []
-        try:
-            task_outputs.append((build_task_id, client.list_task_output(build_task_id)))
-        except Exception:
-            pass
-        for child in client.get_task_children(build_task_id):
-            task_id = child.get("id")
-            if task_id is None:
-                continue
-            try:
-                task_outputs.append((task_id, client.list_task_output(task_id)))
-            except Exception:
-                continue
+        for task_id in members:
+            outputs, error = outputs_by_task[task_id]
+            if error is None:
+                task_outputs.append((task_id, outputs))
         cache[build_task_id] = task_outputs
 
-    for task_id, outputs in task_outputs:
+
+def _find_task_output(client, build_task_id, filename, cache):
+    _prefetch_task_outputs(client, [build_task_id], cache)
+    for task_id, outputs in cache[build_task_id]:
         if _task_output_has_file(outputs, filename):
             return task_id
     return None
 
 
-def _download_dependency(client, task_id, filename, repo_dir):
+def _dependency_urls(koji_topurl, item):
+    if not koji_topurl:
+        return []
+    return [
+        koji_build_url(koji_topurl, item["build"], item["rpm"]["arch"], item["filename"]),
+        koji_task_output_url(koji_topurl, item["output_task_id"], item["filename"]),
+    ]
+
+
+def _download_dependency(client, item, repo_dir, koji_topurl=None, store=None):
+    filename = item["filename"]
+    expected_sigmd5 = item["rpm"].get("payloadhash")
     path = Path(repo_dir) / filename
     if path.exists() and path.stat().st_size > 0:
-        return summarize_file(path, label="recovered_dependency_rpm")
-    download_task_output(client, task_id, filename, path)
-    return summarize_file(path, label="recovered_dependency_rpm")
+        artifact = summarize_file(path, label="recovered_dependency_rpm")
+        artifact["transport"] = "local"
+        return artifact
+    path, transfer = download_koji_file(
+        client,
+        item["output_task_id"],
+        filename,
+        path,
+        urls=_dependency_urls(koji_topurl, item),
+        expected_sigmd5=expected_sigmd5,
+        store=store,
+    )
+    artifact = summarize_file(path, label="recovered_dependency_rpm", url=transfer.get("url"))
+    artifact["transport"] = transfer["transport"]
+    return artifact
 
 
 def _repo_event(buildroot):
     return buildroot.get("repo_create_event_id") or buildroot.get("create_event_id")
 
 
-def _external_repo_metadata(client, buildroot, metadata_dir):
+def _check_metadata_checksum(summary, checksum):
+    # repomd.xml may name any hashlib algorithm ("sha" is the createrepo spelling of
+    # sha1); metadata whose checksum cannot be checked is refused, not cached.
+    if not checksum:
+        return
+    algorithm = {"sha": "sha1"}.get(checksum.get("type"), checksum.get("type"))
+    if algorithm not in hashlib.algorithms_available:
+        raise RuntimeError("unsupported repodata checksum type %r for %s" % (checksum.get("type"), summary["file"]))
+    digest = summary["sha256"] if algorithm == "sha256" else _file_digest(summary["path"], algorithm)
+    if digest != (checksum.get("value") or "").lower():
+        raise RuntimeError(
+            "repodata checksum mismatch for %s: expected %s %s, got %s"
+            % (summary["file"], checksum.get("type"), checksum.get("value"), digest)
+        )
+
+
+def _file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_primary_db_index(base_url, repo_dir, primary_db_info, index_dir, item):
+    checksum = primary_db_info["checksum"]
+    index = open_index(index_dir, "primary_db", checksum)
+    if index is None:
+        url = _url_join(base_url, primary_db_info["href"])
+        primary_db = _download_metadata(url, repo_dir / Path(primary_db_info["href"]).name)
+        _check_metadata_checksum(primary_db, checksum)
+        item["primary_db"] = primary_db
+        index = install_primary_db(index_dir, checksum, primary_db["path"], _open_metadata)
+    return index
+
+
+def _load_primary_xml_index(base_url, repo_dir, primary_info, index_dir, item):
+    checksum = primary_info.get("checksum")
+    index = open_index(index_dir, "primary", checksum) if checksum else None
+    if index is None:
+        url = _url_join(base_url, primary_info["href"])
+        primary = _download_metadata(url, repo_dir / Path(primary_info["href"]).name)
+        _check_metadata_checksum(primary, checksum)
+        item["primary"] = primary
+        checksum = checksum or {"type": "sha256", "value": primary["sha256"]}
+        index = open_index(index_dir, "primary", checksum) or build_index_from_packages(
+            index_dir,
+            checksum,
+            _parse_primary_packages(primary["path"]),
+        )
+    return index
+
+
+def _load_repo_index(base_url, repo_dir, repomd_path, index_dir, item):
+    primary_db_info = _find_repomd_data(repomd_path, "primary_db")
+    if primary_db_info and primary_db_info.get("checksum"):
+        item["primary_db_info"] = primary_db_info
+        try:
+            return _load_primary_db_index(base_url, repo_dir, primary_db_info, index_dir, item)
+        except Exception as exc:
+            item["primary_db_error"] = repr(exc)
+    return _load_primary_xml_index(base_url, repo_dir, item["primary_info"], index_dir, item)
+
+
+def _external_repo_metadata(client, buildroot, metadata_dir, index_dir=None):
     event = _repo_event(buildroot)
     repos = client.get_external_repo_list(buildroot["tag_name"], event)
     arch = buildroot["arch"]
+    index_dir = Path(index_dir) if index_dir else Path(metadata_dir) / "external-repos" / "index"
     metadata = []
+    indexes = []
     for index, repo in enumerate(repos or []):
         base_url = _replace_repo_arch(repo["url"], arch)
         repo_dir = Path(metadata_dir) / "external-repos" / ("%02d-%s" % (index, repo["external_repo_name"]))
@@ -239,39 +369,80 @@ def _external_repo_metadata(client, buildroot, metadata_dir):
         item = dict(repo)
         item["event_id"] = event
         item["resolved_url"] = base_url
+        repo_index = None
         try:
             repomd_url = _url_join(base_url, "repodata/repomd.xml")
-            repomd = _download_metadata(repomd_url, repo_dir / "repomd.xml")
-            primary_info = _find_primary_location(repo_dir / "repomd.xml")
-            primary_url = _url_join(base_url, primary_info["href"])
-            primary = _download_metadata(primary_url, repo_dir / Path(primary_info["href"]).name)
-            item["repomd"] = repomd
-            item["primary"] = primary
-            item["primary_info"] = primary_info
+            item["repomd"] = _download_metadata(repomd_url, repo_dir / "repomd.xml")
+            item["primary_info"] = _find_primary_location(repo_dir / "repomd.xml")
+            repo_index = _load_repo_index(base_url, repo_dir, repo_dir / "repomd.xml", index_dir, item)
+            item["index"] = repo_index.summary()
             item["status"] = "ready"
         except Exception as exc:
             item["status"] = "error"
             item["error"] = repr(exc)
         metadata.append(item)
-    return metadata
+        indexes.append(repo_index)
+    return metadata, indexes
 
 
-def _find_external_package(repo_metadata, entry):
-    expected = _parse_nevra(entry["rpm_lookup"])
-    for repo in repo_metadata:
-        if repo.get("status") != "ready":
+def _published_repo_roots(base_url):
+    # --binary-rpm-base-url usually points at <repo>/Packages/; repodata lives in <repo>/.
+    base_url = base_url.rstrip("/") + "/"
+    roots = []
+    if base_url.endswith("/Packages/"):
+        roots.append(base_url[: -len("Packages/")])
+    roots.append(base_url)
+    return roots
+
+
+def open_published_repo_index(base_url, metadata_dir, index_dir, name="published-repo"):
+    attempts = []
+    for index, root in enumerate(_published_repo_roots(base_url)):
+        repo_dir = Path(metadata_dir) / name / ("%02d" % index)
+        repo_dir.mkdir(parents=True, exist_ok=True)
+        item = {"resolved_url": root}
+        try:
+            item["repomd"] = _download_metadata(_url_join(root, "repodata/repomd.xml"), repo_dir / "repomd.xml")
+            item["primary_info"] = _find_primary_location(repo_dir / "repomd.xml")
+            repo_index = _load_repo_index(root, repo_dir, repo_dir / "repomd.xml", index_dir, item)
+        except Exception as exc:
+            attempts.append({"url": root, "error": repr(exc)})
             continue
-        for package in _parse_primary_packages(repo["primary"]["path"]):
-            if all(
-                str(package.get(key)) == str(expected[key])
-                for key in ("name", "version", "release", "arch")
-            ):
-                return repo, package
+        return repo_index, {"status": "ready", "url": root, "index": repo_index.summary(), "attempts": attempts}
+    return None, {"status": "error", "attempts": attempts}
+
+
+def published_package_url(repo_index, repo_summary, base_url, rpm):
+    package = repo_index.get(_package_key(rpm)) if repo_index is not None else None
+    if package:
+        return _url_join(repo_summary["url"], package["href"])
+    return join_url(base_url, rpm_filename(rpm))
+
+
+def _package_key(package):
+    return tuple(str(package.get(key)) for key in ("name", "version", "release", "arch"))
+
+
+def _find_external_package(repo_metadata, entry, indexes):
+    key = _package_key(_parse_nevra(entry["rpm_lookup"]))
+    for repo, index in zip(repo_metadata, indexes):
+        if index is None or repo.get("status") != "ready":
+            continue
+        package = index.get(key)
+        if package:
+            return repo, package
     return None, None
 
 
-def _recover_external_rpms(client, buildroot, entries, repo_dir, metadata_dir):
-    repo_metadata = _external_repo_metadata(client, buildroot, metadata_dir)
+def _external_sha256(package):
+    checksum = package.get("checksum") or {}
+    if checksum.get("type") == "sha256" and checksum.get("value"):
+        return checksum["value"].lower()
+    return None
+
+
+def _recover_external_rpms(client, buildroot, entries, repo_dir, metadata_dir, index_dir=None, store=None):
+    repo_metadata, indexes = _external_repo_metadata(client, buildroot, metadata_dir, index_dir)
     report = {
         "status": "ready",
         "event_id": _repo_event(buildroot),
@@ -283,65 +454,79 @@ def _recover_external_rpms(client, buildroot, entries, repo_dir, metadata_dir):
     }
     recovered = []
     downloaded_cache = {}
-    for entry in entries:
-        repo, package = _find_external_package(repo_metadata, entry)
-        if not package:
-            report["unresolved"].append(entry)
-            continue
+    try:
+        for entry in entries:
+            repo, package = _find_external_package(repo_metadata, entry, indexes)
+            if not package:
+                report["unresolved"].append(entry)
+                continue
 
-        source_url = _url_join(repo["resolved_url"], package["href"])
-        filename = Path(package["href"]).name or _rpm_filename_from_nevra(entry["rpm_lookup"])
-        path = Path(repo_dir) / filename
-        artifact = downloaded_cache.get(source_url)
-        if artifact is None:
-            try:
-                download_url(source_url, path)
-                artifact = summarize_file(path, label="recovered_external_rpm", url=source_url)
-                artifact["source_type"] = "external_repo"
-                artifact["external_repo_name"] = repo["external_repo_name"]
-                artifact["repo_checksum"] = package.get("checksum")
-                downloaded_cache[source_url] = artifact
-            except Exception as exc:
-                report["download_errors"].append(
+            source_url = _url_join(repo["resolved_url"], package["href"])
+            filename = Path(package["href"]).name or _rpm_filename_from_nevra(entry["rpm_lookup"])
+            path = Path(repo_dir) / filename
+            artifact = downloaded_cache.get(source_url)
+            if artifact is None:
+                try:
+                    # Repodata names the sha256 of the package; a download that does
+                    # not match is refused instead of stored under that digest.
+                    expected_sha256 = _external_sha256(package)
+                    download_url(
+                        source_url,
+                        path,
+                        store=store,
+                        store_key="sha256:%s" % expected_sha256 if expected_sha256 else None,
+                        expected_sha256=expected_sha256,
+                    )
+                    artifact = summarize_file(path, label="recovered_external_rpm", url=source_url)
+                    artifact["source_type"] = "external_repo"
+                    artifact["external_repo_name"] = repo["external_repo_name"]
+                    artifact["repo_checksum"] = package.get("checksum")
+                    downloaded_cache[source_url] = artifact
+                except Exception as exc:
+                    report["download_errors"].append(
+                        {
+                            "nevra": entry["nevra"],
+                            "url": source_url,
+                            "error": repr(exc),
+                        }
+                    )
+                    continue
+
+            verification = _verify_external_rpm(path, entry)
+            item = {
+                "entry": entry,
+                "source_type": "external_repo",
+                "external_repo_name": repo["external_repo_name"],
+                "source_url": source_url,
+                "filename": filename,
+                "artifact": artifact,
+                "package_metadata": package,
+                "verification": verification,
+            }
+            if not verification["matched"]:
+                report["verification_failed"].append(
                     {
                         "nevra": entry["nevra"],
                         "url": source_url,
-                        "error": repr(exc),
+                        "verification": verification,
                     }
                 )
                 continue
-
-        verification = _verify_external_rpm(path, entry)
-        item = {
-            "entry": entry,
-            "source_type": "external_repo",
-            "external_repo_name": repo["external_repo_name"],
-            "source_url": source_url,
-            "filename": filename,
-            "artifact": artifact,
-            "package_metadata": package,
-            "verification": verification,
-        }
-        if not verification["matched"]:
-            report["verification_failed"].append(
+            report["resolved"].append(
                 {
                     "nevra": entry["nevra"],
+                    "rpm_lookup": entry["rpm_lookup"],
+                    "source_repo": repo["external_repo_name"],
                     "url": source_url,
                     "verification": verification,
+                    "artifact": artifact,
                 }
             )
-            continue
-        report["resolved"].append(
-            {
-                "nevra": entry["nevra"],
-                "rpm_lookup": entry["rpm_lookup"],
-                "source_repo": repo["external_repo_name"],
-                "url": source_url,
-                "verification": verification,
-                "artifact": artifact,
-            }
-        )
-        recovered.append(item)
+            recovered.append(item)
+    finally:
+        for index in indexes:
+            if index is not None:
+                index.close()
 
     if report["unresolved"] or report["verification_failed"] or report["download_errors"]:
         report["status"] = "incomplete"
@@ -521,6 +706,7 @@ def _public_artifact(summary):
             "label",
             "source_type",
             "task_id",
+            "transport",
             "external_repo_name",
             "repo_checksum",
             "error",
@@ -581,6 +767,9 @@ def summarize_fallback_report(report, max_items=20):
             "status": external.get("status"),
             "event_id": external.get("event_id"),
             "repo_count": len(external.get("repos") or []),
+            "reused_repo_indexes": len(
+                [repo for repo in external.get("repos") or [] if (repo.get("index") or {}).get("reused")]
+            ),
             "resolved": len(external.get("resolved") or []),
             "unresolved": len(external.get("unresolved") or []),
             "verification_failed": len(external.get("verification_failed") or []),
@@ -636,6 +825,9 @@ def prepare_installed_pkgs_fallback(
     repo_dir,
     metadata_dir,
     source_task_id,
+    koji_topurl=None,
+    repodata_cache_dir=None,
+    store=None,
 ):
     installed_pkgs_log = Path(installed_pkgs_log)
     repo_dir = Path(repo_dir)
@@ -644,19 +836,24 @@ def prepare_installed_pkgs_fallback(
     metadata_dir.mkdir(parents=True, exist_ok=True)
 
     entries = parse_installed_pkgs(installed_pkgs_log)
-    rpm_cache = {}
-    build_cache = {}
     task_output_cache = {}
     resolved = []
     unresolved_by_getrpm = []
     payload_mismatch = []
     missing_task_output = []
 
+    rpm_lookups = list(dict.fromkeys(entry["rpm_lookup"] for entry in entries))
+    rpm_cache = dict(zip(rpm_lookups, _multicall_values(client.get_rpms_optional(rpm_lookups))))
+    build_ids = list(dict.fromkeys(rpm["build_id"] for rpm in rpm_cache.values() if rpm))
+    build_cache = dict(zip(build_ids, _multicall_values(client.get_builds(build_ids))))
+    _prefetch_task_outputs(
+        client,
+        [build["task_id"] for build in build_cache.values() if build and build.get("task_id") is not None],
+        task_output_cache,
+    )
+
     for entry in entries:
-        rpm = rpm_cache.get(entry["rpm_lookup"])
-        if entry["rpm_lookup"] not in rpm_cache:
-            rpm = client.get_rpm_optional(entry["rpm_lookup"])
-            rpm_cache[entry["rpm_lookup"]] = rpm
+        rpm = rpm_cache[entry["rpm_lookup"]]
         if not rpm:
             unresolved_by_getrpm.append(entry)
             continue
@@ -672,10 +869,7 @@ def prepare_installed_pkgs_fallback(
             continue
 
         build_id = rpm["build_id"]
-        build = build_cache.get(build_id)
-        if build_id not in build_cache:
-            build = client.get_build(build_id)
-            build_cache[build_id] = build
+        build = build_cache[build_id]
 
         filename = rpm_filename(rpm)
         output_task_id = _find_task_output(client, build["task_id"], filename, task_output_cache)
@@ -695,6 +889,7 @@ def prepare_installed_pkgs_fallback(
                 "entry": entry,
                 "name": rpm["name"],
                 "rpm": rpm,
+                "build": build,
                 "source_type": "koji_task_output",
                 "build_id": build_id,
                 "build_task_id": build.get("task_id"),
@@ -712,6 +907,8 @@ def prepare_installed_pkgs_fallback(
             unresolved_by_getrpm,
             repo_dir,
             metadata_dir,
+            index_dir=repodata_cache_dir,
+            store=store,
         )
         for item in external_resolved:
             parsed = _parse_nevra(item["entry"]["rpm_lookup"])
@@ -765,7 +962,9 @@ def prepare_installed_pkgs_fallback(
             if item.get("source_type") == "external_repo":
                 artifact = item["artifact"]
             else:
-                artifact = _download_dependency(client, item["output_task_id"], filename, repo_dir)
+                artifact = _download_dependency(
+                    client, item, repo_dir, koji_topurl=koji_topurl, store=store
+                )
                 artifact["source_type"] = "koji_task_output"
                 artifact["task_id"] = item["output_task_id"]
             downloaded.append(artifact)
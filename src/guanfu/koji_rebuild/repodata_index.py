@@ -0,0 +1,147 @@
+import os
+import re
+import shutil
+import sqlite3
+from pathlib import Path
+
+# Subset of the createrepo primary_db "packages" table. Indexes built from
+# primary.xml use the same columns so both sources are queried the same way.
+PACKAGE_COLUMNS = (
+    "name",
+    "arch",
+    "epoch",
+    "version",
+    "release",
+    "checksum_type",
+    "pkgId",
+    "location_href",
+    "size_package",
+    "size_installed",
+    "size_archive",
+    "time_file",
+    "time_build",
+)
+
+
+class RepodataIndex:
+    def __init__(self, path, source, checksum, reused):
+        self.path = Path(path)
+        self.source = source
+        self.checksum = checksum
+        self.reused = reused
+        self._db = None
+
+    def get(self, key):
+        if self._db is None:
+            self._db = sqlite3.connect("file:%s?mode=ro" % self.path, uri=True, check_same_thread=False)
+        row = self._db.execute(
+            "SELECT %s FROM packages WHERE name = ? AND version = ? AND release = ? AND arch = ? "
+            "ORDER BY pkgKey LIMIT 1" % ", ".join(PACKAGE_COLUMNS),
+            tuple(key),
+        ).fetchone()
+        if row is None:
+            return None
+        return _package_from_row(dict(zip(PACKAGE_COLUMNS, row)))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def summary(self):
+        return {
+            "source": self.source,
+            "checksum": self.checksum,
+            "reused": self.reused,
+        }
+
+
+def index_path(store_dir, data_type, checksum):
+    name = "%s-%s-%s.sqlite" % (data_type, checksum["type"], checksum["value"])
+    return Path(store_dir) / re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def open_index(store_dir, data_type, checksum):
+    path = index_path(store_dir, data_type, checksum)
+    if not path.exists():
+        return None
+    return RepodataIndex(path, data_type, checksum, reused=True)
+
+
+def build_index_from_packages(store_dir, checksum, packages):
+    path = index_path(store_dir, "primary", checksum)
+    tmp = _tmp_path(path)
+    db = sqlite3.connect(str(tmp))
+    try:
+        db.execute(
+            "CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, %s)"
+            % ", ".join("%s TEXT" % column for column in PACKAGE_COLUMNS)
+        )
+        db.executemany(
+            "INSERT INTO packages (%s) VALUES (%s)"
+            % (", ".join(PACKAGE_COLUMNS), ", ".join("?" for _ in PACKAGE_COLUMNS)),
+            (_row_from_package(package) for package in packages),
+        )
+        db.execute("CREATE INDEX packagename ON packages (name)")
+        db.commit()
+    finally:
+        db.close()
+    os.replace(str(tmp), str(path))
+    return RepodataIndex(path, "primary", checksum, reused=False)
+
+
+def install_primary_db(store_dir, checksum, compressed_db, opener):
+    path = index_path(store_dir, "primary_db", checksum)
+    tmp = _tmp_path(path)
+    with opener(compressed_db) as source, open(tmp, "wb") as dest:
+        shutil.copyfileobj(source, dest, 1024 * 1024)
+    os.replace(str(tmp), str(path))
+    return RepodataIndex(path, "primary_db", checksum, reused=False)
+
+
+def _tmp_path(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name("%s.%d.tmp" % (path.name, os.getpid()))
+    if tmp.exists():
+        tmp.unlink()
+    return tmp
+
+
+def _row_from_package(package):
+    checksum = package.get("checksum") or {}
+    return (
+        package.get("name"),
+        package.get("arch"),
+        package.get("epoch"),
+        package.get("version"),
+        package.get("release"),
+        checksum.get("type"),
+        checksum.get("value"),
+        package.get("href"),
+        package.get("package_size"),
+        package.get("installed_size"),
+        package.get("archive_size"),
+        package.get("file_time"),
+        package.get("buildtime"),
+    )
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _package_from_row(row):
+    return {
+        "name": row["name"],
+        "arch": row["arch"],
+        "epoch": _text(row["epoch"]),
+        "version": row["version"],
+        "release": row["release"],
+        "checksum": {"type": row["checksum_type"], "value": row["pkgId"]},
+        "href": row["location_href"],
+        "package_size": _text(row["size_package"]),
+        "installed_size": _text(row["size_installed"]),
+        "archive_size": _text(row["size_archive"]),
+        "file_time": _text(row["time_file"]),
+        "buildtime": _text(row["time_build"]),
+    }
@@ -12,6 +12,13 @@ class KojiResolution:
         self.task_srpm_name = task_srpm_name
 
 
+def _required(result):
+    value, error = result
+    if error is not None:
+        raise error
+    return value
+
+
 def _select_buildarch_task(client, build_task_id, arch, buildroot_id):
     children = client.get_task_children(build_task_id)
     candidates = [
@@ -19,15 +26,14 @@ def _select_buildarch_task(client, build_task_id, arch, buildroot_id):
         for child in children
         if child.get("method") == "buildArch" and child.get("arch") == arch
     ]
-    for child in candidates:
-        try:
-            result = client.get_task_result(child["id"])
-        except Exception:
+    task_results = client.get_task_results([child["id"] for child in candidates])
+    for child, (result, error) in zip(candidates, task_results):
+        if error is not None:
             continue
         if result and result.get("brootid") == buildroot_id:
-            return child
+            return child, result
     if candidates:
-        return candidates[0]
+        return candidates[0], _required(task_results[0])
     raise RuntimeError(f"no buildArch task for arch={arch} under task={build_task_id}")
 
 
@@ -45,15 +51,20 @@ def resolve_koji_build(client, rpm_info):
     if not rpm:
         raise RuntimeError(f"RPM was not found in Koji: {rpm_info}")
 
-    build = client.get_build(rpm["build_id"])
-    buildroot = client.get_buildroot(rpm["buildroot_id"])
-    buildarch = _select_buildarch_task(
+    build_result, buildroot_result = client.multicall(
+        [
+            ("getBuild", (rpm["build_id"], True)),
+            ("getBuildroot", (rpm["buildroot_id"], True)),
+        ]
+    )
+    build = _required(build_result)
+    buildroot = _required(buildroot_result)
+    buildarch, task_result = _select_buildarch_task(
         client,
         build["task_id"],
         buildroot["arch"],
         rpm.get("buildroot_id"),
     )
-    task_result = client.get_task_result(buildarch["id"])
     outputs = client.list_task_output(buildarch["id"])
     task_srpm_name = _select_task_srpm(task_result, outputs)
 
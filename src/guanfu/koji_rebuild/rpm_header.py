@@ -0,0 +1,443 @@
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+
+RPM_LEAD_SIZE = 96
+RPM_LEAD_MAGIC = b"\xed\xab\xee\xdb"
+RPM_HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+
+TAGS = {
+    "HEADERIMMUTABLE": 63,
+    "SIGSIZE": 257,
+    "SIGPGP": 259,
+    "SIGMD5": 261,
+    "SIGGPG": 262,
+    "DSAHEADER": 267,
+    "RSAHEADER": 268,
+    "SHA1HEADER": 269,
+    "LONGSIGSIZE": 270,
+    "LONGARCHIVESIZE": 271,
+    "SHA256HEADER": 273,
+    "NAME": 1000,
+    "VERSION": 1001,
+    "RELEASE": 1002,
+    "EPOCH": 1003,
+    "SUMMARY": 1004,
+    "BUILDTIME": 1006,
+    "BUILDHOST": 1007,
+    "SIZE": 1009,
+    "VENDOR": 1011,
+    "LICENSE": 1014,
+    "PACKAGER": 1015,
+    "GROUP": 1016,
+    "URL": 1020,
+    "OS": 1021,
+    "ARCH": 1022,
+    "PREIN": 1023,
+    "POSTIN": 1024,
+    "PREUN": 1025,
+    "POSTUN": 1026,
+    "FILESIZES": 1028,
+    "FILEMODES": 1030,
+    "FILERDEVS": 1033,
+    "FILEMTIMES": 1034,
+    "FILEDIGESTS": 1035,
+    "FILELINKTOS": 1036,
+    "FILEFLAGS": 1037,
+    "FILEUSERNAME": 1039,
+    "FILEGROUPNAME": 1040,
+    "SOURCERPM": 1044,
+    "ARCHIVESIZE": 1046,
+    "PROVIDENAME": 1047,
+    "REQUIREFLAGS": 1048,
+    "REQUIRENAME": 1049,
+    "REQUIREVERSION": 1050,
+    "CONFLICTFLAGS": 1053,
+    "CONFLICTNAME": 1054,
+    "CONFLICTVERSION": 1055,
+    "VERIFYSCRIPT": 1079,
+    "PREINPROG": 1085,
+    "POSTINPROG": 1086,
+    "PREUNPROG": 1087,
+    "POSTUNPROG": 1088,
+    "OBSOLETENAME": 1090,
+    "VERIFYSCRIPTPROG": 1091,
+    "PROVIDEFLAGS": 1112,
+    "PROVIDEVERSION": 1113,
+    "OBSOLETEFLAGS": 1114,
+    "OBSOLETEVERSION": 1115,
+    "DIRINDEXES": 1116,
+    "BASENAMES": 1117,
+    "DIRNAMES": 1118,
+    "PAYLOADFORMAT": 1124,
+    "PAYLOADCOMPRESSOR": 1125,
+    "PAYLOADFLAGS": 1126,
+    "PRETRANS": 1151,
+    "POSTTRANS": 1152,
+    "PRETRANSPROG": 1153,
+    "POSTTRANSPROG": 1154,
+    "LONGFILESIZES": 5008,
+    "LONGSIZE": 5009,
+    "FILEDIGESTALGO": 5011,
+    "PAYLOADDIGEST": 5092,
+    "PAYLOADDIGESTALGO": 5093,
+    "PAYLOADDIGESTALT": 5097,
+}
+
+# Signature header tags that rpm exposes under a different main-header tag.
+SIGNATURE_TAG_ALIASES = {1000: 257, 1002: 259, 1004: 261, 1005: 262, 1007: 1046}
+
+TYPE_NULL, TYPE_CHAR, TYPE_INT8, TYPE_INT16, TYPE_INT32, TYPE_INT64 = 0, 1, 2, 3, 4, 5
+TYPE_STRING, TYPE_BIN, TYPE_STRING_ARRAY, TYPE_I18NSTRING = 6, 7, 8, 9
+_INT_FORMATS = {TYPE_CHAR: "B", TYPE_INT8: "B", TYPE_INT16: "H", TYPE_INT32: "I", TYPE_INT64: "Q"}
+
+RPMSENSE_LESS = 1 << 1
+RPMSENSE_GREATER = 1 << 2
+RPMSENSE_EQUAL = 1 << 3
+RPMFILE_CONFIG = 1 << 0
+RPMFILE_DOC = 1 << 1
+
+DIGEST_ALGO_SIZES = {1: 16, 2: 20, 8: 32, 9: 48, 10: 64, 11: 28}
+PGP_PUBKEY_ALGOS = {1: "RSA", 17: "DSA", 19: "ECDSA", 22: "EdDSA"}
+PGP_HASH_ALGOS = {1: "MD5", 2: "SHA1", 3: "RIPEMD160", 8: "SHA256", 9: "SHA384", 10: "SHA512", 11: "SHA224"}
+
+SCRIPTLETS = (
+    ("preinstall", "PREIN", "PREINPROG"),
+    ("postinstall", "POSTIN", "POSTINPROG"),
+    ("preuninstall", "PREUN", "PREUNPROG"),
+    ("postuninstall", "POSTUN", "POSTUNPROG"),
+    ("pretrans", "PRETRANS", "PRETRANSPROG"),
+    ("posttrans", "POSTTRANS", "POSTTRANSPROG"),
+    ("verify", "VERIFYSCRIPT", "VERIFYSCRIPTPROG"),
+)
+DEPENDENCY_TAGS = {
+    "requires": ("REQUIRENAME", "REQUIREFLAGS", "REQUIREVERSION"),
+    "provides": ("PROVIDENAME", "PROVIDEFLAGS", "PROVIDEVERSION"),
+    "conflicts": ("CONFLICTNAME", "CONFLICTFLAGS", "CONFLICTVERSION"),
+    "obsoletes": ("OBSOLETENAME", "OBSOLETEFLAGS", "OBSOLETEVERSION"),
+}
+
+
+def _header_size(intro):
+    if len(intro) != 16 or intro[:4] != RPM_HEADER_MAGIC:
+        raise ValueError("bad RPM header magic")
+    nindex, hsize = struct.unpack(">II", intro[8:16])
+    return 16 + nindex * 16 + hsize
+
+
+def header_offset(path):
+    with open(path, "rb") as f:
+        lead = f.read(RPM_LEAD_SIZE)
+        if len(lead) != RPM_LEAD_SIZE or lead[:4] != RPM_LEAD_MAGIC:
+            raise ValueError("not an RPM file: %s" % path)
+        signature_size = _header_size(f.read(16))
+    return RPM_LEAD_SIZE + signature_size + (-signature_size % 8)
+
+
+def sigmd5_file(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        f.seek(header_offset(path))
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def payload_digest_file(path):
+    # Digest of the compressed payload as PAYLOADDIGEST records it, or None
+    # when the package names an algorithm hashlib does not provide.
+    package = read_package(path)
+    algo = PGP_HASH_ALGOS.get(package.first("PAYLOADDIGESTALGO", 8))
+    try:
+        h = hashlib.new((algo or "").lower())
+    except ValueError:
+        return None
+    with open(path, "rb") as f:
+        f.seek(package.payload_offset)
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _decode(value):
+    return value.decode("utf-8", "surrogateescape")
+
+
+def _parse_header(data, start):
+    size = _header_size(bytes(data[start : start + 16]))
+    if start + size > len(data):
+        raise ValueError("truncated RPM header")
+    nindex = struct.unpack(">I", data[start + 8 : start + 12])[0]
+    store = start + 16 + nindex * 16
+    store_size = size - 16 - nindex * 16
+    tags = {}
+    for index in range(nindex):
+        entry = start + 16 + index * 16
+        tag, kind, offset, count = struct.unpack(">IIII", data[entry : entry + 16])
+        if offset > store_size:
+            raise ValueError("RPM header tag %d points outside the data store" % tag)
+        tags[tag] = _tag_value(data, store + offset, store + store_size, kind, count)
+    return tags, start + size
+
+
+def _tag_value(data, offset, end, kind, count):
+    if kind in _INT_FORMATS:
+        fmt = ">%d%s" % (count, _INT_FORMATS[kind])
+        return list(struct.unpack(fmt, data[offset : offset + struct.calcsize(fmt)]))
+    if kind == TYPE_BIN:
+        return bytes(data[offset : offset + count])
+    if kind in (TYPE_STRING, TYPE_STRING_ARRAY, TYPE_I18NSTRING):
+        values = []
+        for _ in range(count if kind != TYPE_STRING else 1):
+            stop = data.find(b"\0", offset, end)
+            if stop < 0:
+                raise ValueError("unterminated string in RPM header")
+            values.append(_decode(bytes(data[offset:stop])))
+            offset = stop + 1
+        return values[0] if kind == TYPE_STRING else values
+    return None
+
+
+class RpmPackage:
+    def __init__(self, path, signature, header, header_start, payload_offset):
+        self.path = path
+        self.signature = signature
+        self.header = header
+        self.header_start = header_start
+        self.payload_offset = payload_offset
+
+    def get(self, name, default=None):
+        tag = TAGS[name]
+        if tag in self.header:
+            return self.header[tag]
+        for sig_tag, alias in SIGNATURE_TAG_ALIASES.items():
+            if alias == tag and sig_tag in self.signature:
+                return self.signature[sig_tag]
+        if tag < 1000 and tag in self.signature:
+            return self.signature[tag]
+        return default
+
+    def first(self, name, default=None):
+        value = self.get(name)
+        if isinstance(value, list):
+            return value[0] if value else default
+        return default if value is None else value
+
+    def format_tag(self, name):
+        # Mirrors what `rpm -qp --qf %{NAME}` prints for a scalar tag.
+        if name == "SIZE" and self.get("SIZE") is None:
+            name = "LONGSIZE"
+        value = self.first(name)
+        if value is None:
+            return "(none)"
+        if isinstance(value, bytes):
+            return value.hex()
+        return str(value)
+
+    def nevra(self):
+        return "%s-%s-%s.%s" % (
+            self.first("NAME"),
+            self.first("VERSION"),
+            self.first("RELEASE"),
+            self.first("ARCH"),
+        )
+
+    def pgpsig(self, name):
+        value = self.get(name)
+        if not value:
+            return "(none)"
+        try:
+            return format_pgpsig(value)
+        except (ValueError, IndexError, struct.error):
+            return value.hex()
+
+    def dependencies(self, kind):
+        name_tag, flags_tag, version_tag = DEPENDENCY_TAGS[kind]
+        names = self.get(name_tag) or []
+        flags = self.get(flags_tag) or [0] * len(names)
+        versions = self.get(version_tag) or [""] * len(names)
+        return [_format_dependency(*item) for item in zip(names, flags, versions)]
+
+    def scriptlets(self):
+        scripts = []
+        for label, script_tag, prog_tag in SCRIPTLETS:
+            script = self.get(script_tag)
+            prog = self.get(prog_tag)
+            if script is None and prog is None:
+                continue
+            if isinstance(prog, list):
+                prog = " ".join(prog)
+            # Either may be missing: a program-only scriptlet has no body.
+            scripts.append({"name": label, "program": prog, "script": script})
+        return scripts
+
+    def files(self):
+        basenames = self.get("BASENAMES") or []
+        if not basenames:
+            return []
+        count = len(basenames)
+        dirnames = self.get("DIRNAMES") or []
+        dirindexes = self.get("DIRINDEXES") or [0] * count
+        sizes = self.get("LONGFILESIZES") or self.get("FILESIZES") or [0] * count
+        digest_algo = self.first("FILEDIGESTALGO", 1)
+        empty_digest = "0" * (DIGEST_ALGO_SIZES.get(digest_algo, 16) * 2)
+        columns = {
+            "mtime": self.get("FILEMTIMES") or [0] * count,
+            "digest": self.get("FILEDIGESTS") or [""] * count,
+            "mode": self.get("FILEMODES") or [0] * count,
+            "owner": self.get("FILEUSERNAME") or [""] * count,
+            "group": self.get("FILEGROUPNAME") or [""] * count,
+            "flags": self.get("FILEFLAGS") or [0] * count,
+            "rdev": self.get("FILERDEVS") or [0] * count,
+            "linkto": self.get("FILELINKTOS") or [""] * count,
+        }
+        files = []
+        for index, basename in enumerate(basenames):
+            flags = columns["flags"][index]
+            files.append(
+                {
+                    "path": dirnames[dirindexes[index]] + basename,
+                    "size": sizes[index],
+                    "mtime": columns["mtime"][index],
+                    "digest": columns["digest"][index] or empty_digest,
+                    "mode": columns["mode"][index],
+                    "owner": columns["owner"][index],
+                    "group": columns["group"][index],
+                    "flags": flags,
+                    "isconfig": 1 if flags & RPMFILE_CONFIG else 0,
+                    "isdoc": 1 if flags & RPMFILE_DOC else 0,
+                    "rdev": columns["rdev"][index],
+                    "linkto": columns["linkto"][index],
+                }
+            )
+        return files
+
+
+def _format_dependency(name, flags, version):
+    op = ""
+    if flags & RPMSENSE_LESS:
+        op += "<"
+    if flags & RPMSENSE_GREATER:
+        op += ">"
+    if flags & RPMSENSE_EQUAL:
+        op += "="
+    if op and version:
+        return "%s %s %s" % (name, op, version)
+    return name
+
+
+def format_dump_line(item):
+    # Same columns as `rpm -qp --dump`.
+    return "%s %d %d %s 0%o %s %s %d %d %d %s" % (
+        item["path"],
+        item["size"],
+        item["mtime"],
+        item["digest"],
+        item["mode"],
+        item["owner"],
+        item["group"],
+        item["isconfig"],
+        item["isdoc"],
+        item["rdev"],
+        item["linkto"] or "X",
+    )
+
+
+def _pgp_packet_body(data):
+    first = data[0]
+    if not first & 0x80:
+        raise ValueError("not an OpenPGP packet")
+    if first & 0x40:
+        length = data[1]
+        if length < 192:
+            return data[2 : 2 + length]
+        if length < 224:
+            length = ((length - 192) << 8) + data[2] + 192
+            return data[3 : 3 + length]
+        if length == 255:
+            return data[6 : 6 + struct.unpack(">I", data[2:6])[0]]
+        raise ValueError("unsupported OpenPGP packet length")
+    length_type = first & 0x03
+    if length_type == 3:
+        return data[1:]
+    size = (1, 2, 4)[length_type]
+    length = int.from_bytes(data[1 : 1 + size], "big")
+    return data[1 + size : 1 + size + length]
+
+
+def _pgp_subpackets(data):
+    offset = 0
+    while offset < len(data):
+        length = data[offset]
+        if length < 192:
+            offset += 1
+        elif length < 255:
+            length = ((length - 192) << 8) + data[offset + 1] + 192
+            offset += 2
+        else:
+            length = struct.unpack(">I", data[offset + 1 : offset + 5])[0]
+            offset += 5
+        yield data[offset] & 0x7F, data[offset + 1 : offset + length]
+        offset += length
+
+
+def format_pgpsig(value):
+    # Mirrors rpm's %{RSAHEADER:pgpsig}: "RSA/SHA256, <ctime>, Key ID <keyid>".
+    body = _pgp_packet_body(value)
+    version = body[0]
+    if version == 3:
+        created = struct.unpack(">I", body[3:7])[0]
+        keyid = body[7:15]
+        pubkey_algo, hash_algo = body[15], body[16]
+    elif version == 4:
+        pubkey_algo, hash_algo = body[2], body[3]
+        hashed_len = struct.unpack(">H", body[4:6])[0]
+        hashed = body[6 : 6 + hashed_len]
+        unhashed_len = struct.unpack(">H", body[6 + hashed_len : 8 + hashed_len])[0]
+        unhashed = body[8 + hashed_len : 8 + hashed_len + unhashed_len]
+        created, keyid = 0, b""
+        for kind, payload in list(_pgp_subpackets(hashed)) + list(_pgp_subpackets(unhashed)):
+            if kind == 2:
+                created = struct.unpack(">I", payload[:4])[0]
+            elif kind == 16:
+                keyid = payload[:8]
+            elif kind == 33 and not keyid:
+                keyid = payload[-8:]
+    else:
+        raise ValueError("unsupported OpenPGP signature version %d" % version)
+    return "%s/%s, %s, Key ID %s" % (
+        PGP_PUBKEY_ALGOS.get(pubkey_algo, str(pubkey_algo)),
+        PGP_HASH_ALGOS.get(hash_algo, str(hash_algo)),
+        time.strftime("%c", time.localtime(created)),
+        keyid.hex(),
+    )
+
+
+def _read_package(path):
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if data[:4] != RPM_LEAD_MAGIC or len(data) < RPM_LEAD_SIZE:
+            raise ValueError("not an RPM file: %s" % path)
+        signature, signature_end = _parse_header(data, RPM_LEAD_SIZE)
+        header_start = signature_end + (-(signature_end - RPM_LEAD_SIZE) % 8)
+        header, payload_offset = _parse_header(data, header_start)
+    except (struct.error, IndexError) as exc:
+        raise ValueError("malformed RPM header in %s: %s" % (path, exc))
+    finally:
+        data.close()
+    return RpmPackage(str(path), signature, header, header_start, payload_offset)
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_package(path, _identity):
+    return _read_package(path)
+
+
+def read_package(path):
+    st = os.stat(path)
+    return _cached_package(str(path), (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns))
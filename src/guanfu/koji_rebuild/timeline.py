@@ -0,0 +1,56 @@
+import contextlib
+import time
+
+
+class PhaseTimeline:
+    # Executor phases in seconds since the timeline started, on the host's
+    # monotonic clock. The wall clock at the origin is kept so epoch
+    # timestamps reported by the guest can be placed on the same axis.
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.origin_wall = time.time()
+        self.phases = []
+
+    def now(self):
+        return time.monotonic() - self.origin
+
+    def offset(self, epoch):
+        return epoch - self.origin_wall
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, start, self.now())
+
+    def add(self, name, start, end, source="host", **extra):
+        if start is None or end is None:
+            return
+        item = {
+            "phase": name,
+            "source": source,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "seconds": round(end - start, 3),
+        }
+        item.update(extra)
+        self.phases.append(item)
+
+    def summary(self):
+        return {
+            "clock": "seconds since the executor started; guest phases are placed by the guest wall clock",
+            "total_seconds": round(self.now(), 3),
+            "phases": sorted(self.phases, key=lambda item: (item["start"], item["end"])),
+        }
+
+
+@contextlib.contextmanager
+def timed(timeline, name):
+    # Times a block on `timeline`; with no timeline the block just runs.
+    if timeline is None:
+        yield
+        return
+    with timeline.phase(name):
+        yield
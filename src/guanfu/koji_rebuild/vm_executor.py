@@ -1,19 +1,47 @@
+import copy
+import fcntl
+import hashlib
+import json
 import os
 import re
 import shlex
 import shutil
 import subprocess
 import sys
+import tempfile
+import textwrap
+import threading
 import time
 import urllib.parse
 from pathlib import Path
 
-from guanfu.koji_rebuild.downloader import download_url, summarize_file
-from guanfu.koji_rebuild.mock_runner import _diagnose_mock_failure
+from guanfu.koji_rebuild.downloader import download_url, persistent_sha256, summarize_file
+from guanfu.koji_rebuild.mock_runner import _diagnose_mock_failure, mock_stage_timings
+from guanfu.koji_rebuild.timeline import PhaseTimeline, timed
+from guanfu.koji_rebuild.vm_scheduler import pinned_command, vm_resource_request
 
 
 DEFAULT_VM_WORKDIR = "/mnt/guanfu-work"
 DEFAULT_MOUNT_TAG = "guanfu_work"
+# Bump when the way golden images are prepared changes.
+GOLDEN_IMAGE_VERSION = "1"
+# job-disk share mode: a NoCloud seed (vfat or iso9660, as cloud-init
+# requires) with meta-data/user-data, a read-only ext4 disk with the job
+# inputs, and an empty, sparse ext4 disk mounted as the VM work directory.
+SEED_DISK_LABEL = "cidata"
+SEED_DISK_SIZE = 2 * 1024 * 1024
+JOB_DISK_LABEL = "guanfu-job"
+RESULTS_DISK_LABEL = "guanfu-results"
+RESULTS_DISK_SIZE = 8 * 1024 * 1024 * 1024
+VM_JOB_MOUNT = "/mnt/guanfu-job"
+# virtio-serial port used by the warm VM pool agent.
+AGENT_PORT_NAME = "org.guanfu.agent"
+# Run-directory subtrees a pool job reads. Each job gets hard links to them
+# below the exported vm-pool/jobs/ tree, which the guest mounts read-only.
+POOL_STAGED_INPUTS = ("inputs", "fallback-repo")
+# Whether each virtiofsd binary could start here, probed once per process.
+_VIRTIOFSD_PROBES = {}
+_VIRTIOFSD_PROBE_LOCK = threading.Lock()
 DEFAULT_AN23_VM_IMAGE_BASE_URL = "https://mirrors.openanolis.cn/anolis/23/isos/GA/x86_64/"
 DEFAULT_AN23_VM_IMAGE_FILENAME = "AnolisOS-23.4-x86_64.qcow2"
 DEFAULT_AN23_VM_IMAGE_URL = DEFAULT_AN23_VM_IMAGE_BASE_URL + DEFAULT_AN23_VM_IMAGE_FILENAME
@@ -87,73 +115,176 @@ def prepare_vm_mock_config(source_cfg, dest_cfg, run_dir, vm_workdir=DEFAULT_VM_
     dest_cfg.write_text(text)
     return dest_cfg
 
+# Guest shell fragments shared by the one-shot rebuild script and the pool
+# agent. The run loop expects $mock_cfg, $srpm, $results_dir, $runs,
+# $isolation and an optional mock $uniqueext, and reports progress through a
+# mark() function.
+GUEST_INSTALL_MOCK = """if ! command -v mock >/dev/null 2>&1; then
+  dnf -y install mock rpm-build || yum -y install mock rpm-build || true
+fi"""
+# Opt-in (--vm-share-benchmark): stat every shared input and read inputs/
+# once before mock starts, a comparable figure for each share mode.
+GUEST_SHARE_BENCHMARK = """bench_start=$(date +%s.%N)
+bench_files=$(find -L "{vm_workdir}/inputs" "{vm_workdir}/fallback-repo" -type f 2>/dev/null | wc -l)
+bench_bytes=$(find -L "{vm_workdir}/inputs" -type f -exec cat {{}} + 2>/dev/null | wc -c)
+bench_end=$(date +%s.%N)
+echo "VM_SHARE_BENCH files=$bench_files bytes=$bench_bytes seconds=$(echo "$bench_start $bench_end" | awk '{{printf "%.3f", $2 - $1}}')"
+"""
+GUEST_ENVIRONMENT_PROBE = """echo "VM_ACTUAL_KERNEL=$(uname -r)"
+echo "VM_ACTUAL_MOCK=$(mock --version 2>/dev/null | head -1)"
+echo "VM_ACTUAL_RPM=$(rpm --version 2>/dev/null | head -1)"
+echo "VM_ACTUAL_DNF=$(dnf --version 2>/dev/null | head -1)"
+echo "VM_ACTUAL_CPU_MODEL=$(lscpu 2>/dev/null | sed -n 's/^Model name:[[:space:]]*//p' | head -1)"
+echo "VM_ACTUAL_CPU_FAMILY=$(lscpu 2>/dev/null | sed -n 's/^CPU family:[[:space:]]*//p' | head -1)"
+echo "VM_ACTUAL_CPU_MODEL_ID=$(lscpu 2>/dev/null | sed -n 's/^Model:[[:space:]]*//p' | head -1)"
+echo "VM_ACTUAL_CPU_FLAGS=$(grep -m1 '^flags' /proc/cpuinfo | cut -d: -f2- | sed 's/^ *//')\""""
+GUEST_RUN_LOOP = """run=1
+rc=0
+while [ "$run" -le "$runs" ]; do
+  resultdir="$results_dir/result-run-$run"
+  rm -rf "$resultdir"
+  mkdir -p "$resultdir"
+  mark "VM_REBUILD_PKG_RUN_START $run $(date -Is)"
+  echo "VM_TIME $(date +%s.%N) run_start $run"
+  mock -r "$mock_cfg" ${uniqueext:+--uniqueext="$uniqueext"} --isolation="$isolation" --resultdir "$resultdir" \\
+    --rebuild "$srpm"
+  rc=$?
+  echo "VM_TIME $(date +%s.%N) run_end $run"
+  echo "$rc" > "$resultdir/mock.exit"
+  mark "VM_REBUILD_PKG_RUN_EXIT $run $rc $(date -Is)"
+  find "$resultdir" -maxdepth 1 -type f -printf "%f %s bytes\\n" | sort || true
+  if [ "$rc" -ne 0 ]; then
+    break
+  fi
+  run=$((run + 1))
+done"""
+
 
-def run_vm_rebuild(args, run_dir, mock_cfg, srpm, results_dir, target_os, koji_recorded=None):
+def run_vm_rebuild(
+    args, run_dir, mock_cfg, srpm, results_dir, target_os, koji_recorded=None, pool=None, scheduler=None
+):
     run_dir = Path(run_dir).resolve()
     mock_cfg = Path(mock_cfg).resolve()
     srpm = Path(srpm).resolve()
     results_dir = Path(results_dir).resolve()
     results_dir.mkdir(parents=True, exist_ok=True)
-
-    profile = _select_vm_profile(target_os, args)
-    qemu_binary = _select_qemu_binary(getattr(args, "vm_qemu_binary", None))
-    acceleration, acceleration_warning = _select_acceleration(getattr(args, "vm_require_kvm", False))
-    preflight = _preflight_vm_host_dependencies(args, profile, qemu_binary, acceleration_warning)
-    share_mode = _select_share_mode(args, qemu_binary)
-    if share_mode == "image-copy":
-        preflight["checks"].extend(_preflight_image_copy_dependencies(args))
-    preflight["checks"].append({"name": "vm-share-mode", "status": "ok", "value": share_mode})
-    vm_image = prepare_vm_image(args, run_dir, profile)
-    boot_mode = _select_boot_mode(args, vm_image)
-    transfer = {"mode": share_mode}
-
-    vm_mock_cfg = Path(mock_cfg).parent / "mock-vm.cfg"
-    prepare_vm_mock_config(mock_cfg, vm_mock_cfg, run_dir, getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR))
-
-    script = _vm_rebuild_script(
-        vm_workdir=getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR),
-        mock_cfg=Path(getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)) / vm_mock_cfg.relative_to(run_dir),
-        srpm=Path(getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)) / Path(srpm).resolve().relative_to(run_dir),
-        results_dir=Path(getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)) / results_dir.resolve().relative_to(run_dir),
-        runs=args.runs,
-        isolation=args.isolation,
-        mount_workdir=share_mode == "9p",
-    )
-    if boot_mode == "direct-init":
-        _inject_vm_script_raw(vm_image["path"], run_dir, script)
-    else:
-        _inject_vm_script_systemd(vm_image["path"], run_dir, script, args)
-    if share_mode == "image-copy":
-        transfer["copy_in"] = _copy_inputs_into_vm(vm_image["path"], run_dir, args)
-
-    command = build_qemu_command(
-        args,
-        qemu_binary=qemu_binary,
-        profile=profile,
-        acceleration=acceleration,
-        shared_dir=run_dir,
-        vm_image=vm_image,
-        boot_mode=boot_mode,
-        share_mode=share_mode,
-    )
+    if pool is not None:
+        return _run_pooled_vm_rebuild(args, pool, run_dir, mock_cfg, srpm, results_dir, target_os, koji_recorded)
+
+    timeline = PhaseTimeline()
+    with timeline.phase("preflight"):
+        profile = _select_vm_profile(target_os, args)
+        qemu_binary = _select_qemu_binary(getattr(args, "vm_qemu_binary", None))
+        acceleration, acceleration_warning = _select_acceleration(getattr(args, "vm_require_kvm", False))
+        share_mode = _select_share_mode(args, qemu_binary)
+        preflight = _preflight_vm_host_dependencies(args, profile, qemu_binary, acceleration_warning, share_mode)
+        if share_mode == "image-copy":
+            preflight["checks"].extend(_preflight_image_copy_dependencies(args))
+        if share_mode == "job-disk":
+            preflight["checks"].extend(_preflight_job_disk_dependencies())
+        if share_mode == "virtiofs":
+            preflight["checks"].extend(_preflight_virtiofs_dependencies(args))
+        preflight["checks"].append({"name": "vm-share-mode", "status": "ok", "value": share_mode})
+    request = vm_resource_request(args, run_dir / "inputs", srpm)
+    reservation = None
+    if scheduler is not None:
+        # Waits until the host has cores, memory and scratch disk for this VM;
+        # image downloads, golden builds and virt-customize count against it too.
+        with timeline.phase("queue"):
+            reservation = scheduler.reserve(request, label=run_dir.name)
+    args = _sized_vm_args(args, request, reservation)
+    try:
+        vm_image = prepare_vm_image(args, run_dir, profile, share_mode, timeline=timeline)
+        boot_mode = _select_boot_mode(args, vm_image)
+        transfer = {"mode": share_mode}
+
+        vm_mock_cfg = Path(mock_cfg).parent / "mock-vm.cfg"
+        prepare_vm_mock_config(mock_cfg, vm_mock_cfg, run_dir, getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR))
+
+        script = _vm_rebuild_script(
+            vm_workdir=getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR),
+            mock_cfg=Path(getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)) / vm_mock_cfg.relative_to(run_dir),
+            srpm=Path(getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)) / Path(srpm).resolve().relative_to(run_dir),
+            results_dir=(
+                Path(getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)) / results_dir.resolve().relative_to(run_dir)
+            ),
+            runs=args.runs,
+            isolation=args.isolation,
+            share_mode=share_mode,
+            share_benchmark=getattr(args, "vm_share_benchmark", False),
+        )
+        if share_mode == "job-disk":
+            # cloud-init runs the script from the job disk, so qcow2 images are not touched.
+            with timeline.phase("copy_in"):
+                transfer["copy_in"] = _build_job_disks(run_dir, script)
+        if boot_mode == "direct-init":
+            with timeline.phase("inject_script"):
+                _inject_vm_script_raw(vm_image["path"], run_dir, script)
+        elif share_mode != "job-disk":
+            with timeline.phase("virt_customize"):
+                _inject_vm_script_systemd(
+                    vm_image["path"], run_dir, script, args, prepared=bool(vm_image.get("golden"))
+                )
+        if share_mode == "image-copy":
+            with timeline.phase("copy_in"):
+                transfer["copy_in"] = _copy_inputs_into_vm(vm_image["path"], run_dir, args)
+
+        command = build_qemu_command(
+            args,
+            qemu_binary=qemu_binary,
+            profile=profile,
+            acceleration=acceleration,
+            shared_dir=run_dir,
+            vm_image=vm_image,
+            boot_mode=boot_mode,
+            share_mode=share_mode,
+        )
+    except BaseException:
+        if reservation is not None:
+            scheduler.release(reservation)
+        raise
+    command = pinned_command(command, reservation)
+    virtiofsd = None
     started = time.time()
+    qemu_started = None
     timed_out = False
     try:
+        if share_mode == "virtiofs":
+            with timeline.phase("virtiofsd_start"):
+                virtiofsd, transfer["virtiofsd"] = _start_virtiofsd(args, run_dir)
+        started = time.time()
+        qemu_started = timeline.now()
         proc = subprocess.run(command, timeout=getattr(args, "vm_timeout", 7200))
         qemu_exit_code = proc.returncode
     except subprocess.TimeoutExpired:
         timed_out = True
         qemu_exit_code = 124
+    finally:
+        if virtiofsd is not None:
+            _stop_virtiofsd(virtiofsd)
+        if reservation is not None:
+            scheduler.release(reservation)
     elapsed = time.time() - started
-
-    if share_mode == "image-copy":
-        try:
-            transfer["copy_out"] = _copy_outputs_from_vm(vm_image["path"], run_dir, args)
-        except Exception as exc:
-            transfer["copy_out_error"] = repr(exc)
+    qemu_ended = timeline.now()
+    timeline.add("qemu", qemu_started, qemu_ended)
+
+    if share_mode in ("image-copy", "job-disk"):
+        with timeline.phase("copy_out"):
+            try:
+                if share_mode == "image-copy":
+                    transfer["copy_out"] = _copy_outputs_from_vm(vm_image["path"], run_dir, args)
+                else:
+                    transfer["copy_out"] = _read_results_disk(run_dir)
+            except Exception as exc:
+                transfer["copy_out_error"] = repr(exc)
 
     vm_log = run_dir / "metadata" / "vm-rebuild.log"
+    guest_times = parse_vm_guest_times(vm_log)
+    _add_guest_timeline(timeline, guest_times, results_dir, args.runs, qemu_started, qemu_ended)
     actual = parse_vm_actual_environment(vm_log)
+    guest_read = parse_vm_share_benchmark(vm_log)
+    if guest_read:
+        transfer["guest_read"] = guest_read
     executor = vm_executor_summary(
         profile=profile,
         acceleration=acceleration,
@@ -169,8 +300,12 @@ def run_vm_rebuild(args, run_dir, mock_cfg, srpm, results_dir, target_os, koji_r
         share_mode=share_mode,
         transfer=transfer,
         preflight=preflight,
+        resources=_vm_resources_summary(request, reservation),
+        timeline=timeline.summary(),
+    )
+    rebuilds = _collect_vm_rebuilds(
+        args, vm_mock_cfg, srpm, results_dir, qemu_exit_code, elapsed, guest_times=guest_times
     )
-    rebuilds = _collect_vm_rebuilds(args, vm_mock_cfg, srpm, results_dir, qemu_exit_code, elapsed)
     return {
         "executor": executor,
         "rebuilds": rebuilds,
@@ -179,6 +314,65 @@ def run_vm_rebuild(args, run_dir, mock_cfg, srpm, results_dir, target_os, koji_r
     }
 
 
+def _run_pooled_vm_rebuild(args, pool, run_dir, mock_cfg, srpm, results_dir, target_os, koji_recorded=None):
+    # The job runs on an already booted pool guest, which sees a copy of
+    # the run's inputs as its job directory below the VM workdir.
+    pool_job = pool.new_job(run_dir)
+    vm_mock_cfg = Path(mock_cfg).parent / "mock-vm.cfg"
+    prepare_vm_mock_config(mock_cfg, vm_mock_cfg, run_dir, str(pool_job["guest_dir"]))
+    (run_dir / "metadata").mkdir(parents=True, exist_ok=True)
+    timeline = PhaseTimeline()
+    job_started = timeline.now()
+    job = pool.run_job(
+        target_os,
+        pool_job,
+        mock_cfg=vm_mock_cfg,
+        srpm=srpm,
+        results_dir=results_dir,
+        runs=args.runs,
+        isolation=args.isolation,
+        log=run_dir / "metadata" / "vm-rebuild.log",
+    )
+    vm_log = run_dir / "metadata" / "vm-rebuild.log"
+    guest_times = parse_vm_guest_times(vm_log)
+    timeline.add("pool_job", job_started, timeline.now())
+    _add_guest_timeline(timeline, guest_times, results_dir, args.runs)
+    guest = job["guest"]
+    executor = vm_executor_summary(
+        profile=guest["profile"],
+        acceleration=guest["acceleration"],
+        qemu_binary=guest["qemu_binary"],
+        command=guest["command"],
+        elapsed_seconds=job["elapsed_seconds"],
+        timed_out=job["timed_out"],
+        koji_recorded=koji_recorded,
+        actual_vm=parse_vm_actual_environment(vm_log),
+        vm_image=guest["vm_image"],
+        boot_mode=guest["boot_mode"],
+        share_mode=guest["share_mode"],
+        transfer={"mode": guest["share_mode"]},
+        preflight=guest["preflight"],
+        pool=job["pool"],
+        timeline=timeline.summary(),
+    )
+    rebuilds = _collect_vm_rebuilds(
+        args,
+        vm_mock_cfg,
+        srpm,
+        results_dir,
+        job["exit_code"],
+        job["elapsed_seconds"],
+        uniqueext=job.get("uniqueext"),
+        guest_times=guest_times,
+    )
+    return {
+        "executor": executor,
+        "rebuilds": rebuilds,
+        "qemu_exit_code": None,
+        "vm_log": str(vm_log),
+    }
+
+
 def build_qemu_command(
     args,
     qemu_binary,
@@ -188,6 +382,8 @@ def build_qemu_command(
     vm_image=None,
     boot_mode=None,
     share_mode="9p",
+    agent_socket=None,
+    virtiofs_socket=None,
 ):
     vm_image = vm_image or {
         "path": getattr(args, "vm_image", None),
@@ -223,6 +419,43 @@ def build_qemu_command(
                 ),
             ]
         )
+    if share_mode == "virtiofs":
+        memory = str(getattr(args, "vm_memory", "4096M"))
+        command.extend(
+            [
+                "-object",
+                "memory-backend-memfd,id=guanfu_mem,size=%s,share=on" % memory,
+                "-numa",
+                "node,memdev=guanfu_mem",
+                "-chardev",
+                "socket,id=guanfu_virtiofs,path=%s" % (virtiofs_socket or _virtiofs_socket_path(shared_dir)),
+                "-device",
+                "vhost-user-fs-pci,chardev=guanfu_virtiofs,tag=%s" % DEFAULT_MOUNT_TAG,
+            ]
+        )
+    if agent_socket:
+        command.extend(
+            [
+                "-device",
+                "virtio-serial-pci",
+                "-chardev",
+                "socket,id=guanfu_agent,path=%s,server=on,wait=off" % agent_socket,
+                "-device",
+                "virtserialport,chardev=guanfu_agent,name=%s" % AGENT_PORT_NAME,
+            ]
+        )
+    if share_mode == "job-disk":
+        seed_disk, job_disk, results_disk = _job_disk_paths(shared_dir)
+        command.extend(
+            [
+                "-drive",
+                "file=%s,if=virtio,format=raw,readonly=on" % seed_disk,
+                "-drive",
+                "file=%s,if=virtio,format=raw,readonly=on" % job_disk,
+                "-drive",
+                "file=%s,if=virtio,format=raw" % results_disk,
+            ]
+        )
     if boot_mode == "direct-init":
         command.extend(
             [
@@ -257,6 +490,9 @@ def vm_executor_summary(
     share_mode=None,
     transfer=None,
     preflight=None,
+    pool=None,
+    resources=None,
+    timeline=None,
 ):
     profile = profile or {}
     koji_recorded = koji_recorded or {}
@@ -273,6 +509,9 @@ def vm_executor_summary(
         "share_mode": share_mode,
         "transfer": transfer,
         "preflight": preflight,
+        "pool": pool,
+        "resources": resources,
+        "timeline": timeline,
         "qemu_exit_code": qemu_exit_code,
         "qemu_elapsed_seconds": elapsed_seconds,
         "timed_out": timed_out or None,
@@ -286,6 +525,94 @@ def vm_executor_summary(
     return _without_none(summary)
 
 
+def _sized_vm_args(args, request, reservation=None):
+    # QEMU gets the size the scheduler admitted, which is the request clamped
+    # to the host.
+    sized = reservation or request
+    if request["sizing"] == "fixed" and (sized["smp"], sized["memory_mib"]) == (request["smp"], request["memory_mib"]):
+        return args
+    args = copy.copy(args)
+    args.vm_smp = str(sized["smp"])
+    args.vm_memory = "%dM" % sized["memory_mib"]
+    return args
+
+
+def _vm_resources_summary(request, reservation=None):
+    reservation = reservation or {}
+    return _without_none(
+        {
+            "sizing": request["sizing"],
+            "smp": request["smp"],
+            "memory_mib": request["memory_mib"],
+            "scratch_bytes": request["disk_bytes"],
+            "host_cpus": reservation.get("cpus"),
+            "numa_node": reservation.get("numa_node"),
+            "queued_seconds": reservation.get("queued_seconds"),
+        }
+    )
+
+
+def parse_vm_guest_times(log_path):
+    # "VM_TIME <epoch> <event> [run]" markers from the guest scripts, keyed
+    # as "event" or "event:run"; the first occurrence wins.
+    times = {}
+    for line in (_read_text(log_path) or "").splitlines():
+        parts = line.split()
+        if len(parts) not in (3, 4) or parts[0] != "VM_TIME":
+            continue
+        try:
+            epoch = float(parts[1])
+        except ValueError:
+            continue
+        times.setdefault(":".join(parts[2:]), epoch)
+    return times
+
+
+def _add_guest_timeline(timeline, guest_times, results_dir, runs, qemu_started=None, qemu_ended=None):
+    # Guest phases from the VM_TIME markers, and mock's own stages from each
+    # run's state.log anchored at that run's start marker. Boot and shutdown
+    # are measured against the QEMU process when there is one.
+    at = dict((key, timeline.offset(epoch)) for key, epoch in guest_times.items())
+    timeline.add("boot", qemu_started, at.get("script_start"), source="guest")
+    timeline.add("guest_setup", at.get("script_start"), at.get("batch_start"), source="guest")
+    timeline.add("mock_install", at.get("batch_start"), at.get("mock_ready"), source="guest")
+    timeline.add(
+        "environment_probe", at.get("mock_ready", at.get("batch_start")), at.get("run_start:1"), source="guest"
+    )
+    for run_index in range(1, runs + 1):
+        run_start = at.get("run_start:%d" % run_index)
+        run_end = at.get("run_end:%d" % run_index)
+        timeline.add("run", run_start, run_end, source="guest", run=run_index)
+        if run_start is None:
+            continue
+        build_end = None
+        for stage in mock_stage_timings(Path(results_dir) / ("result-run-%d" % run_index)):
+            timeline.add(
+                stage["stage"], run_start + stage["start"], run_start + stage["end"], source="mock", run=run_index
+            )
+            if stage["stage"] == "rpmbuild":
+                build_end = run_start + stage["end"]
+        # Copying results out of the chroot and cleaning it up.
+        timeline.add("results", build_end, run_end, source="mock", run=run_index)
+    timeline.add("shutdown", at.get("batch_end"), qemu_ended, source="guest")
+
+
+def parse_vm_share_benchmark(log_path):
+    # Written by GUEST_SHARE_BENCHMARK when --vm-share-benchmark is set.
+    for line in (_read_text(log_path) or "").splitlines():
+        if line.startswith("VM_SHARE_BENCH "):
+            fields = dict(item.split("=", 1) for item in line.split()[1:] if "=" in item)
+            try:
+                return {
+                    "files": int(fields["files"]),
+                    "bytes": int(fields["bytes"]),
+                    "seconds": float(fields["seconds"]),
+                }
+            except (KeyError, ValueError):
+                return None
+    return None
+
+
 def parse_vm_actual_environment(log_path):
     data = {}
     for line in (_read_text(log_path) or "").splitlines():
@@ -299,7 +626,10 @@ def parse_vm_actual_environment(log_path):
     return _without_none(data)
 
 
-def _collect_vm_rebuilds(args, mock_cfg, srpm, results_dir, qemu_exit_code, qemu_elapsed):
+def _collect_vm_rebuilds(
+    args, mock_cfg, srpm, results_dir, qemu_exit_code, qemu_elapsed, uniqueext=None, guest_times=None
+):
+    guest_times = guest_times or {}
     rebuilds = []
     for run_index in range(1, args.runs + 1):
         resultdir = Path(results_dir) / ("result-run-%s" % run_index)
@@ -310,13 +640,21 @@ def _collect_vm_rebuilds(args, mock_cfg, srpm, results_dir, qemu_exit_code, qemu
             exit_code = qemu_exit_code
         else:
             break
+        elapsed = None if exit_file.exists() else round(qemu_elapsed, 1)
+        run_start = guest_times.get("run_start:%d" % run_index)
+        run_end = guest_times.get("run_end:%d" % run_index)
+        if run_start is not None and run_end is not None:
+            elapsed = round(run_end - run_start, 1)
         result = {
             "run": run_index,
             "exit_code": exit_code,
-            "elapsed_seconds": None if exit_file.exists() else round(qemu_elapsed, 1),
-            "command": _mock_command(mock_cfg, srpm, resultdir, args.isolation),
+            "elapsed_seconds": elapsed,
+            "command": _mock_command(mock_cfg, srpm, resultdir, args.isolation, uniqueext),
             "rpms": [summarize_file(path) for path in sorted(resultdir.glob("*.rpm"))],
         }
+        stages = mock_stage_timings(resultdir)
+        if stages:
+            result["stages"] = stages
         if exit_code != 0:
             diagnosis = _diagnose_mock_failure(resultdir)
             if diagnosis:
@@ -327,11 +665,11 @@ def _collect_vm_rebuilds(args, mock_cfg, srpm, results_dir, qemu_exit_code, qemu
     return rebuilds
 
 
-def _mock_command(mock_cfg, srpm, resultdir, isolation):
-    return [
-        "mock",
-        "-r",
-        str(mock_cfg),
+def _mock_command(mock_cfg, srpm, resultdir, isolation, uniqueext=None):
+    command = ["mock", "-r", str(mock_cfg)]
+    if uniqueext:
+        command.append("--uniqueext=%s" % uniqueext)
+    return command + [
         "--isolation=%s" % isolation,
         "--resultdir",
         str(resultdir),
@@ -340,20 +678,183 @@ def _mock_command(mock_cfg, srpm, resultdir, isolation):
     ]
 
 
-def _vm_rebuild_script(vm_workdir, mock_cfg, srpm, results_dir, runs, isolation, mount_workdir=True):
+def _vm_rebuild_script(vm_workdir, mock_cfg, srpm, results_dir, runs, isolation, share_mode="9p",
+                       share_benchmark=False):
+    return """#!/bin/bash
+{preamble}{mount_setup}
+mkdir -p "{vm_workdir}/metadata" "{results_dir}"
+exec >"{vm_workdir}/metadata/vm-rebuild.log" 2>&1
+cat /root/guanfu-vm-bootstrap.log || true
+mark() {{
+  echo "$*"
+}}
+mark "VM_BATCH_START $(date -Is)"
+echo "VM_TIME $(date +%s.%N) batch_start"
+{share_benchmark}{install_mock}
+echo "VM_TIME $(date +%s.%N) mock_ready"
+{environment_probe}
+mock_cfg="{mock_cfg}"
+srpm="{srpm}"
+results_dir="{results_dir}"
+runs="{runs}"
+isolation="{isolation}"
+{run_loop}
+echo "VM_TIME $(date +%s.%N) batch_end"
+mark "VM_BATCH_END $(date -Is)"
+sync
+poweroff -f || reboot -f || halt -f
+""".format(
+        preamble=_guest_preamble(vm_workdir),
+        mount_setup=_guest_mount_setup(vm_workdir, share_mode),
+        share_benchmark=GUEST_SHARE_BENCHMARK.format(vm_workdir=vm_workdir) if share_benchmark else "",
+        install_mock=GUEST_INSTALL_MOCK,
+        environment_probe=GUEST_ENVIRONMENT_PROBE,
+        run_loop=GUEST_RUN_LOOP,
+        vm_workdir=vm_workdir,
+        mock_cfg=mock_cfg,
+        srpm=srpm,
+        results_dir=results_dir,
+        runs=runs,
+        isolation=isolation,
+    )
+
+
+def _vm_agent_script(vm_workdir, share_mode="9p", snapshot=False):
+    # Long-running guest agent for the warm VM pool. Jobs arrive on the
+    # virtio-serial port as "JOB <id> <mock cfg> <srpm> <results dir> <runs>
+    # <isolation> <log> <uniqueext>" and run in the background, so the host
+    # may keep several in flight; run markers come back as
+    # "JOB_MARK <id> <marker>" and every job ends with "JOB_DONE <id> <rc>".
+    # A uniqueext of "-" builds in the plain mock root. "SHUTDOWN" waits for
+    # running jobs and powers the guest off.
+    # With snapshot=True the agent announces AGENT_SNAPSHOT_READY before the
+    # share is mounted, so the guest can be saved and later restored; the
+    # host then sends "RESUME <epoch>" to fix the clock and continue.
+    snapshot_pause = ""
+    if snapshot:
+        snapshot_pause = """echo "AGENT_SNAPSHOT_READY" >&3
+read -r command epoch <&3
+if [ "$command" = "RESUME" ]; then
+  date -s "@$epoch" >/dev/null || true
+fi
+"""
+    return """#!/bin/bash
+{preamble}
+{install_mock}
+set +x
+port="/dev/virtio-ports/{port_name}"
+for attempt in $(seq 1 120); do
+  [ -e "$port" ] && break
+  sleep 1
+done
+exec 3<>"$port"
+{snapshot_pause}{mount_setup}
+echo "AGENT_READY" >&3
+while read -r command id mock_cfg srpm results_dir runs isolation log uniqueext <&3; do
+  case "$command" in
+    JOB)
+      [ "$uniqueext" = "-" ] && uniqueext=""
+      (
+        mark() {{
+          echo "$*"
+          echo "JOB_MARK $id $*" >&3
+        }}
+        # The job's inputs are hard links to the run's own files: the build
+        # only runs once they are mounted read-only.
+        staged=""
+        writable=""
+        for dir in {staged_inputs}; do
+          [ -d "{vm_workdir}/$id/$dir" ] || continue
+          if mount --bind "{vm_workdir}/$id/$dir" "{vm_workdir}/$id/$dir"; then
+            staged="$staged {vm_workdir}/$id/$dir"
+            mount -o remount,bind,ro "{vm_workdir}/$id/$dir" || writable="$writable $dir"
+          else
+            writable="$writable $dir"
+          fi
+        done
+        mkdir -p "$(dirname "$log")" "$results_dir"
+        (
+          if [ -n "$writable" ]; then
+            echo "GuanFu: cannot mount$writable read-only; refusing to build"
+            exit 1
+          fi
+          mark "VM_BATCH_START $(date -Is)"
+          echo "VM_TIME $(date +%s.%N) batch_start"
+{environment_probe}
+{run_loop}
+          echo "VM_TIME $(date +%s.%N) batch_end"
+          mark "VM_BATCH_END $(date -Is)"
+          exit "$rc"
+        ) >"$log" 2>&1
+        rc=$?
+        for dir in $staged; do
+          umount "$dir" || true
+        done
+        sync
+        echo "JOB_DONE $id $rc" >&3
+      ) &
+      ;;
+    SHUTDOWN)
+      break
+      ;;
+  esac
+done
+wait
+sync
+poweroff -f || reboot -f || halt -f
+""".format(
+        preamble=_guest_preamble(vm_workdir),
+        install_mock=GUEST_INSTALL_MOCK,
+        port_name=AGENT_PORT_NAME,
+        snapshot_pause=snapshot_pause,
+        mount_setup=_guest_mount_setup(vm_workdir, share_mode),
+        vm_workdir=vm_workdir,
+        staged_inputs=" ".join(POOL_STAGED_INPUTS),
+        environment_probe=textwrap.indent(GUEST_ENVIRONMENT_PROBE, " " * 10),
+        run_loop=textwrap.indent(GUEST_RUN_LOOP, " " * 10),
+    )
+
+
+def _guest_mount_setup(vm_workdir, share_mode):
     mount_setup = ""
-    if mount_workdir:
-        mount_setup = """if ! mount -t 9p -o trans=virtio,version=9p2000.L,msize=104857600 "{mount_tag}" "{vm_workdir}"; then
+    if share_mode in ("9p", "virtiofs"):
+        if share_mode == "9p":
+            mount_options = "-t 9p -o trans=virtio,version=9p2000.L,msize=104857600"
+        else:
+            mount_options = "-t virtiofs"
+        mount_setup = """if ! mount {mount_options} "{mount_tag}" "{vm_workdir}"; then
   echo "VM_MOUNT_FAILED"
   sync
   poweroff -f || reboot -f || halt -f
 fi
 """.format(
+            mount_options=mount_options,
             mount_tag=DEFAULT_MOUNT_TAG,
             vm_workdir=vm_workdir,
         )
-    return """#!/bin/bash
-exec >/root/guanfu-vm-bootstrap.log 2>&1
+    elif share_mode == "job-disk":
+        mount_setup = """mkdir -p "{job_mount}"
+if ! {{ mountpoint -q "{job_mount}" || mount -o ro LABEL={job_label} "{job_mount}"; }} || ! mount LABEL={results_label} "{vm_workdir}"; then
+  echo "VM_MOUNT_FAILED"
+  sync
+  poweroff -f || reboot -f || halt -f
+fi
+ln -sfn "{job_mount}/inputs" "{vm_workdir}/inputs"
+if [ -d "{job_mount}/fallback-repo" ]; then
+  ln -sfn "{job_mount}/fallback-repo" "{vm_workdir}/fallback-repo"
+fi
+""".format(
+            job_mount=VM_JOB_MOUNT,
+            job_label=JOB_DISK_LABEL,
+            results_label=RESULTS_DISK_LABEL,
+            vm_workdir=vm_workdir,
+        )
+    return mount_setup
+
+
+def _guest_preamble(vm_workdir):
+    return """exec >/root/guanfu-vm-bootstrap.log 2>&1
+echo "VM_TIME $(date +%s.%N) script_start"
 set -x
 setenforce 0 || true
 mount -t proc proc /proc || true
@@ -367,53 +868,10 @@ if [ ! -s /etc/resolv.conf ]; then
   printf "# GUANFU_VM_RESOLV_FIX\\nnameserver 223.5.5.5\\n" > /etc/resolv.conf
 fi
 mkdir -p "{vm_workdir}"
-{mount_setup}
-mkdir -p "{vm_workdir}/metadata" "{results_dir}"
-exec >"{vm_workdir}/metadata/vm-rebuild.log" 2>&1
-cat /root/guanfu-vm-bootstrap.log || true
-echo "VM_BATCH_START $(date -Is)"
-if ! command -v mock >/dev/null 2>&1; then
-  dnf -y install mock rpm-build || yum -y install mock rpm-build || true
-fi
-echo "VM_ACTUAL_KERNEL=$(uname -r)"
-echo "VM_ACTUAL_MOCK=$(mock --version 2>/dev/null | head -1)"
-echo "VM_ACTUAL_RPM=$(rpm --version 2>/dev/null | head -1)"
-echo "VM_ACTUAL_DNF=$(dnf --version 2>/dev/null | head -1)"
-echo "VM_ACTUAL_CPU_MODEL=$(lscpu 2>/dev/null | sed -n 's/^Model name:[[:space:]]*//p' | head -1)"
-echo "VM_ACTUAL_CPU_FAMILY=$(lscpu 2>/dev/null | sed -n 's/^CPU family:[[:space:]]*//p' | head -1)"
-echo "VM_ACTUAL_CPU_MODEL_ID=$(lscpu 2>/dev/null | sed -n 's/^Model:[[:space:]]*//p' | head -1)"
-echo "VM_ACTUAL_CPU_FLAGS=$(grep -m1 '^flags' /proc/cpuinfo | cut -d: -f2- | sed 's/^ *//')"
-run=1
-while [ "$run" -le "{runs}" ]; do
-  resultdir="{results_dir}/result-run-$run"
-  rm -rf "$resultdir"
-  mkdir -p "$resultdir"
-  echo "VM_REBUILD_PKG_RUN_START $run $(date -Is)"
-  mock -r "{mock_cfg}" --isolation="{isolation}" --resultdir "$resultdir" --rebuild "{srpm}"
-  rc=$?
-  echo "$rc" > "$resultdir/mock.exit"
-  echo "VM_REBUILD_PKG_RUN_EXIT $run $rc $(date -Is)"
-  find "$resultdir" -maxdepth 1 -type f -printf "%f %s bytes\\n" | sort || true
-  if [ "$rc" -ne 0 ]; then
-    break
-  fi
-  run=$((run + 1))
-done
-echo "VM_BATCH_END $(date -Is)"
-sync
-poweroff -f || reboot -f || halt -f
-""".format(
-        vm_workdir=vm_workdir,
-        mount_setup=mount_setup,
-        mock_cfg=mock_cfg,
-        srpm=srpm,
-        results_dir=results_dir,
-        runs=runs,
-        isolation=isolation,
-    )
+""".format(vm_workdir=vm_workdir)
 
 
-def prepare_vm_image(args, run_dir, profile):
+def prepare_vm_image(args, run_dir, profile, share_mode=None, cache_dir=None, timeline=None):
     image_ref = getattr(args, "vm_image", None) or profile.get("default_image_url")
     if not image_ref:
         raise RuntimeError("VM image is required for --executor vm")
@@ -422,7 +880,9 @@ def prepare_vm_image(args, run_dir, profile):
     if image_format_hint == "qcow2":
         _select_qemu_img_binary(getattr(args, "vm_qemu_img_binary", None))
 
-    base_image, source = _resolve_vm_image(image_ref, run_dir)
+    cache_dir = Path(cache_dir) if cache_dir else Path(run_dir).parent / "vm-cache"
+    with timed(timeline, "base_image"):
+        base_image, source = _resolve_vm_image(image_ref, cache_dir, getattr(args, "vm_image_sha256", None))
     image_format = _resolve_image_format(args, base_image, profile)
     if image_format == "raw":
         _validate_direct_boot_paths(args)
@@ -436,41 +896,101 @@ def prepare_vm_image(args, run_dir, profile):
         raise RuntimeError("unsupported VM image format: %s" % image_format)
 
     qemu_img = _select_qemu_img_binary(getattr(args, "vm_qemu_img_binary", None))
+    golden = None
+    if share_mode != "job-disk" or _virt_customize_available(args):
+        with timed(timeline, "golden_image"):
+            golden = _prepare_golden_image(args, cache_dir, profile, base_image, source, qemu_img)
     overlay = Path(run_dir) / "metadata" / "vm-overlay.qcow2"
     if overlay.exists():
         overlay.unlink()
-    subprocess.run(
-        [
-            qemu_img,
-            "create",
-            "-f",
-            "qcow2",
-            "-F",
-            "qcow2",
-            "-b",
-            str(base_image),
-            str(overlay),
-        ],
-        check=True,
-    )
+    with timed(timeline, "overlay"):
+        subprocess.run(
+            [
+                qemu_img,
+                "create",
+                "-f",
+                "qcow2",
+                "-F",
+                "qcow2",
+                "-b",
+                golden["path"] if golden else str(base_image),
+                str(overlay),
+            ],
+            check=True,
+        )
     return {
         "path": str(overlay),
         "format": "qcow2",
         "source": source,
         "overlay": str(overlay),
         "qemu_img": qemu_img,
+        "golden": golden,
+    }
+
+
+def golden_image_key(base_sha256, packages, profile):
+    material = {
+        "version": GOLDEN_IMAGE_VERSION,
+        "base_sha256": base_sha256,
+        "packages": sorted(set(_prepare_package_list(packages))),
+        "profile": profile.get("name"),
     }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
 
 
-def _resolve_vm_image(image_ref, run_dir):
+def _prepare_golden_image(args, cache_dir, profile, base_image, source, qemu_img):
+    # The prepare packages are installed once into a standalone, read-only
+    # qcow2 keyed by base image, package set and profile; every run then only
+    # needs a thin overlay on top of it.
+    packages = getattr(args, "vm_prepare_packages", "mock,rpm-build")
+    if not _prepare_package_list(packages) or getattr(args, "vm_golden_image", "cache") == "none":
+        return None
+    key = golden_image_key(source["sha256"], packages, profile)
+    golden = Path(cache_dir) / "golden" / ("%s.qcow2" % key[:32])
+    summary = {
+        "path": str(golden.resolve()),
+        "key": key,
+        "packages": sorted(set(_prepare_package_list(packages))),
+    }
+    golden.parent.mkdir(parents=True, exist_ok=True)
+    # One builder per key across threads and processes; the others wait and
+    # then reuse its image. A published golden image is never replaced.
+    with open(str(golden.with_name(".%s.lock" % golden.name)), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if golden.exists():
+            summary["status"] = "reused"
+            return summary
+        partial = golden.with_name(".%s.%d.%d.partial" % (golden.name, os.getpid(), threading.get_ident()))
+        try:
+            subprocess.run([qemu_img, "convert", "-O", "qcow2", str(base_image), str(partial)], check=True)
+            virt_customize = _select_virt_customize_binary(getattr(args, "vm_virt_customize_binary", None))
+            subprocess.run(
+                [virt_customize, "-a", str(partial), "--run-command", _guest_prepare_package_command(packages)],
+                check=True,
+                env=_libguestfs_env(),
+            )
+            partial.chmod(0o444)
+            os.link(str(partial), str(golden))
+        finally:
+            if partial.exists():
+                partial.unlink()
+    summary["status"] = "built"
+    return summary
+
+
+def _resolve_vm_image(image_ref, cache_dir, expected_sha256=None):
     if _is_url(image_ref):
         filename = Path(urllib.parse.urlparse(image_ref).path).name
         if not filename:
             raise RuntimeError("VM image URL does not include a filename: %s" % image_ref)
-        cache_dir = Path(run_dir).parent / "vm-cache"
-        cached = cache_dir / filename
+        cached = Path(cache_dir) / filename
+        # download_url renames into place only after a complete download, so an
+        # existing file is whole; the published checksum also catches stale copies.
+        if cached.exists() and expected_sha256 and persistent_sha256(cached) != expected_sha256.lower():
+            cached.unlink()
         if not cached.exists() or cached.stat().st_size == 0:
-            download_url(image_ref, cached)
+            download_url(image_ref, cached, expected_sha256=expected_sha256)
+        persistent_sha256(cached)
         return cached.resolve(), summarize_file(cached, label="vm_image", url=image_ref)
 
     image = Path(image_ref).expanduser()
@@ -523,9 +1043,15 @@ def _select_qemu_img_binary(requested=None):
     )
 
 
-def _preflight_vm_host_dependencies(args, profile, qemu_binary, acceleration_warning=None):
+def _preflight_vm_host_dependencies(args, profile, qemu_binary, acceleration_warning=None, share_mode=None):
     image_ref = getattr(args, "vm_image", None) or profile.get("default_image_url")
     image_format = _resolve_image_format_from_ref(args, image_ref, profile)
+    if share_mode == "job-disk" and _select_boot_mode(args, {"format": image_format}) == "direct-init":
+        # direct-init runs the script from the root image, which job-disk mode never writes.
+        raise RuntimeError(
+            "--vm-share-mode job-disk cannot boot a raw image with --vm-kernel/--vm-initrd; "
+            "drop them to boot the image with cloud-init, or use another --vm-share-mode"
+        )
     checks = [
         {"name": "qemu", "status": "ok", "path": qemu_binary},
         {"name": "acceleration", "status": "ok", "value": "tcg" if acceleration_warning else "kvm"},
@@ -542,13 +1068,20 @@ def _preflight_vm_host_dependencies(args, profile, qemu_binary, acceleration_war
                 "path": _select_qemu_img_binary(getattr(args, "vm_qemu_img_binary", None)),
             }
         )
-        checks.append(
-            {
-                "name": "virt-customize",
-                "status": "ok",
-                "path": _select_virt_customize_binary(getattr(args, "vm_virt_customize_binary", None)),
-            }
-        )
+        if share_mode == "job-disk" and not _virt_customize_available(args):
+            # Only the golden image needs libguestfs in job-disk mode.
+            message = "virt-customize was not found; --vm-prepare-packages are installed inside the VM"
+            checks.append({"name": "virt-customize", "status": "missing"})
+            warnings.append(message)
+            print("[guanfu] WARNING: %s" % message, file=sys.stderr)
+        else:
+            checks.append(
+                {
+                    "name": "virt-customize",
+                    "status": "ok",
+                    "path": _select_virt_customize_binary(getattr(args, "vm_virt_customize_binary", None)),
+                }
+            )
     return _without_none({"checks": checks, "warnings": warnings or None})
 
 
@@ -567,16 +1100,48 @@ def _preflight_image_copy_dependencies(args):
     ]
 
 
+def _preflight_job_disk_dependencies():
+    seed_format, seed_tools = _select_seed_binaries()
+    return [
+        {"name": "mke2fs", "status": "ok", "path": _select_e2fsprogs_binary("mke2fs")},
+        {"name": "debugfs", "status": "ok", "path": _select_e2fsprogs_binary("debugfs")},
+        {"name": "cidata-seed", "status": "ok", "value": seed_format, "path": seed_tools[0]},
+    ]
+
+
+def _preflight_virtiofs_dependencies(args):
+    virtiofsd = _select_virtiofsd_binary(getattr(args, "vm_virtiofsd_binary", None))
+    check = {"name": "virtiofsd", "status": "ok", "path": virtiofsd}
+    try:
+        proc = subprocess.run(
+            [virtiofsd, "--version"],
+            check=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=10,
+        )
+        lines = (proc.stdout or "").strip().splitlines()
+        if lines:
+            check["version"] = lines[0]
+    except Exception:
+        pass
+    return [check]
+
+
 def _select_share_mode(args, qemu_binary):
     requested = getattr(args, "vm_share_mode", "auto")
-    if requested in ("9p", "image-copy"):
+    if requested in ("9p", "virtiofs", "image-copy", "job-disk"):
         return requested
     if requested != "auto":
         raise RuntimeError("unsupported VM share mode: %s" % requested)
-    return "9p" if _qemu_supports_9p(qemu_binary) else "image-copy"
+    devices = _qemu_devices(qemu_binary)
+    if "vhost-user-fs-pci" in devices and _virtiofsd_available(args):
+        return "virtiofs"
+    return "9p" if "virtio-9p-pci" in devices else "image-copy"
 
 
-def _qemu_supports_9p(qemu_binary):
+def _qemu_devices(qemu_binary):
     try:
         proc = subprocess.run(
             [qemu_binary, "-device", "help"],
@@ -587,8 +1152,94 @@ def _qemu_supports_9p(qemu_binary):
             timeout=10,
         )
     except Exception:
+        return ""
+    return proc.stdout or ""
+
+
+def _virtiofs_socket_path(run_dir):
+    return _short_socket_path("virtiofs", run_dir)
+
+
+def _short_socket_path(kind, path):
+    # Unix socket paths are limited to ~108 bytes, so sockets live in the
+    # temp directory under a name derived from the directory they serve.
+    digest = hashlib.sha256(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:16]
+    return Path(tempfile.gettempdir()) / ("guanfu-%s-%s.sock" % (kind, digest))
+
+
+def _start_virtiofsd(args, run_dir, log_path=None, socket_path=None):
+    virtiofsd = _select_virtiofsd_binary(getattr(args, "vm_virtiofsd_binary", None))
+    socket_path = Path(socket_path or _virtiofs_socket_path(run_dir))
+    if socket_path.exists():
+        socket_path.unlink()
+    log_path = Path(log_path or Path(run_dir) / "metadata" / "virtiofsd.log")
+    # The -o options are understood by both the C and the Rust virtiofsd.
+    command = [
+        virtiofsd,
+        "--socket-path=%s" % socket_path,
+        "-o",
+        "source=%s" % Path(run_dir).resolve(),
+        "-o",
+        "cache=auto",
+    ]
+    with open(str(log_path), "w") as log:
+        proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 10
+    while not socket_path.exists():
+        if proc.poll() is not None or time.time() > deadline:
+            _stop_virtiofsd(proc)
+            raise RuntimeError("virtiofsd did not create %s; see %s" % (socket_path, log_path))
+        time.sleep(0.1)
+    return proc, {"command": command, "socket": str(socket_path), "log": str(log_path)}
+
+
+def _stop_virtiofsd(proc):
+    # virtiofsd normally exits on its own once QEMU disconnects.
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def _select_virtiofsd_binary(requested=None):
+    if requested:
+        if Path(requested).exists() or shutil.which(requested):
+            return requested
+        raise RuntimeError("virtiofsd binary was not found: %s" % requested)
+    for candidate in ("virtiofsd", "/usr/libexec/virtiofsd", "/usr/lib/qemu/virtiofsd"):
+        resolved = shutil.which(candidate)
+        if resolved:
+            return resolved
+    raise RuntimeError(
+        "virtiofsd is required for virtiofs VM share mode. Please install virtiofsd "
+        "(for example: dnf install virtiofsd, or apt install virtiofsd)."
+    )
+
+
+def _virtiofsd_available(args):
+    # Auto mode starts virtiofsd once on an empty directory: an installed
+    # binary that cannot run here (no namespaces, no privileges) means 9p.
+    try:
+        virtiofsd = _select_virtiofsd_binary(getattr(args, "vm_virtiofsd_binary", None))
+    except RuntimeError:
         return False
-    return "virtio-9p-pci" in proc.stdout
+    with _VIRTIOFSD_PROBE_LOCK:
+        if virtiofsd not in _VIRTIOFSD_PROBES:
+            probe_dir = Path(tempfile.mkdtemp(prefix="guanfu-virtiofsd-"))
+            try:
+                proc, _info = _start_virtiofsd(
+                    args, probe_dir, log_path=probe_dir / "virtiofsd.log", socket_path=probe_dir / "probe.sock"
+                )
+                _stop_virtiofsd(proc)
+                _VIRTIOFSD_PROBES[virtiofsd] = True
+            except (OSError, RuntimeError):
+                _VIRTIOFSD_PROBES[virtiofsd] = False
+            finally:
+                shutil.rmtree(str(probe_dir), ignore_errors=True)
+        return _VIRTIOFSD_PROBES[virtiofsd]
 
 
 def _copy_inputs_into_vm(image, run_dir, args):
@@ -630,6 +1281,184 @@ def _copy_outputs_from_vm(image, run_dir, args):
     }
 
 
+def _job_disk_paths(run_dir):
+    metadata_dir = Path(run_dir).resolve() / "metadata"
+    return metadata_dir / "vm-seed.img", metadata_dir / "vm-job.img", metadata_dir / "vm-results.img"
+
+
+def _build_job_disks(run_dir, script):
+    # Both disks are built as plain files with e2fsprogs, so neither root nor
+    # a libguestfs appliance is needed.
+    mke2fs = _select_e2fsprogs_binary("mke2fs")
+    run_dir = Path(run_dir)
+    seed_disk, job_disk, results_disk = _job_disk_paths(run_dir)
+    staging = run_dir / "metadata" / "vm-job"
+    if staging.exists():
+        shutil.rmtree(str(staging))
+    staging.mkdir(parents=True)
+    try:
+        paths = [run_dir / "inputs"]
+        if (run_dir / "fallback-repo").exists():
+            paths.append(run_dir / "fallback-repo")
+        size = 0
+        for path in paths:
+            size += _link_tree(path, staging / path.name)
+        (staging / "guanfu-vm-rebuild.sh").write_text(script)
+        (staging / "guanfu-vm-rebuild.sh").chmod(0o755)
+        for disk in (seed_disk, job_disk, results_disk):
+            if disk.exists():
+                disk.unlink()
+        # Leave room for ext4 metadata and the journal.
+        job_size_kib = (size + size // 5) // 1024 + 32 * 1024
+        subprocess.run(
+            [mke2fs, "-q", "-t", "ext4", "-L", JOB_DISK_LABEL, "-d", str(staging), "-F", str(job_disk),
+             "%dk" % job_size_kib],
+            check=True,
+        )
+    finally:
+        shutil.rmtree(str(staging), ignore_errors=True)
+    seed_format = _build_seed_disk(seed_disk)
+    with open(str(results_disk), "wb") as handle:
+        handle.truncate(RESULTS_DISK_SIZE)
+    subprocess.run(
+        [mke2fs, "-q", "-t", "ext4", "-L", RESULTS_DISK_LABEL, "-E", "lazy_itable_init=1,lazy_journal_init=1",
+         "-F", str(results_disk)],
+        check=True,
+    )
+    return {
+        "tool": mke2fs,
+        "paths": [str(path) for path in paths],
+        "seed_disk": str(seed_disk),
+        "seed_format": seed_format,
+        "job_disk": str(job_disk),
+        "results_disk": str(results_disk),
+    }
+
+
+def _link_tree(source, dest):
+    # Hard links keep staging cheap; files are copied across filesystems.
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(str(source)):
+        target = Path(dest) / Path(dirpath).relative_to(source)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in filenames:
+            path = Path(dirpath) / name
+            try:
+                os.link(str(path), str(target / name))
+            except OSError:
+                shutil.copy2(str(path), str(target / name))
+            size += path.stat().st_size
+    return size
+
+
+def _build_seed_disk(seed_disk):
+    # cloud-init's NoCloud datasource only reads a "cidata" seed from vfat or
+    # iso9660, so the seed is kept apart from the ext4 job disk.
+    seed_format, tools = _select_seed_binaries()
+    seed_disk = Path(seed_disk)
+    staging = seed_disk.parent / "vm-seed"
+    if staging.exists():
+        shutil.rmtree(str(staging))
+    staging.mkdir(parents=True)
+    try:
+        meta_data, user_data = staging / "meta-data", staging / "user-data"
+        meta_data.write_text("instance-id: guanfu-%d\nlocal-hostname: guanfu-rebuild\n" % int(time.time()))
+        user_data.write_text(_job_disk_user_data())
+        if seed_format == "iso9660":
+            command = [tools[0]]
+            if Path(tools[0]).name == "xorriso":
+                command.extend(["-as", "mkisofs"])
+            subprocess.run(
+                command + ["-quiet", "-output", str(seed_disk), "-volid", SEED_DISK_LABEL, "-joliet", "-rock",
+                           str(user_data), str(meta_data)],
+                check=True,
+            )
+        else:
+            mkfs_vfat, mcopy = tools
+            with open(str(seed_disk), "wb") as handle:
+                handle.truncate(SEED_DISK_SIZE)
+            subprocess.run(
+                [mkfs_vfat, "-n", SEED_DISK_LABEL.upper(), str(seed_disk)],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            subprocess.run([mcopy, "-o", "-i", str(seed_disk), str(user_data), str(meta_data), "::"], check=True)
+    finally:
+        shutil.rmtree(str(staging), ignore_errors=True)
+    return seed_format
+
+
+def _job_disk_user_data():
+    return """#cloud-config
+runcmd:
+  - [bash, -c, "mkdir -p {job_mount} && mount -o ro LABEL={label} {job_mount} && exec bash {job_mount}/guanfu-vm-rebuild.sh"]
+""".format(job_mount=VM_JOB_MOUNT, label=JOB_DISK_LABEL)
+
+
+def _read_results_disk(run_dir):
+    debugfs = _select_e2fsprogs_binary("debugfs")
+    run_dir = Path(run_dir)
+    _seed_disk, _job_disk, results_disk = _job_disk_paths(run_dir)
+    dump_dir = run_dir / "metadata" / "vm-results"
+    if dump_dir.exists():
+        shutil.rmtree(str(dump_dir))
+    dump_dir.mkdir(parents=True)
+    try:
+        subprocess.run(
+            [debugfs, "-R", "rdump /results /metadata %s" % dump_dir, str(results_disk)],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        for name in ("results", "metadata"):
+            if (dump_dir / name).is_dir():
+                _merge_tree(dump_dir / name, run_dir / name)
+    finally:
+        shutil.rmtree(str(dump_dir), ignore_errors=True)
+    for disk in _job_disk_paths(run_dir):
+        if disk.exists():
+            disk.unlink()
+    return {
+        "tool": debugfs,
+        "paths": ["results", "metadata"],
+        "destination": str(run_dir),
+    }
+
+
+def _merge_tree(source, dest):
+    for dirpath, dirnames, filenames in os.walk(str(source)):
+        target = Path(dest) / Path(dirpath).relative_to(source)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in filenames:
+            os.replace(os.path.join(dirpath, name), str(target / name))
+
+
+def _select_e2fsprogs_binary(name):
+    resolved = shutil.which(name) or shutil.which(name, path="/usr/sbin:/sbin")
+    if resolved:
+        return resolved
+    raise RuntimeError(
+        "%s is required for job-disk VM share mode. Please install e2fsprogs 1.43 or newer "
+        "(for example: dnf install e2fsprogs, or apt install e2fsprogs)." % name
+    )
+
+
+def _select_seed_binaries():
+    # An iso9660 seed needs one tool; vfat needs dosfstools plus mtools.
+    for name in ("genisoimage", "xorriso", "mkisofs"):
+        resolved = shutil.which(name)
+        if resolved:
+            return "iso9660", [resolved]
+    mkfs_vfat = shutil.which("mkfs.vfat") or shutil.which("mkfs.vfat", path="/usr/sbin:/sbin")
+    mcopy = shutil.which("mcopy")
+    if mkfs_vfat and mcopy:
+        return "vfat", [mkfs_vfat, mcopy]
+    raise RuntimeError(
+        "genisoimage, xorriso or mkisofs (or mkfs.vfat with mcopy) is required to build the cloud-init "
+        "seed for job-disk VM share mode (for example: dnf install genisoimage, or apt install genisoimage)."
+    )
+
+
 def _select_virt_copy_binary(default, requested=None):
     if requested:
         if Path(requested).exists() or shutil.which(requested):
@@ -663,7 +1492,7 @@ def _inject_vm_script_raw(image, run_dir, script):
             subprocess.run(["umount", str(mount_dir)], check=False)
 
 
-def _inject_vm_script_systemd(image, run_dir, script, args):
+def _inject_vm_script_systemd(image, run_dir, script, args, prepared=False):
     if getattr(_inject_vm_script_systemd, "_skip_for_tests", False):
         return
     virt_customize = _select_virt_customize_binary(getattr(args, "vm_virt_customize_binary", None))
@@ -679,7 +1508,7 @@ def _inject_vm_script_systemd(image, run_dir, script, args):
         str(image),
     ]
     prepare_packages = getattr(args, "vm_prepare_packages", "mock,rpm-build")
-    if prepare_packages:
+    if prepare_packages and not prepared:
         command.extend(["--run-command", _guest_prepare_package_command(prepare_packages)])
     command.extend(
         [
@@ -721,16 +1550,26 @@ def _select_virt_customize_binary(requested=None):
     )
 
 
+def _virt_customize_available(args):
+    try:
+        _select_virt_customize_binary(getattr(args, "vm_virt_customize_binary", None))
+    except RuntimeError:
+        return False
+    return True
+
+
 def _libguestfs_env():
     env = os.environ.copy()
     env.setdefault("LIBGUESTFS_BACKEND", "direct")
     return env
 
 
+def _prepare_package_list(packages):
+    return [item for item in re.split(r"[,\s]+", packages or "") if item]
+
+
 def _guest_prepare_package_command(packages):
-    package_args = " ".join(
-        shlex.quote(item) for item in re.split(r"[,\s]+", packages or "") if item
-    )
+    package_args = " ".join(shlex.quote(item) for item in _prepare_package_list(packages))
     return (
         "mkdir -p /etc && "
         "rm -f /etc/resolv.conf && "
@@ -858,6 +1697,7 @@ def _vm_image_summary(vm_image):
             "source": vm_image.get("source"),
             "overlay": vm_image.get("overlay"),
             "qemu_img": vm_image.get("qemu_img"),
+            "golden": vm_image.get("golden"),
         }
     )
 
@@ -0,0 +1,560 @@
+import itertools
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from guanfu.koji_rebuild.artifact_store import _link_or_copy
+from guanfu.koji_rebuild.vm_executor import (
+    DEFAULT_VM_WORKDIR,
+    POOL_STAGED_INPUTS,
+    _inject_vm_script_raw,
+    _inject_vm_script_systemd,
+    _preflight_virtiofs_dependencies,
+    _preflight_vm_host_dependencies,
+    _select_acceleration,
+    _select_boot_mode,
+    _select_qemu_binary,
+    _select_share_mode,
+    _select_vm_profile,
+    _short_socket_path,
+    _sized_vm_args,
+    _start_virtiofsd,
+    _stop_virtiofsd,
+    _vm_agent_script,
+    build_qemu_command,
+    prepare_vm_image,
+)
+from guanfu.koji_rebuild.vm_scheduler import pinned_command, vm_resource_request
+from guanfu.koji_rebuild.vm_snapshot import (
+    SNAPSHOT_DISK,
+    SNAPSHOT_MEMORY,
+    QmpClient,
+    load_ready_snapshot,
+    ready_snapshot_key,
+    save_ready_snapshot,
+)
+
+
+DEFAULT_POOL_SIZE = 1
+DEFAULT_RECYCLE_AFTER = 10
+DEFAULT_GUEST_JOBS = 1
+# Guests that do not answer SHUTDOWN within this many seconds are killed.
+SHUTDOWN_TIMEOUT = 60
+
+
+class AgentError(RuntimeError):
+    pass
+
+
+def guest_job_slots(args):
+    # --vm-guest-jobs 0 gives every guest one concurrent job per vCPU.
+    slots = getattr(args, "vm_guest_jobs", DEFAULT_GUEST_JOBS)
+    if slots > 0:
+        return slots
+    smp = str(getattr(args, "vm_smp", "2")).split(",", 1)[0]
+    return int(smp) if smp.isdigit() else 1
+
+
+class VmPool:
+    # Hands rebuild jobs to already booted guests running the GuanFu agent.
+    # Guests only share vm-pool/jobs/, where every job gets a directory with
+    # copies of its inputs and room for its results, never the caches or
+    # other runs' directories. Guests are booted lazily up to `size`, run up
+    # to `guest_jobs` jobs at once, and are replaced by a fresh overlay once
+    # they have taken `recycle_after` jobs or any job has failed on them.
+    def __init__(
+        self, args, size=DEFAULT_POOL_SIZE, recycle_after=DEFAULT_RECYCLE_AFTER, guest_jobs=None, scheduler=None
+    ):
+        self.args = args
+        self.scheduler = scheduler
+        self.size = max(1, size)
+        self.recycle_after = max(1, recycle_after)
+        self.guest_jobs = max(1, guest_jobs or guest_job_slots(args))
+        self.workdir = Path(args.workdir).resolve()
+        self.jobs_dir = self.workdir / "vm-pool" / "jobs"
+        self.target_os = None
+        self.stats = {"boots": 0, "jobs": 0, "recycled": 0}
+        self._guests = []
+        self._booting = 0
+        self._indexes = itertools.count(1)
+        self._job_ids = itertools.count(1)
+        self._condition = threading.Condition()
+
+    @property
+    def slots(self):
+        return self.size * self.guest_jobs
+
+    def new_job(self, run_dir):
+        # A job for the run directory; the guest sees its copy of the run as
+        # <vm workdir>/<job id>.
+        job_id = "job-%d" % next(self._job_ids)
+        return {
+            "id": job_id,
+            "run_dir": Path(run_dir).resolve(),
+            "dir": self.jobs_dir / job_id,
+            "guest_dir": Path(getattr(self.args, "vm_workdir", DEFAULT_VM_WORKDIR)) / job_id,
+        }
+
+    def guest_path(self, job, path):
+        try:
+            relative = Path(path).resolve().relative_to(job["run_dir"])
+        except ValueError:
+            raise RuntimeError("%s is outside the run directory %s" % (path, job["run_dir"]))
+        guest = job["guest_dir"] / relative
+        if any(char.isspace() for char in str(guest)):
+            raise RuntimeError("VM pool paths must not contain whitespace: %s" % guest)
+        return guest
+
+    def run_job(self, target_os, job, mock_cfg, srpm, results_dir, runs, isolation, log):
+        # Paths are host paths inside job["run_dir"]; results and the log are
+        # moved back there once the job is done.
+        fields = [
+            str(self.guest_path(job, mock_cfg)),
+            str(self.guest_path(job, srpm)),
+            str(self.guest_path(job, results_dir)),
+            str(runs),
+            isolation,
+            str(self.guest_path(job, log)),
+        ]
+        for path in (mock_cfg, srpm):
+            if Path(path).resolve().relative_to(job["run_dir"]).parts[0] not in POOL_STAGED_INPUTS:
+                raise RuntimeError("%s is not below %s" % (path, " or ".join(POOL_STAGED_INPUTS)))
+        _stage_job(job, [results_dir, Path(log).parent])
+        try:
+            result = self._run_staged_job(target_os, job["id"], fields)
+        finally:
+            _collect_job(job, [results_dir, log])
+        return result
+
+    def _run_staged_job(self, target_os, job_id, fields):
+        guest, guest_job = self._acquire(target_os)
+        # Concurrent jobs of the same buildroot get their own mock root; the
+        # root cache is keyed by the shared root name and is still reused.
+        uniqueext = job_id if self.guest_jobs > 1 else "-"
+        healthy = False
+        try:
+            result = guest.run_job(job_id, fields + [uniqueext], timeout=getattr(self.args, "vm_timeout", 7200))
+            healthy = result["exit_code"] == 0 and not result["timed_out"]
+        finally:
+            self._release(guest, healthy)
+        result["uniqueext"] = None if uniqueext == "-" else uniqueext
+        result["pool"] = {
+            "guest": guest.name,
+            "guest_job": guest_job,
+            "guest_boot_seconds": guest.boot_seconds,
+            "guest_boot": guest.info.get("boot"),
+            "snapshot": guest.info.get("snapshot"),
+            "size": self.size,
+            "guest_jobs": self.guest_jobs,
+            "recycle_after": self.recycle_after,
+        }
+        return result
+
+    def close(self):
+        with self._condition:
+            guests, self._guests = self._guests, []
+        for guest in guests:
+            guest.close()
+
+    def summary(self):
+        return dict(self.stats, size=self.size, guest_jobs=self.guest_jobs, recycle_after=self.recycle_after)
+
+    def _acquire(self, target_os):
+        with self._condition:
+            if self.target_os is None:
+                self.target_os = target_os
+            elif target_os != self.target_os:
+                raise RuntimeError(
+                    "VM pool guests run %s; cannot rebuild a %s package" % (self.target_os, target_os)
+                )
+            while True:
+                for guest in self._guests:
+                    if not guest.retiring and guest.running < self.guest_jobs and guest.jobs < self.recycle_after:
+                        guest.running += 1
+                        guest.jobs += 1
+                        return guest, guest.jobs
+                if len(self._guests) + self._booting < self.size:
+                    break
+                self._condition.wait()
+            self._booting += 1
+            index = next(self._indexes)
+        guest = PoolGuest(self, "guest-%d" % index)
+        try:
+            guest.boot(target_os)
+        except Exception:
+            guest.close()
+            with self._condition:
+                self._booting -= 1
+                self._condition.notify_all()
+            raise
+        with self._condition:
+            self._booting -= 1
+            self.stats["boots"] += 1
+            guest.running = 1
+            guest.jobs = 1
+            self._guests.append(guest)
+            self._condition.notify_all()
+        return guest, 1
+
+    def _release(self, guest, healthy):
+        with self._condition:
+            self.stats["jobs"] += 1
+            guest.running -= 1
+            if not healthy or guest.jobs >= self.recycle_after:
+                guest.retiring = True
+            if not guest.retiring or guest.running:
+                self._condition.notify_all()
+                return
+        guest.close()
+        with self._condition:
+            if guest in self._guests:
+                self._guests.remove(guest)
+                self.stats["recycled"] += 1
+            self._condition.notify_all()
+
+
+class PoolGuest:
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self.dir = pool.workdir / "vm-pool" / name
+        self.jobs = 0
+        self.running = 0
+        self.retiring = False
+        self.boot_seconds = None
+        self.info = None
+        self.reservation = None
+        self.args = pool.args
+        self.process = None
+        self._virtiofsd = None
+        self._console = None
+        self._socket = None
+        self._reader = None
+        self._send_lock = threading.Lock()
+        self._jobs = {}
+        self._jobs_changed = threading.Condition()
+        self._agent_error = None
+
+    def boot(self, target_os):
+        args = self.pool.args
+        if self.dir.exists():
+            shutil.rmtree(str(self.dir))
+        (self.dir / "metadata").mkdir(parents=True)
+        snapshot = getattr(args, "vm_snapshot", "none") == "ready"
+        if self.pool.scheduler is not None:
+            # Pool guests keep the fixed --vm-smp/--vm-memory size for their
+            # whole life, whatever the jobs they take. The reservation also
+            # covers preparing the image, and QEMU gets its clamped size.
+            request = vm_resource_request(args, sizing="fixed")
+            self.reservation = self.pool.scheduler.reserve(request, label=self.name)
+            self.args = _sized_vm_args(args, request, self.reservation)
+        self.info = self._plan(target_os, snapshot)
+        started = time.time()
+        deadline = started + getattr(args, "vm_timeout", 7200)
+        vm_workdir = getattr(args, "vm_workdir", DEFAULT_VM_WORKDIR)
+        if snapshot:
+            self._boot_from_snapshot(_vm_agent_script(vm_workdir, self.info["share_mode"], snapshot=True), deadline)
+        else:
+            self._inject(_vm_agent_script(vm_workdir, self.info["share_mode"]))
+            self._launch(deadline)
+            self._expect("AGENT_READY", deadline)
+        self.boot_seconds = round(time.time() - started, 1)
+        print("[guanfu] VM pool %s ready after %.1fs" % (self.name, self.boot_seconds), file=sys.stderr)
+        self.start_dispatcher()
+
+    def start_dispatcher(self):
+        # Once the agent is ready one thread reads the port and routes
+        # markers and exit codes to the jobs waiting in run_job().
+        self._socket.settimeout(None)
+        threading.Thread(target=self._dispatch, name="%s-agent" % self.name, daemon=True).start()
+
+    def _plan(self, target_os, snapshot):
+        args = self.args
+        profile = _select_vm_profile(target_os, args)
+        qemu_binary = _select_qemu_binary(getattr(args, "vm_qemu_binary", None))
+        acceleration, acceleration_warning = _select_acceleration(getattr(args, "vm_require_kvm", False))
+        if snapshot:
+            # vhost-user-fs devices cannot be migrated to a file; an unmounted
+            # 9p export can.
+            if getattr(args, "vm_share_mode", "auto") not in ("auto", "9p"):
+                raise RuntimeError("--vm-snapshot ready needs --vm-share-mode 9p")
+            share_mode = "9p"
+        else:
+            share_mode = _select_share_mode(args, qemu_binary)
+        if share_mode not in ("virtiofs", "9p"):
+            raise RuntimeError("the VM pool needs a live share: use --vm-share-mode virtiofs or 9p")
+        preflight = _preflight_vm_host_dependencies(args, profile, qemu_binary, acceleration_warning, share_mode)
+        if share_mode == "virtiofs":
+            preflight["checks"].extend(_preflight_virtiofs_dependencies(args))
+        vm_image = prepare_vm_image(args, self.dir, profile, share_mode, cache_dir=self.pool.workdir / "vm-cache")
+        boot_mode = _select_boot_mode(args, vm_image)
+        if snapshot and (boot_mode != "systemd" or vm_image["format"] != "qcow2"):
+            raise RuntimeError("--vm-snapshot ready needs a qcow2 VM image")
+        return {
+            "profile": profile,
+            "acceleration": acceleration,
+            "qemu_binary": qemu_binary,
+            "vm_image": vm_image,
+            "boot_mode": boot_mode,
+            "share_mode": share_mode,
+            "preflight": preflight,
+            "boot": "cold",
+        }
+
+    def _inject(self, script):
+        vm_image = self.info["vm_image"]
+        if self.info["boot_mode"] == "direct-init":
+            _inject_vm_script_raw(vm_image["path"], self.dir, script)
+        else:
+            _inject_vm_script_systemd(
+                vm_image["path"], self.dir, script, self.args, prepared=bool(vm_image.get("golden"))
+            )
+
+    def _launch(self, deadline, qmp_socket=None, incoming=None):
+        args = self.args
+        metadata_dir = self.dir / "metadata"
+        agent_socket = _short_socket_path("agent", self.dir)
+        virtiofs_socket = _short_socket_path("virtiofs", self.dir)
+        for path in (agent_socket, virtiofs_socket, qmp_socket):
+            if path and Path(path).exists():
+                Path(path).unlink()
+        self.pool.jobs_dir.mkdir(parents=True, exist_ok=True)
+        if self.info["share_mode"] == "virtiofs":
+            self._virtiofsd, _info = _start_virtiofsd(
+                args, self.pool.jobs_dir, log_path=metadata_dir / "virtiofsd.log", socket_path=virtiofs_socket
+            )
+        command = build_qemu_command(
+            args,
+            qemu_binary=self.info["qemu_binary"],
+            profile=self.info["profile"],
+            acceleration=self.info["acceleration"],
+            shared_dir=self.pool.jobs_dir,
+            vm_image=self.info["vm_image"],
+            boot_mode=self.info["boot_mode"],
+            share_mode=self.info["share_mode"],
+            agent_socket=agent_socket,
+            virtiofs_socket=virtiofs_socket,
+        )
+        if qmp_socket:
+            command.extend(["-qmp", "unix:%s,server=on,wait=off" % qmp_socket])
+        if incoming:
+            command.extend(["-incoming", "exec:cat %s" % shlex.quote(str(incoming))])
+        command = pinned_command(command, self.reservation)
+        self.info["command"] = command
+        self._console = open(str(metadata_dir / "console.log"), "a")
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stdout=self._console, stderr=subprocess.STDOUT
+        )
+        self._connect(agent_socket, deadline)
+
+    def _boot_from_snapshot(self, script, deadline):
+        # The first guest for a given image and virtual hardware boots cold up
+        # to the agent's pause point and is saved; every guest then resumes
+        # from that state with a fresh overlay and only mounts the share.
+        args = self.args
+        cache_dir = self.pool.workdir / "vm-cache"
+        vm_image = self.info["vm_image"]
+        key = ready_snapshot_key(args, self.info, script)
+        snapshot = load_ready_snapshot(cache_dir, key)
+        if snapshot is None:
+            started = time.time()
+            self._inject(script)
+            qmp_socket = _short_socket_path("qmp", self.dir)
+            self._launch(deadline, qmp_socket=qmp_socket)
+            self._expect("AGENT_SNAPSHOT_READY", deadline)
+            qmp = QmpClient(qmp_socket, deadline)
+            try:
+                snapshot = save_ready_snapshot(
+                    qmp, self.process, cache_dir, key, vm_image["path"], round(time.time() - started, 1)
+                )
+            finally:
+                qmp.close()
+            self._disconnect()
+            print("[guanfu] Saved VM ready snapshot %s" % snapshot["path"], file=sys.stderr)
+
+        subprocess.run(
+            [
+                vm_image["qemu_img"],
+                "create",
+                "-f",
+                "qcow2",
+                "-F",
+                "qcow2",
+                "-b",
+                str(Path(snapshot["path"]) / SNAPSHOT_DISK),
+                vm_image["path"],
+            ],
+            check=True,
+        )
+        self._launch(deadline, incoming=Path(snapshot["path"]) / SNAPSHOT_MEMORY)
+        self._send("RESUME %d" % int(time.time()))
+        self._expect("AGENT_READY", deadline)
+        self.info["boot"] = "snapshot-restore"
+        self.info["snapshot"] = {"key": key, "path": snapshot["path"], "status": snapshot["status"]}
+
+    def _expect(self, expected, deadline):
+        line = self._readline(deadline)
+        if line != expected:
+            raise AgentError("%s: expected %s from the agent, got %r" % (self.name, expected, line))
+
+    def run_job(self, job_id, fields, timeout):
+        started = time.time()
+        job = {"markers": [], "exit_code": None}
+        exit_code = None
+        timed_out = False
+        with self._jobs_changed:
+            self._jobs[job_id] = job
+        try:
+            self._send(" ".join(["JOB", job_id] + fields))
+            deadline = started + timeout
+            with self._jobs_changed:
+                while job["exit_code"] is None and self._agent_error is None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise socket.timeout("%s: %s did not finish" % (self.name, job_id))
+                    self._jobs_changed.wait(remaining)
+                if job["exit_code"] is None:
+                    raise AgentError(self._agent_error)
+                exit_code = job["exit_code"]
+        except socket.timeout:
+            timed_out = True
+            exit_code = 124
+        except (OSError, AgentError) as exc:
+            print("[guanfu] WARNING: VM pool %s failed: %s" % (self.name, exc), file=sys.stderr)
+            exit_code = 1
+        finally:
+            with self._jobs_changed:
+                self._jobs.pop(job_id, None)
+        return {
+            "exit_code": exit_code,
+            "timed_out": timed_out,
+            "elapsed_seconds": round(time.time() - started, 1),
+            "markers": job["markers"],
+            "guest": self.info,
+        }
+
+    def _dispatch(self):
+        error = "agent connection closed"
+        try:
+            for line in self._reader:
+                parts = line.rstrip("\r\n").split(" ", 2)
+                with self._jobs_changed:
+                    job = self._jobs.get(parts[1]) if len(parts) == 3 else None
+                    if job is None:
+                        continue
+                    if parts[0] == "JOB_MARK":
+                        job["markers"].append(parts[2])
+                        print("[guanfu] %s %s: %s" % (self.name, parts[1], parts[2]), file=sys.stderr)
+                    elif parts[0] == "JOB_DONE":
+                        job["exit_code"] = int(parts[2])
+                        self._jobs_changed.notify_all()
+        except (OSError, ValueError) as exc:
+            error = str(exc)
+        with self._jobs_changed:
+            self._agent_error = "%s: %s" % (self.name, error)
+            self._jobs_changed.notify_all()
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self._send("SHUTDOWN")
+                self.process.wait(timeout=SHUTDOWN_TIMEOUT)
+            except (OSError, AgentError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self._disconnect()
+        overlay = self.dir / "metadata" / "vm-overlay.qcow2"
+        if overlay.exists():
+            overlay.unlink()
+        if self.reservation is not None:
+            self.pool.scheduler.release(self.reservation)
+            self.reservation = None
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                # Wakes the dispatcher thread blocked on the port.
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+        if self._virtiofsd is not None:
+            _stop_virtiofsd(self._virtiofsd)
+            self._virtiofsd = None
+        if self._console is not None:
+            self._console.close()
+            self._console = None
+
+    def _connect(self, path, deadline):
+        while True:
+            if self.process is not None and self.process.poll() is not None:
+                raise AgentError(
+                    "%s: QEMU exited with %s before the agent connected" % (self.name, self.process.returncode)
+                )
+            if Path(path).exists():
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(str(path))
+                except OSError:
+                    sock.close()
+                else:
+                    self._socket = sock
+                    self._reader = sock.makefile("r", encoding="utf-8", errors="replace", newline="\n")
+                    return
+            if time.time() > deadline:
+                raise socket.timeout("%s: agent socket %s did not appear" % (self.name, path))
+            time.sleep(0.2)
+
+    def _send(self, line):
+        if self._socket is None:
+            raise AgentError("%s: agent is not connected" % self.name)
+        with self._send_lock:
+            self._socket.sendall((line + "\n").encode("utf-8"))
+
+    def _readline(self, deadline):
+        self._socket.settimeout(max(0.1, deadline - time.time()))
+        line = self._reader.readline()
+        if not line:
+            raise AgentError("%s: agent connection closed" % self.name)
+        return line.rstrip("\r\n")
+
+
+def _stage_job(job, output_dirs):
+    for name in POOL_STAGED_INPUTS:
+        source = job["run_dir"] / name
+        if source.is_dir():
+            shutil.copytree(str(source), str(job["dir"] / name), symlinks=True, copy_function=_link_input)
+    for path in output_dirs:
+        (job["dir"] / Path(path).resolve().relative_to(job["run_dir"])).mkdir(parents=True, exist_ok=True)
+
+
+def _collect_job(job, paths):
+    for path in paths:
+        path = Path(path).resolve()
+        staged = job["dir"] / path.relative_to(job["run_dir"])
+        if staged.is_dir():
+            path.mkdir(parents=True, exist_ok=True)
+            for entry in staged.iterdir():
+                target = path / entry.name
+                if target.is_dir() and not target.is_symlink():
+                    shutil.rmtree(str(target))
+                elif target.exists() or target.is_symlink():
+                    target.unlink()
+                shutil.move(str(entry), str(target))
+        elif staged.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(staged), str(path))
+    shutil.rmtree(str(job["dir"]), ignore_errors=True)
+
+
+def _link_input(source, dest):
+    # Inputs are only read, and the guest refuses to build unless it can mount
+    # them read-only, so a hard link is enough; only results are per job.
+    _link_or_copy(Path(source), Path(dest))
+    return dest
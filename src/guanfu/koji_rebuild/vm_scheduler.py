@@ -0,0 +1,243 @@
+import itertools
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+
+
+# Host memory left to the kernel, QEMU itself and the guanfu process.
+HOST_MEMORY_HEADROOM_MIB = 2048
+# Scratch disk accounted per VM on top of the SRPM-dependent estimate.
+VM_SCRATCH_BASE_BYTES = 4 << 30
+VM_SCRATCH_PER_SRPM_BYTE = 20
+# Cost model used when Koji recorded no hardware: (largest SRPM size, vCPUs,
+# memory MiB); the last row takes everything bigger.
+VM_COST_MODEL = (
+    (5 << 20, 2, 4096),
+    (50 << 20, 4, 8192),
+    (None, 8, 16384),
+)
+
+
+def parse_memory_mib(value):
+    # QEMU -m syntax: a number with an optional K/M/G/T suffix, MiB by default.
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError("invalid memory size: %r" % value)
+    number, unit = float(match.group(1)), match.group(2).upper()
+    scale = {"K": 1.0 / 1024, "": 1, "M": 1, "G": 1024, "T": 1024 * 1024}[unit]
+    return int(number * scale)
+
+
+def parse_cpu_list(text):
+    cpus = []
+    for part in (text or "").strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+def parse_hw_info_resources(hw_info):
+    # Koji's hw_info.log holds `lscpu` and `free` output of the builder.
+    resources = {}
+    match = re.search(r"(?m)^CPU\(s\):\s*(\d+)\s*$", hw_info or "")
+    if match:
+        resources["cpus"] = int(match.group(1))
+    match = re.search(r"(?m)^Mem:\s+(\d+(?:\.\d+)?)([KMGT]?)i?\s", hw_info or "")
+    if match:
+        # Plain `free` prints KiB; `free -h` adds a unit.
+        resources["memory_mib"] = parse_memory_mib(match.group(1) + (match.group(2) or "K"))
+    return resources
+
+
+def detect_host_capacity(workdir):
+    if hasattr(os, "sched_getaffinity"):
+        allowed = set(os.sched_getaffinity(0))
+    else:
+        allowed = set(range(os.cpu_count() or 1))
+    memory_mib = None
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                memory_mib = int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    Path(workdir).mkdir(parents=True, exist_ok=True)
+    numa_nodes = []
+    for node_dir in sorted(Path("/sys/devices/system/node").glob("node[0-9]*")):
+        try:
+            cpus = set(parse_cpu_list((node_dir / "cpulist").read_text())) & allowed
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            numa_nodes.append({"node": int(node_dir.name[4:]), "cpus": sorted(cpus)})
+    return {
+        "cpus": sorted(allowed),
+        "memory_mib": max(0, (memory_mib or 0) - HOST_MEMORY_HEADROOM_MIB) or None,
+        "disk_bytes": shutil.disk_usage(str(workdir)).free,
+        "numa_nodes": numa_nodes,
+    }
+
+
+def vm_resource_request(args, inputs_dir=None, srpm=None, sizing=None):
+    # The VM size for one rebuild: --vm-smp/--vm-memory, the Koji builder
+    # recorded in hw_info.log, or the SRPM-size cost model.
+    sizing = sizing or getattr(args, "vm_sizing", "fixed")
+    srpm_bytes = Path(srpm).stat().st_size if srpm and Path(srpm).exists() else 0
+    request = {
+        "sizing": "fixed",
+        "smp": _smp_count(getattr(args, "vm_smp", "2")),
+        "memory_mib": parse_memory_mib(getattr(args, "vm_memory", "4096M")),
+        "disk_bytes": VM_SCRATCH_BASE_BYTES + srpm_bytes * VM_SCRATCH_PER_SRPM_BYTE,
+    }
+    if sizing == "koji" and inputs_dir:
+        hw_info_path = Path(inputs_dir) / "hw_info.log"
+        recorded = parse_hw_info_resources(hw_info_path.read_text(errors="replace")) if hw_info_path.exists() else {}
+        if recorded.get("cpus") and recorded.get("memory_mib"):
+            request.update(sizing="koji", smp=recorded["cpus"], memory_mib=recorded["memory_mib"])
+            return request
+    if sizing in ("koji", "cost"):
+        for limit, smp, memory_mib in VM_COST_MODEL:
+            if limit is None or srpm_bytes <= limit:
+                request.update(sizing="cost", smp=smp, memory_mib=memory_mib)
+                break
+    return request
+
+
+def _smp_count(value):
+    match = re.match(r"^\s*(?:cpus=)?(\d+)", str(value))
+    return int(match.group(1)) if match else 1
+
+
+class VmScheduler:
+    # Admits VMs first come, first served while their vCPUs, memory and
+    # scratch disk fit into what the host has left. Requests larger than the
+    # whole host are clamped so they run alone instead of waiting forever.
+    def __init__(self, capacity, pin_cpus=False):
+        self.capacity = capacity
+        self.pin_cpus = pin_cpus
+        self.stats = {"admitted": 0, "queued": 0, "max_running": 0, "queued_seconds": 0.0}
+        self._free_cpus = set(capacity["cpus"])
+        self._free_cpu_count = len(capacity["cpus"])
+        self._free_memory = capacity.get("memory_mib")
+        self._free_disk = capacity.get("disk_bytes")
+        self._running = 0
+        self._tickets = itertools.count()
+        self._queue = []
+        self._condition = threading.Condition()
+
+    def reserve(self, request, label=None):
+        wanted = self._clamp(request)
+        queued = time.time()
+        with self._condition:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            waited = False
+            while self._queue[0] != ticket or not self._fits(wanted):
+                if not waited:
+                    waited = True
+                    self.stats["queued"] += 1
+                self._condition.wait()
+            self._queue.pop(0)
+            reservation = dict(wanted, label=label)
+            self._take(reservation)
+            self._running += 1
+            self.stats["admitted"] += 1
+            self.stats["max_running"] = max(self.stats["max_running"], self._running)
+            reservation["queued_seconds"] = round(time.time() - queued, 1)
+            self.stats["queued_seconds"] = round(self.stats["queued_seconds"] + reservation["queued_seconds"], 1)
+            self._condition.notify_all()
+        return reservation
+
+    def release(self, reservation):
+        with self._condition:
+            self._free_cpus.update(reservation.get("cpus") or [])
+            self._free_cpu_count += reservation["smp"]
+            if self._free_memory is not None:
+                self._free_memory += reservation["memory_mib"]
+            if self._free_disk is not None:
+                self._free_disk += reservation["disk_bytes"]
+            self._running -= 1
+            self._condition.notify_all()
+
+    def summary(self):
+        return dict(
+            self.stats,
+            host_cpus=len(self.capacity["cpus"]),
+            host_memory_mib=self.capacity.get("memory_mib"),
+            host_disk_bytes=self.capacity.get("disk_bytes"),
+            numa_nodes=len(self.capacity.get("numa_nodes") or []),
+            pin_cpus=self.pin_cpus,
+        )
+
+    def _clamp(self, request):
+        wanted = {
+            "smp": min(request["smp"], len(self.capacity["cpus"])),
+            "memory_mib": request["memory_mib"],
+            "disk_bytes": request["disk_bytes"],
+        }
+        if self.capacity.get("memory_mib") is not None:
+            wanted["memory_mib"] = min(wanted["memory_mib"], self.capacity["memory_mib"])
+        if self.capacity.get("disk_bytes") is not None:
+            wanted["disk_bytes"] = min(wanted["disk_bytes"], self.capacity["disk_bytes"])
+        return wanted
+
+    def _fits(self, wanted):
+        if wanted["smp"] > self._free_cpu_count:
+            return False
+        if self._free_memory is not None and wanted["memory_mib"] > self._free_memory:
+            return False
+        return self._free_disk is None or wanted["disk_bytes"] <= self._free_disk
+
+    def _take(self, reservation):
+        self._free_cpu_count -= reservation["smp"]
+        if self._free_memory is not None:
+            self._free_memory -= reservation["memory_mib"]
+        if self._free_disk is not None:
+            self._free_disk -= reservation["disk_bytes"]
+        if not self.pin_cpus:
+            return
+        # Prefer the NUMA node that can hold the whole VM with the fewest
+        # CPUs to spare; otherwise spread over whatever is free.
+        candidates = []
+        for node in self.capacity.get("numa_nodes") or []:
+            free = sorted(self._free_cpus & set(node["cpus"]))
+            if len(free) >= reservation["smp"]:
+                candidates.append((len(free), node["node"], free))
+        if candidates:
+            _count, node, free = min(candidates)
+            reservation["numa_node"] = node
+        else:
+            free = sorted(self._free_cpus)
+        reservation["cpus"] = free[: reservation["smp"]]
+        self._free_cpus.difference_update(reservation["cpus"])
+
+
+def pinned_command(command, reservation):
+    # Runs QEMU on the reserved host CPUs, and on the node's memory when the
+    # CPUs all sit on one NUMA node.
+    cpus = (reservation or {}).get("cpus")
+    if not cpus:
+        return command
+    numactl = shutil.which("numactl")
+    if numactl and reservation.get("numa_node") is not None:
+        return [
+            numactl,
+            "--physcpubind=%s" % format_cpu_list(cpus),
+            "--membind=%s" % reservation["numa_node"],
+        ] + command
+    taskset = shutil.which("taskset")
+    if taskset:
+        return [taskset, "-c", format_cpu_list(cpus)] + command
+    return command
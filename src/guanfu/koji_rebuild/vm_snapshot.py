@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+
+# Bump when the ready-snapshot layout or the agent handshake changes.
+SNAPSHOT_VERSION = "1"
+SNAPSHOT_DISK = "disk.qcow2"
+SNAPSHOT_MEMORY = "memory.state"
+SNAPSHOT_INFO = "snapshot.json"
+
+
+class QmpClient:
+    # Minimal QEMU Machine Protocol client: JSON lines over a unix socket,
+    # asynchronous events are skipped.
+    def __init__(self, path, deadline):
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(str(path))
+                break
+            except OSError:
+                sock.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        self._socket = sock
+        self._reader = sock.makefile("r", encoding="utf-8")
+        self._read()
+        self.execute("qmp_capabilities")
+
+    def execute(self, command, arguments=None):
+        message = {"execute": command}
+        if arguments:
+            message["arguments"] = arguments
+        self._socket.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        while True:
+            reply = self._read()
+            if "event" in reply:
+                continue
+            if "error" in reply:
+                raise RuntimeError("QMP %s failed: %s" % (command, reply["error"].get("desc")))
+            return reply.get("return")
+
+    def close(self):
+        self._socket.close()
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise RuntimeError("QMP connection closed")
+        return json.loads(line)
+
+
+def qemu_version(qemu_binary):
+    try:
+        proc = subprocess.run(
+            [qemu_binary, "--version"],
+            check=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=10,
+        )
+    except Exception:
+        return None
+    lines = (proc.stdout or "").strip().splitlines()
+    return lines[0] if lines else None
+
+
+def ready_snapshot_key(args, info, agent_script):
+    # Everything the saved guest state depends on: the disk it booted from,
+    # the virtual hardware, the QEMU build and the agent that is paused.
+    vm_image = info["vm_image"]
+    golden = vm_image.get("golden") or {}
+    material = {
+        "version": SNAPSHOT_VERSION,
+        "image": golden.get("key") or (vm_image.get("source") or {}).get("sha256"),
+        "profile": info["profile"].get("name"),
+        "qemu_cpu": info["profile"].get("qemu_cpu"),
+        "qemu": qemu_version(info["qemu_binary"]),
+        "acceleration": info["acceleration"],
+        "machine": getattr(args, "vm_machine", "q35"),
+        "smp": str(getattr(args, "vm_smp", 2)),
+        "memory": str(getattr(args, "vm_memory", "4096M")),
+        "share_mode": info["share_mode"],
+        "agent": hashlib.sha256(agent_script.encode("utf-8")).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def snapshot_dir(cache_dir, key):
+    return Path(cache_dir) / "snapshots" / key[:32]
+
+
+def load_ready_snapshot(cache_dir, key):
+    directory = snapshot_dir(cache_dir, key)
+    info_path = directory / SNAPSHOT_INFO
+    if not info_path.exists():
+        return None
+    info = json.loads(info_path.read_text(encoding="utf-8"))
+    info.update({"path": str(directory), "status": "reused"})
+    return info
+
+
+def save_ready_snapshot(qmp, process, cache_dir, key, disk, boot_seconds):
+    # The guest is paused, its RAM and device state are migrated into a file,
+    # and QEMU quits so the disk overlay is flushed and frozen alongside it.
+    directory = snapshot_dir(cache_dir, key)
+    # Pool guests of one process may save the same key at once; each writes
+    # into its own partial directory and the first one to finish wins.
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    partial = Path(tempfile.mkdtemp(prefix=directory.name + ".", suffix=".partial", dir=str(directory.parent)))
+    try:
+        qmp.execute("stop")
+        qmp.execute("migrate", {"uri": "exec:cat > %s" % shlex.quote(str(partial / SNAPSHOT_MEMORY))})
+        while True:
+            status = (qmp.execute("query-migrate") or {}).get("status")
+            if status == "completed":
+                break
+            if status in ("failed", "cancelled"):
+                raise RuntimeError("saving the ready snapshot failed: migration %s" % status)
+            time.sleep(0.5)
+        try:
+            qmp.execute("quit")
+        except RuntimeError:
+            pass
+        process.wait(timeout=60)
+        shutil.move(str(disk), str(partial / SNAPSHOT_DISK))
+        (partial / SNAPSHOT_DISK).chmod(0o444)
+        (partial / SNAPSHOT_MEMORY).chmod(0o444)
+        info = {"key": key, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "boot_seconds": boot_seconds}
+        (partial / SNAPSHOT_INFO).write_text(json.dumps(info, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        try:
+            os.rename(str(partial), str(directory))
+        except OSError:
+            # Another guest or process finished the same snapshot first.
+            if not directory.exists():
+                raise
+    finally:
+        if partial.exists():
+            shutil.rmtree(str(partial), ignore_errors=True)
+    info.update({"path": str(directory), "status": "built"})
+    return info
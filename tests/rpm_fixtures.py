@@ -0,0 +1,148 @@
+import hashlib
+import struct
+
+from guanfu.koji_rebuild.rpm_header import (
+    RPM_HEADER_MAGIC,
+    RPM_LEAD_MAGIC,
+    TAGS,
+    TYPE_BIN,
+    TYPE_INT16,
+    TYPE_INT32,
+    TYPE_INT64,
+    TYPE_STRING,
+    TYPE_STRING_ARRAY,
+)
+
+_ALIGN = {TYPE_INT16: 2, TYPE_INT32: 4, TYPE_INT64: 8}
+_INT_FORMATS = {TYPE_INT16: "H", TYPE_INT32: "I", TYPE_INT64: "Q"}
+
+
+def _guess_type(value):
+    if isinstance(value, bytes):
+        return TYPE_BIN
+    if isinstance(value, str):
+        return TYPE_STRING
+    if isinstance(value, int):
+        return TYPE_INT32
+    if value and isinstance(value[0], str):
+        return TYPE_STRING_ARRAY
+    return TYPE_INT32
+
+
+def build_header(entries):
+    # entries: {tag name or number: value} or {tag: (type, value)}.
+    index = []
+    store = b""
+    for tag, value in entries.items():
+        tag = TAGS.get(tag, tag)
+        kind, value = value if isinstance(value, tuple) else (_guess_type(value), value)
+        store += b"\0" * (-len(store) % _ALIGN.get(kind, 1))
+        offset = len(store)
+        if kind == TYPE_BIN:
+            data, count = value, len(value)
+        elif kind == TYPE_STRING:
+            data, count = value.encode() + b"\0", 1
+        elif kind == TYPE_STRING_ARRAY:
+            data, count = b"".join(item.encode() + b"\0" for item in value), len(value)
+        else:
+            values = [value] if isinstance(value, int) else list(value)
+            data, count = struct.pack(">%d%s" % (len(values), _INT_FORMATS[kind]), *values), len(values)
+        store += data
+        index.append(struct.pack(">IIII", tag, kind, offset, count))
+    return RPM_HEADER_MAGIC + b"\0" * 4 + struct.pack(">II", len(index), len(store)) + b"".join(index) + store
+
+
+def build_rpm(header, signature=None, payload=b""):
+    lead = RPM_LEAD_MAGIC + b"\0" * 92
+    signature = build_header(signature or {})
+    padding = b"\0" * (-len(signature) % 8)
+    return lead + signature + padding + build_header(header) + payload
+
+
+def package_header(name="zlib", version="1.2.13", release="3.an23", arch="x86_64", files=None, **extra):
+    header = {
+        "NAME": name,
+        "VERSION": version,
+        "RELEASE": release,
+        "ARCH": arch,
+        "BUILDTIME": 1700000000,
+        "BUILDHOST": "koji-builder",
+        "SOURCERPM": "%s-%s-%s.src.rpm" % (name, version, release),
+        "SIZE": 1234,
+        "PAYLOADCOMPRESSOR": "zstd",
+        "PAYLOADFLAGS": "19",
+    }
+    files = files or []
+    if files:
+        dirnames = sorted(set(path.rsplit("/", 1)[0] + "/" for path, _ in files))
+        header.update(
+            {
+                "DIRNAMES": dirnames,
+                "BASENAMES": [path.rsplit("/", 1)[1] for path, _ in files],
+                "DIRINDEXES": [dirnames.index(path.rsplit("/", 1)[0] + "/") for path, _ in files],
+                "FILESIZES": [len(content) for _, content in files],
+                "FILEMODES": (TYPE_INT16, [0o100644] * len(files)),
+                "FILEMTIMES": [1700000000] * len(files),
+                "FILEDIGESTS": [hashlib.sha256(content).hexdigest() for _, content in files],
+                "FILEDIGESTALGO": 8,
+                "FILEFLAGS": [0] * len(files),
+                "FILEUSERNAME": ["root"] * len(files),
+                "FILEGROUPNAME": ["root"] * len(files),
+                "FILERDEVS": (TYPE_INT16, [0] * len(files)),
+                "FILELINKTOS": [""] * len(files),
+            }
+        )
+    header.update(extra)
+    return header
+
+
+def cpio_payload(files, stripped=False):
+    # files: [(path, bytes)] in header order; stripped uses rpm's "07070X" entries.
+    out = b""
+
+    def pad():
+        return b"\0" * (-len(out) % 4)
+
+    for index, (path, content) in enumerate(files):
+        if stripped:
+            out += b"07070X" + b"%08x" % index
+        else:
+            name = b"." + path.encode() + b"\0"
+            fields = [index + 1, 0o100644, 0, 0, 1, 0, len(content), 0, 0, 0, 0, len(name), 0]
+            out += b"070701" + b"".join(b"%08x" % value for value in fields) + name
+            out += pad()
+        out += content
+        out += pad()
+    name = b"TRAILER!!!\0"
+    out += b"070701" + b"".join(b"%08x" % value for value in [0] * 11 + [len(name), 0]) + name
+    out += pad()
+    return out
+
+
+def build_elf(sections, program_headers=()):
+    # Minimal little-endian ELF64 with the given [(name, bytes)] sections and
+    # (p_type, p_flags) program headers.
+    phdrs = b"".join(struct.pack("<IIQQQQQQ", p_type, p_flags, 0, 0, 0, 0, 0, 8) for p_type, p_flags in program_headers)
+    names = [""] + [name for name, _ in sections] + [".shstrtab"]
+    shstrtab = b""
+    name_offsets = []
+    for name in names:
+        name_offsets.append(len(shstrtab))
+        shstrtab += name.encode() + b"\0"
+    body = b""
+    offsets = []
+    for _, content in sections + [(".shstrtab", shstrtab)]:
+        offsets.append(64 + len(phdrs) + len(body))
+        body += content
+    body += b"\0" * (-len(body) % 8)
+    shoff = 64 + len(phdrs) + len(body)
+    phoff = 64 if phdrs else 0
+    ident = b"\x7fELF" + bytes([2, 1, 1]) + b"\0" * 9
+    elf_header = ident + struct.pack(
+        "<HHIQQQIHHHHHH", 3, 62, 1, 0, phoff, shoff, 0, 64, 56, len(program_headers), 64, len(names), len(names) - 1
+    )
+    headers = b"\0" * 64
+    for index, (_, content) in enumerate(sections + [(".shstrtab", shstrtab)]):
+        kind = 3 if index == len(sections) else 1
+        headers += struct.pack("<IIQQQQIIQQ", name_offsets[index + 1], kind, 0, 0, offsets[index], len(content), 0, 0, 1, 0)
+    return elf_header + phdrs + body + headers
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from guanfu.koji_rebuild.artifact_store import ArtifactStore
+from guanfu.koji_rebuild.downloader import download_url, sha256_file
+
+
+class ArtifactStoreTests(unittest.TestCase):
+    def test_add_links_file_to_read_only_object(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ArtifactStore(Path(tmp) / "store")
+            path = Path(tmp) / "run-1" / "inputs" / "pkg.rpm"
+            path.parent.mkdir(parents=True)
+            path.write_bytes(b"rpm payload")
+
+            sha256 = store.add(path, key="url:https://mirror.invalid/pkg.rpm")
+            copy = Path(tmp) / "run-2" / "inputs" / "pkg.rpm"
+            fetched = store.fetch("url:https://mirror.invalid/pkg.rpm", copy)
+            missing = store.fetch("url:https://mirror.invalid/other.rpm", Path(tmp) / "other.rpm")
+            summary = store.summary()
+            same_object = os.path.samefile(str(copy), str(store.object_path(sha256)))
+            mode = store.object_path(sha256).stat().st_mode & 0o777
+            store.close()
+
+        self.assertEqual(fetched, sha256)
+        self.assertIsNone(missing)
+        self.assertTrue(same_object)
+        self.assertEqual(mode, 0o444)
+        self.assertEqual(summary["hits"], 1)
+        self.assertEqual(summary["misses"], 1)
+        self.assertEqual(summary["bytes_reused"], len(b"rpm payload"))
+
+    def test_download_url_reuses_stored_artifact_until_the_url_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "mirror" / "pkg.rpm"
+            source.parent.mkdir()
+            source.write_bytes(b"published rpm")
+            os.utime(str(source), (1700000000, 1700000000))
+            url = source.as_uri()
+            store = ArtifactStore(Path(tmp) / "store")
+
+            first = download_url(url, Path(tmp) / "run-1" / "pkg.rpm", store=store)
+            second = download_url(url, Path(tmp) / "run-2" / "pkg.rpm", store=store)
+            same_object = os.path.samefile(str(first), str(second))
+            # Republished under the same URL: Last-Modified moves, the stored copy is not served.
+            source.write_bytes(b"re-signed rpm")
+            os.utime(str(source), (1700000100, 1700000100))
+            third = download_url(url, Path(tmp) / "run-3" / "pkg.rpm", store=store)
+            digests = [sha256_file(second), sha256_file(third)]
+            summary = store.summary()
+            store.close()
+
+        self.assertEqual(
+            digests, [hashlib.sha256(b"published rpm").hexdigest(), hashlib.sha256(b"re-signed rpm").hexdigest()]
+        )
+        self.assertTrue(same_object)
+        self.assertEqual(summary["stored"], 2)
+        self.assertEqual(summary["hits"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
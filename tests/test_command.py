@@ -0,0 +1,81 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from guanfu.koji_rebuild.command import _acquired, _compare_build_outputs, _run_acquisition_stage
+
+
+class AcquisitionStageTests(unittest.TestCase):
+    def test_runs_inputs_concurrently_and_keeps_per_item_errors(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def published_rpm():
+            barrier.wait()
+            return "rpm"
+
+        def task_srpm():
+            barrier.wait()
+            raise RuntimeError("downloadTaskOutput failed")
+
+        results, summary = _run_acquisition_stage(
+            [("published_rpm", published_rpm), ("koji_task_srpm", task_srpm)],
+            workers=2,
+        )
+
+        self.assertEqual(_acquired(results, "published_rpm"), "rpm")
+        with self.assertRaisesRegex(RuntimeError, "downloadTaskOutput failed"):
+            _acquired(results, "koji_task_srpm")
+        self.assertEqual([item["name"] for item in summary["items"]], ["published_rpm", "koji_task_srpm"])
+        self.assertEqual(summary["items"][0]["status"], "ok")
+        self.assertEqual(summary["items"][1]["status"], "error")
+        self.assertIn("seconds", summary["items"][1])
+        self.assertEqual(summary["workers"], 2)
+
+
+class BuildComparisonTests(unittest.TestCase):
+    def test_debug_packages_are_looked_up_in_the_debug_repo(self):
+        opened = []
+
+        def open_index(base_url, metadata_dir, index_dir, name="published-repo"):
+            opened.append(name)
+            return None, {"status": "error", "url": base_url}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            args = SimpleNamespace(
+                workdir=tmp,
+                binary_rpm_base_url="https://mirror/os/Packages/",
+                debug_rpm_base_url="https://mirror/debug/Packages/",
+            )
+            with patch("guanfu.koji_rebuild.command.open_published_repo_index", side_effect=open_index), patch(
+                "guanfu.koji_rebuild.command._download_published", return_value=(None, {"error": "404"})
+            ), patch("guanfu.koji_rebuild.command.compare_build", side_effect=lambda items, **kwargs: {"items": items}):
+                comparison = _compare_build_outputs(
+                    args,
+                    [
+                        Path(tmp) / "zlib-devel-1.2.13-3.an23.x86_64.rpm",
+                        Path(tmp) / "zlib-debuginfo-1.2.13-3.an23.x86_64.rpm",
+                        Path(tmp) / "zlib-debugsource-1.2.13-3.an23.x86_64.rpm",
+                    ],
+                    "zlib-1.2.13-3.an23.x86_64.rpm",
+                    None,
+                    Path(tmp) / "inputs",
+                    Path(tmp) / "metadata",
+                )
+
+        self.assertEqual(opened, ["published-repo", "debug-repo"])
+        self.assertEqual(
+            [item["reference_url"] for item in comparison["items"]],
+            [
+                "https://mirror/os/Packages/zlib-devel-1.2.13-3.an23.x86_64.rpm",
+                "https://mirror/debug/Packages/zlib-debuginfo-1.2.13-3.an23.x86_64.rpm",
+                "https://mirror/debug/Packages/zlib-debugsource-1.2.13-3.an23.x86_64.rpm",
+            ],
+        )
+        self.assertEqual(comparison["debug_repo"]["url"], "https://mirror/debug/Packages/")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+import gzip
+import hashlib
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from rpm_fixtures import build_header, build_rpm, cpio_payload, package_header
+
+from guanfu.koji_rebuild.assessment import build_level_assessment
+from guanfu.koji_rebuild.compare import compare_build, compare_published_and_rebuilt
+from guanfu.koji_rebuild.manifest import Manifest, diff_manifests, record_from_dump_line
+from guanfu.koji_rebuild.repo_fallback import published_package_url
+
+
+class TieredCompareTests(unittest.TestCase):
+    def _compare(self, published_bytes, rebuilt_bytes):
+        with tempfile.TemporaryDirectory() as tmp:
+            published = Path(tmp) / "published" / "zlib-1.2.13-3.an23.x86_64.rpm"
+            rebuilt = Path(tmp) / "rebuilt" / "zlib-1.2.13-3.an23.x86_64.rpm"
+            published.parent.mkdir()
+            rebuilt.parent.mkdir()
+            published.write_bytes(published_bytes)
+            rebuilt.write_bytes(rebuilt_bytes)
+            return compare_published_and_rebuilt(published, [rebuilt], rebuilt.name)
+
+    def _tiers(self, result):
+        return [(tier["tier"], tier["outcome"]) for tier in result["analysis"]["tiers"]]
+
+    def test_identical_files_stop_after_file_digest(self):
+        data = build_rpm(package_header(files=[("/usr/lib64/libz.so.1", b"elf")]))
+
+        result = self._compare(data, data)
+
+        self.assertEqual(self._tiers(result), [("file_digest", "equal")])
+        self.assertEqual(result["overall_assessment"]["trust_level"], "L4")
+
+    def test_matching_sigmd5_stops_after_header_digest(self):
+        header = package_header(files=[("/usr/lib64/libz.so.1", b"elf")])
+        # SIGMD5 covers the main header and the (empty) payload.
+        sigmd5 = hashlib.md5(build_header(header)).digest()
+        signed = build_rpm(header, {1004: sigmd5, 268: b"\x89\x00\x00"})
+        unsigned = build_rpm(header, {1004: sigmd5})
+
+        result = self._compare(signed, unsigned)
+
+        self.assertEqual(self._tiers(result), [("file_digest", "different"), ("header_digest", "sigmd5_equal")])
+        self.assertEqual([item["diff_type"] for item in result["diff_items"]], ["RPM_SIGNATURE"])
+
+    def test_copied_sigmd5_over_a_different_payload_is_not_trusted(self):
+        files = [("/usr/lib64/libz.so.1", b"elf")]
+        header = package_header(files=files, PAYLOADFORMAT="cpio", PAYLOADCOMPRESSOR="gzip")
+        published = build_rpm(header, {1004: b"\x01" * 16}, payload=gzip.compress(cpio_payload(files)))
+        swapped = build_rpm(
+            header, {1004: b"\x01" * 16}, payload=gzip.compress(cpio_payload([("/usr/lib64/libz.so.1", b"bad")]))
+        )
+
+        result = self._compare(published, swapped)
+
+        self.assertEqual(self._tiers(result)[1], ("header_digest", "digest_mismatch"))
+        self.assertEqual(self._tiers(result)[-1][0], "content")
+        self.assertEqual(result["overall_assessment"]["action"], "reject")
+        self.assertIn(
+            {"diff_type": "OTHER", "risk_level": "critical", "fields": ["SIGMD5"]},
+            [{key: item.get(key) for key in ("diff_type", "risk_level", "fields")} for item in result["diff_items"]],
+        )
+
+    def test_payload_digest_shortcut_checks_the_payload(self):
+        payload = b"payload"
+        header = package_header(
+            files=[("/usr/lib64/libz.so.1", b"elf")],
+            PAYLOADDIGEST=[hashlib.sha256(payload).hexdigest()],
+            PAYLOADDIGESTALGO=8,
+        )
+        published = build_rpm(header, {1004: b"\x01" * 16}, payload=payload)
+        rebuilt = build_rpm(dict(header, BUILDHOST="vm"), {1004: b"\x02" * 16}, payload=payload)
+        swapped = build_rpm(dict(header, BUILDHOST="vm"), {1004: b"\x02" * 16}, payload=b"swapped")
+
+        matching = self._compare(published, rebuilt)
+        tampered = self._compare(published, swapped)
+
+        self.assertEqual(self._tiers(matching)[1], ("header_digest", "payload_digest_equal"))
+        self.assertEqual(self._tiers(matching)[-1], ("content", "equal"))
+        self.assertEqual(self._tiers(tampered)[1], ("header_digest", "digest_mismatch"))
+        self.assertNotEqual(self._tiers(tampered)[-1], ("content", "equal"))
+
+    def test_differing_manifest_runs_all_tiers(self):
+        published = build_rpm(package_header(files=[("/usr/lib64/libz.so.1", b"elf")]), {1004: b"\x01" * 16})
+        rebuilt = build_rpm(package_header(files=[("/usr/lib64/libz.so.1", b"ELF")]), {1004: b"\x02" * 16})
+
+        result = self._compare(published, rebuilt)
+
+        self.assertEqual(
+            [tier for tier, _ in self._tiers(result)],
+            ["file_digest", "header_digest", "manifest", "content"],
+        )
+        self.assertEqual(self._tiers(result)[2], ("manifest", "different"))
+
+    def test_writes_untruncated_manifest_diff_sidecar(self):
+        published_files = [("/usr/share/zlib/%03d" % index, b"a") for index in range(60)]
+        rebuilt_files = [(path, b"b") for path, _ in published_files[1:]] + [("/usr/share/zlib/new", b"")]
+        with tempfile.TemporaryDirectory() as tmp:
+            published = Path(tmp) / "zlib.rpm"
+            rebuilt = Path(tmp) / "rebuilt" / "zlib.rpm"
+            rebuilt.parent.mkdir()
+            published.write_bytes(build_rpm(package_header(files=published_files), {1004: b"\x01" * 16}))
+            rebuilt.write_bytes(build_rpm(package_header(files=rebuilt_files), {1004: b"\x02" * 16}))
+            sidecar = Path(tmp) / "manifest-diff.jsonl"
+
+            result = compare_published_and_rebuilt(published, [rebuilt], rebuilt.name, manifest_diff_path=sidecar)
+            lines = [json.loads(line) for line in sidecar.read_text().splitlines()]
+
+        self.assertEqual(result["analysis"]["manifest_diff"]["records"], 61)
+        self.assertEqual(len(lines), 61)
+        self.assertEqual(lines[0], {"kind": "only_in_published", "path": "/usr/share/zlib/000"})
+        self.assertEqual(lines[1]["changed_fields"], ["digest"])
+        self.assertEqual(lines[-1]["path"], "/usr/share/zlib/new")
+
+    def test_manifest_merge_join_matches_dump_semantics(self):
+        published = Manifest([
+            record_from_dump_line("/b 1 10 aa 0100644 root root 0 0 0 X"),
+            record_from_dump_line("/a 1 10 aa 0100644 root root 0 0 0 X"),
+        ])
+        rebuilt = Manifest([
+            record_from_dump_line("/a 1 11 aa 0100644 root root 0 0 0 X"),
+            record_from_dump_line("/c 1 10 aa 0100644 root root 0 0 0 X"),
+        ])
+
+        diff = [(kind, getattr(value, "path", None) or value["path"]) for kind, value in diff_manifests(published, rebuilt)]
+
+        self.assertEqual(diff, [("changed", "/a"), ("only_in_published", "/b"), ("only_in_rebuilt", "/c")])
+        self.assertIs(published.records[0].owner, rebuilt.records[0].owner)
+
+
+class BuildCompareTests(unittest.TestCase):
+    def test_compares_every_subpackage_and_reports_build_verdict(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / "published").mkdir()
+            (tmp / "rebuilt").mkdir()
+            lib = build_rpm(package_header(files=[("/usr/lib64/libz.so.1", b"elf")]))
+            devel_published = build_rpm(package_header(name="zlib-devel", files=[("/usr/include/zlib.h", b"a")]))
+            devel_rebuilt = build_rpm(
+                package_header(name="zlib-devel", files=[("/usr/include/zlib.h", b"b")], BUILDHOST="vm")
+            )
+            for directory, devel in (("published", devel_published), ("rebuilt", devel_rebuilt)):
+                (tmp / directory / "zlib-1.2.13-3.an23.x86_64.rpm").write_bytes(lib)
+                (tmp / directory / "zlib-devel-1.2.13-3.an23.x86_64.rpm").write_bytes(devel)
+            shutil.copy(tmp / "rebuilt" / "zlib-1.2.13-3.an23.x86_64.rpm", tmp / "rebuilt" / "zlib-debuginfo.rpm")
+            items = [
+                {
+                    "package_name": name,
+                    "rebuilt": str(tmp / "rebuilt" / name),
+                    "published": str(tmp / "published" / name),
+                }
+                for name in ("zlib-1.2.13-3.an23.x86_64.rpm", "zlib-devel-1.2.13-3.an23.x86_64.rpm")
+            ]
+            items.append(
+                {
+                    "package_name": "zlib-debuginfo.rpm",
+                    "rebuilt": str(tmp / "rebuilt" / "zlib-debuginfo.rpm"),
+                    "published": None,
+                    "error": "HTTP 404: Not Found",
+                }
+            )
+
+            result = compare_build(items, workers=2)
+
+        packages = result["packages"]
+        self.assertEqual([item["status"] for item in packages], ["compared", "compared", "missing_published"])
+        self.assertTrue(packages[0]["overall_assessment"]["reproducible"])
+        self.assertFalse(packages[1]["overall_assessment"]["reproducible"])
+        verdict = result["overall_assessment"]
+        self.assertFalse(verdict["reproducible"])
+        self.assertEqual(verdict["packages"]["compared"], 2)
+        self.assertEqual(verdict["packages"]["reproducible"], 1)
+        self.assertEqual(verdict["packages"]["missing_published"], 1)
+        self.assertEqual(verdict["trust_level"], packages[1]["overall_assessment"]["trust_level"])
+
+    def test_missing_published_package_caps_build_trust(self):
+        compared = {
+            "status": "compared",
+            "overall_assessment": {
+                "risk_level": "none",
+                "reproducible": False,
+                "confidence": 0.9,
+                "trust_level": "L3",
+            },
+        }
+
+        approved = build_level_assessment([compared])
+        verdict = build_level_assessment([compared, {"status": "missing_published"}])
+
+        self.assertEqual(approved["action"], "approve")
+        self.assertEqual(verdict["trust_level"], "L1")
+        self.assertEqual(verdict["action"], "review")
+
+    def test_published_package_url_prefers_repo_index_location(self):
+        class Index:
+            def get(self, key):
+                if key == ("zlib-devel", "1.2.13", "3.an23", "x86_64"):
+                    return {"href": "Packages/z/zlib-devel-1.2.13-3.an23.x86_64.rpm"}
+                return None
+
+        rpm = {"name": "zlib-devel", "version": "1.2.13", "release": "3.an23", "arch": "x86_64"}
+        missing = dict(rpm, name="zlib-static")
+        base = "https://mirrors.invalid/anolis/23/os/x86_64/os/Packages/"
+        summary = {"url": "https://mirrors.invalid/anolis/23/os/x86_64/os/"}
+
+        self.assertEqual(
+            published_package_url(Index(), summary, base, rpm),
+            "https://mirrors.invalid/anolis/23/os/x86_64/os/Packages/z/zlib-devel-1.2.13-3.an23.x86_64.rpm",
+        )
+        self.assertEqual(
+            published_package_url(Index(), summary, base, missing),
+            base + "zlib-static-1.2.13-3.an23.x86_64.rpm",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+import hashlib
+import http.server
+import json
+import re
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from guanfu.koji_rebuild import downloader
+from guanfu.koji_rebuild.artifact_store import ArtifactStore
+from guanfu.koji_rebuild.downloader import (
+    download_koji_file,
+    download_url,
+    koji_build_url,
+    persistent_sha256,
+    koji_task_output_url,
+    remember_sha256,
+    sha256_file,
+)
+from guanfu.koji_rebuild.rpm_header import sigmd5_file
+
+
+def _fake_rpm(body):
+    lead = b"\xed\xab\xee\xdb" + b"\0" * 92
+    signature = b"\x8e\xad\xe8\x01" + b"\0" * 4 + (0).to_bytes(4, "big") + (4).to_bytes(4, "big") + b"sig!"
+    padding = b"\0" * (-len(signature) % 8)
+    return lead + signature + padding + body
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    data = b""
+    fail_starts = set()
+    ranges = []
+    methods = []
+    etag = True
+    truncate = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _full_headers(self, extra=0):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.data) + extra))
+        self.send_header("Accept-Ranges", "bytes")
+        if self.etag:
+            self.send_header("ETag", '"%s"' % hashlib.md5(self.data).hexdigest())
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.methods.append("HEAD")
+        self._full_headers()
+
+    def do_GET(self):
+        etag = '"%s"' % hashlib.md5(self.data).hexdigest()
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if not match:
+            self.methods.append("GET")
+            self._full_headers(extra=self.truncate)
+            self.wfile.write(self.data)
+            return
+        start, end = int(match.group(1)), int(match.group(2))
+        self.ranges.append(start)
+        if start in self.fail_starts:
+            self.fail_starts.discard(start)
+            self.send_error(503)
+            return
+        body = self.data[start : end + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(self.data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DownloaderTests(unittest.TestCase):
+    def test_koji_urls_follow_topurl_layout(self):
+        self.assertEqual(
+            koji_task_output_url("https://koji.invalid/kojifiles/", 123456, "build.log"),
+            "https://koji.invalid/kojifiles/work/tasks/3456/123456/build.log",
+        )
+        self.assertEqual(
+            koji_build_url(
+                "https://koji.invalid/kojifiles",
+                {"name": "zlib", "version": "1.2.13", "release": "3.an23"},
+                "x86_64",
+                "zlib-1.2.13-3.an23.x86_64.rpm",
+            ),
+            "https://koji.invalid/kojifiles/packages/zlib/1.2.13/3.an23/x86_64/zlib-1.2.13-3.an23.x86_64.rpm",
+        )
+
+    def test_sigmd5_skips_lead_and_signature(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "pkg.rpm"
+            path.write_bytes(_fake_rpm(b"header-and-payload"))
+
+            self.assertEqual(sigmd5_file(path), hashlib.md5(b"header-and-payload").hexdigest())
+
+    def test_sha256_file_reuses_digest_until_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "result.rpm"
+            path.write_bytes(b"rebuilt rpm")
+            remember_sha256(path, "digest-from-download-stream")
+
+            cached = sha256_file(path)
+            path.write_bytes(b"rebuilt rpm, second run")
+            refreshed = sha256_file(path)
+
+        self.assertEqual(cached, "digest-from-download-stream")
+        self.assertEqual(refreshed, hashlib.sha256(b"rebuilt rpm, second run").hexdigest())
+
+    def test_persistent_sha256_survives_the_process_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "image.qcow2"
+            path.write_bytes(b"image")
+            first = persistent_sha256(path)
+            sidecar = json.loads(Path(str(path) + ".sha256").read_text())
+            sidecar["sha256"] = "recorded"
+            Path(str(path) + ".sha256").write_text(json.dumps(sidecar))
+            with patch.dict(downloader._DIGEST_CACHE, clear=True):
+                recorded = persistent_sha256(path)
+                path.write_bytes(b"image, rebuilt")
+                refreshed = persistent_sha256(path)
+
+        self.assertEqual(first, hashlib.sha256(b"image").hexdigest())
+        self.assertEqual(recorded, "recorded")
+        self.assertEqual(refreshed, hashlib.sha256(b"image, rebuilt").hexdigest())
+
+    def test_segmented_download_resumes_from_part_file(self):
+        data = bytes(range(256)) * 1000
+        _RangeHandler.data = data
+        _RangeHandler.fail_starts = {65536}
+        _RangeHandler.ranges = []
+        _RangeHandler.methods = []
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:%d/image.qcow2" % server.server_port
+        try:
+            with tempfile.TemporaryDirectory() as tmp, patch.multiple(
+                downloader, SEGMENTED_DOWNLOAD_THRESHOLD=1024, SEGMENT_SIZE=65536, SEGMENT_WORKERS=2
+            ):
+                dest = Path(tmp) / "vm-cache" / "image.qcow2"
+                with self.assertRaises(Exception):
+                    download_url(url, dest)
+                interrupted = dest.exists()
+                part_exists = Path(str(dest) + ".part").exists()
+
+                _RangeHandler.ranges = []
+                download_url(url, dest, expected_sha256=hashlib.sha256(data).hexdigest())
+                content = dest.read_bytes()
+                leftovers = sorted(path.name for path in dest.parent.iterdir())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertFalse(interrupted)
+        self.assertTrue(part_exists)
+        self.assertEqual(_RangeHandler.ranges, [65536])
+        self.assertEqual(_RangeHandler.methods, ["HEAD", "HEAD"])
+        self.assertEqual(content, data)
+        self.assertEqual(leftovers, ["image.qcow2"])
+
+    def test_download_without_validator_is_not_segmented_and_cleans_up(self):
+        data = bytes(range(256)) * 1000
+        _RangeHandler.data = data
+        _RangeHandler.ranges = []
+        _RangeHandler.methods = []
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:%d/image.qcow2" % server.server_port
+        try:
+            with tempfile.TemporaryDirectory() as tmp, patch.multiple(
+                downloader, SEGMENTED_DOWNLOAD_THRESHOLD=1024
+            ), patch.multiple(_RangeHandler, etag=False, truncate=10):
+                dest = Path(tmp) / "vm-cache" / "image.qcow2"
+                with self.assertRaises(Exception):
+                    download_url(url, dest)
+                leftovers = sorted(path.name for path in dest.parent.iterdir())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(_RangeHandler.ranges, [])
+        self.assertEqual(_RangeHandler.methods, ["HEAD", "GET"])
+        self.assertEqual(leftovers, [])
+
+    def test_download_koji_file_prefers_verified_http(self):
+        body = b"header-and-payload"
+
+        def fake_download(url, dest):
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(_fake_rpm(b"tampered" if "bad" in url else body))
+            return dest, None
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = Path(tmp) / "repo" / "pkg.rpm"
+            with patch("guanfu.koji_rebuild.downloader.try_download_url", side_effect=fake_download), patch(
+                "guanfu.koji_rebuild.downloader.download_task_output"
+            ) as xmlrpc_download:
+                path, transfer = download_koji_file(
+                    None,
+                    1,
+                    "pkg.rpm",
+                    dest,
+                    urls=["https://koji.invalid/bad/pkg.rpm", "https://koji.invalid/good/pkg.rpm"],
+                    expected_sigmd5=hashlib.md5(body).hexdigest(),
+                )
+
+        self.assertEqual(path, dest)
+        self.assertEqual(transfer["transport"], "http")
+        self.assertEqual(transfer["url"], "https://koji.invalid/good/pkg.rpm")
+        self.assertIn("sigmd5 mismatch", transfer["attempts"][0]["error"])
+        xmlrpc_download.assert_not_called()
+
+    def test_download_koji_file_falls_back_to_xmlrpc_when_unpublished(self):
+        def fake_task_output(_client, _task_id, _filename, dest):
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(b"log line\n")
+            return dest
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = Path(tmp) / "build.log"
+            with patch(
+                "guanfu.koji_rebuild.downloader.try_download_url",
+                return_value=(None, "HTTP 404: Not Found"),
+            ), patch("guanfu.koji_rebuild.downloader.download_task_output", side_effect=fake_task_output):
+                _, transfer = download_koji_file(
+                    None,
+                    1,
+                    "build.log",
+                    dest,
+                    urls=["https://koji.invalid/work/tasks/1/1/build.log"],
+                    expected_size=9,
+                )
+
+        self.assertEqual(transfer["transport"], "xmlrpc")
+        self.assertEqual(transfer["attempts"][0]["error"], "HTTP 404: Not Found")
+
+    def test_mismatched_download_is_not_stored_under_expected_digest(self):
+        _RangeHandler.data = b"tampered package"
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:%d/bash.rpm" % server.server_port
+        expected = hashlib.sha256(b"published package").hexdigest()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = ArtifactStore(Path(tmp) / "cache" / "artifacts")
+                dest = Path(tmp) / "repo" / "bash.rpm"
+                with self.assertRaises(RuntimeError):
+                    download_url(url, dest, store=store, store_key="sha256:" + expected, expected_sha256=expected)
+                stored = store.lookup("sha256:" + expected)
+                leftovers = sorted(path.name for path in dest.parent.iterdir())
+                store.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertIsNone(stored)
+        self.assertEqual(leftovers, [])
+
+if __name__ == "__main__":
+    unittest.main()
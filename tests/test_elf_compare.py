@@ -0,0 +1,90 @@
+import gzip
+import tempfile
+import unittest
+from pathlib import Path
+
+from rpm_fixtures import build_elf, build_rpm, cpio_payload, package_header
+
+from guanfu.koji_rebuild.compare import compare_published_and_rebuilt
+from guanfu.koji_rebuild.elf_compare import ElfMemberAnalyzer, compare_elf_sections, elf_sections
+
+
+def _library(build_id=b"\x01" * 20, code=b"\x90\xc3", debug=b"dwarf", load_flags=5):
+    # PT_LOAD with the given flags and a non-executable PT_GNU_STACK.
+    return build_elf(
+        [(".text", code), (".note.gnu.build-id", build_id), (".debug_info", debug)],
+        program_headers=[(1, load_flags), (0x6474E551, 6)],
+    )
+
+
+class ElfCompareTests(unittest.TestCase):
+    def _classify(self, published, rebuilt):
+        return compare_elf_sections(elf_sections(published), elf_sections(rebuilt))
+
+    def test_classifies_section_differences(self):
+        self.assertEqual(elf_sections(_library())[1][0], ".text")
+        self.assertEqual(self._classify(_library(), _library())["classification"], "identical")
+        buildid = self._classify(_library(), _library(build_id=b"\x02" * 20))
+        self.assertEqual(buildid["classification"], "buildid")
+        self.assertEqual(buildid["different_sections"], [".note.gnu.build-id"])
+        debug = self._classify(_library(), _library(build_id=b"\x02" * 20, debug=b"DWARF!"))
+        self.assertEqual(debug["classification"], "debug")
+        code = self._classify(_library(), _library(code=b"\x90\x90\xc3"))
+        self.assertEqual(code["classification"], "code")
+
+    def test_changes_outside_sections_are_code(self):
+        rebuilt = _library(build_id=b"\x02" * 20)
+        entry = bytearray(rebuilt)
+        entry[0x18] = 0x40
+        writable = _library(build_id=b"\x02" * 20, load_flags=7)
+        appended = rebuilt + b"\xcc" * 16
+
+        cases = ((entry, "<elf header>"), (writable, "<program headers>"), (appended, "<uncovered bytes>"))
+        for tampered, name in cases:
+            result = self._classify(_library(), bytes(tampered))
+            self.assertEqual(result["classification"], "code")
+            self.assertIn(name, result["different_sections"])
+        # Zero padding after the last section is not a change.
+        self.assertEqual(self._classify(_library(), _library() + b"\0" * 16)["classification"], "identical")
+
+    def test_analyzer_deletes_each_pair_once_analyzed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            members = []
+            for index in range(3):
+                pair = (Path(tmp) / ("%d.published" % index), Path(tmp) / ("%d.rebuilt" % index))
+                pair[0].write_bytes(_library())
+                pair[1].write_bytes(_library(code=b"\x90" * index + b"\xc3"))
+                members.append(("/usr/lib64/lib%d.so" % index, str(pair[0]), str(pair[1])))
+            analyzer = ElfMemberAnalyzer(workers=2)
+            for member in members:
+                analyzer.submit(member)
+            results = analyzer.close()
+            left = list(Path(tmp).iterdir())
+
+        self.assertEqual(left, [])
+        self.assertEqual(sorted(results), [member[0] for member in members])
+        self.assertEqual(results["/usr/lib64/lib1.so"]["classification"], "identical")
+        self.assertEqual(results["/usr/lib64/lib2.so"]["classification"], "code")
+
+    def test_buildid_only_library_reaches_l3(self):
+        path = "/usr/lib64/libz.so.1"
+        with tempfile.TemporaryDirectory() as tmp:
+            rpms = []
+            for directory, build_id in (("published", b"\x01" * 20), ("rebuilt", b"\x02" * 20)):
+                files = [(path, _library(build_id=build_id))]
+                header = package_header(files=files, PAYLOADFORMAT="cpio", PAYLOADCOMPRESSOR="gzip")
+                rpm = Path(tmp) / directory / "zlib-1.2.13-3.an23.x86_64.rpm"
+                rpm.parent.mkdir()
+                rpm.write_bytes(build_rpm(header, payload=gzip.compress(cpio_payload(files))))
+                rpms.append(rpm)
+
+            result = compare_published_and_rebuilt(rpms[0], [rpms[1]], rpms[1].name, elf_workers=1)
+
+        self.assertEqual([item["diff_type"] for item in result["diff_items"]], ["BINARY_BUILDID"])
+        self.assertEqual(result["overall_assessment"]["trust_level"], "L3")
+        self.assertEqual(result["analysis"]["elf_compare"][0]["path"], path)
+        self.assertEqual(result["analysis"]["unsupported_precise_types"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+import tempfile
+import threading
+import unittest
+import xmlrpc.client
+from pathlib import Path
+from types import SimpleNamespace
+
+from guanfu.koji_rebuild.client import KojiClient
+from guanfu.koji_rebuild.metadata_cache import KojiMetadataCache
+from guanfu.koji_rebuild.resolver import resolve_koji_build
+
+
+class FakeSession:
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.requests = []
+        self.system = SimpleNamespace(multicall=self._multicall)
+
+    def __getattr__(self, name):
+        if name not in self.handlers:
+            raise AttributeError(name)
+
+        def call(*params):
+            self.requests.append([name])
+            return self.handlers[name](*params)
+
+        return call
+
+    def _multicall(self, payload):
+        self.requests.append([item["methodName"] for item in payload])
+        results = []
+        for item in payload:
+            try:
+                results.append([self.handlers[item["methodName"]](*item["params"])])
+            except Exception as exc:
+                results.append({"faultCode": 1000, "faultString": str(exc)})
+        return results
+
+
+def _client(handlers, batch_size=100, cache=None):
+    client = KojiClient("https://koji.invalid/kojihub", multicall_batch_size=batch_size, cache=cache)
+    client.session = FakeSession(handlers)
+    return client
+
+
+class KojiClientTests(unittest.TestCase):
+    def test_each_thread_gets_its_own_server_proxy(self):
+        client = KojiClient("https://koji.invalid/kojihub")
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.session))
+        thread.start()
+        thread.join()
+
+        self.assertIs(client.session, client.session)
+        self.assertIsNot(client.session, sessions[0])
+
+    def test_multicall_splits_batches_and_keeps_order(self):
+        client = _client({"getBuild": lambda build_id, _strict: {"id": build_id}}, batch_size=2)
+
+        results = client.get_builds([1, 2, 3])
+
+        self.assertEqual([value["id"] for value, _ in results], [1, 2, 3])
+        self.assertEqual(client.session.requests, [["getBuild", "getBuild"], ["getBuild"]])
+
+    def test_multicall_reports_per_item_faults(self):
+        def get_build(build_id, _strict):
+            if build_id == 2:
+                raise ValueError("no such build")
+            return {"id": build_id}
+
+        client = _client({"getBuild": get_build})
+
+        results = client.get_builds([1, 2, 3])
+
+        self.assertEqual(results[0], ({"id": 1}, None))
+        self.assertIsNone(results[1][0])
+        self.assertIsInstance(results[1][1], xmlrpc.client.Fault)
+        self.assertEqual(results[2], ({"id": 3}, None))
+
+    def test_truncated_multicall_response_falls_back_to_plain_calls(self):
+        client = _client({"getBuild": lambda build_id, _strict: {"id": build_id}})
+        client.session.system.multicall = lambda payload: [[{"id": 1}]]
+
+        results = client.get_builds([1, 2, 3])
+
+        self.assertEqual([value["id"] for value, _ in results], [1, 2, 3])
+        self.assertEqual(client.session.requests, [["getBuild"], ["getBuild"]])
+
+    def test_oversized_multicall_response_is_rejected(self):
+        client = _client({})
+        client.session.system.multicall = lambda payload: [[{"id": 1}], [{"id": 2}]]
+
+        with self.assertRaisesRegex(RuntimeError, "2 results for 1 calls"):
+            client.get_builds([1])
+
+    def test_batch_size_one_uses_plain_calls(self):
+        client = _client({"listTaskOutput": lambda task_id, _stat: ["%s.log" % task_id]}, batch_size=1)
+
+        results = client.list_tasks_output([7, 8])
+
+        self.assertEqual(results, [(["7.log"], None), (["8.log"], None)])
+        self.assertEqual(client.session.requests, [["listTaskOutput"], ["listTaskOutput"]])
+
+    def test_resolve_koji_build_batches_task_results(self):
+        def get_task_result(task_id, _raise):
+            if task_id == 11:
+                raise RuntimeError("task failed")
+            return {"brootid": 5, "srpms": ["tasks/12/zlib-1.0-1.an23.src.rpm"]}
+
+        client = _client(
+            {
+                "getRPM": lambda _info, _strict, _multi: {"build_id": 3, "buildroot_id": 5},
+                "getBuild": lambda _build_id, _strict: {"task_id": 10},
+                "getBuildroot": lambda _buildroot_id, _strict: {"arch": "x86_64"},
+                "getTaskChildren": lambda _task_id: [
+                    {"id": 11, "method": "buildArch", "arch": "x86_64"},
+                    {"id": 12, "method": "buildArch", "arch": "x86_64"},
+                ],
+                "getTaskResult": get_task_result,
+                "listTaskOutput": lambda _task_id, _stat: {"zlib-1.0-1.an23.src.rpm": {}},
+            }
+        )
+
+        resolution = resolve_koji_build(client, "zlib-1.0-1.an23.x86_64")
+
+        self.assertEqual(resolution.buildarch_task["id"], 12)
+        self.assertEqual(resolution.task_srpm_name, "zlib-1.0-1.an23.src.rpm")
+        self.assertIn(["getTaskResult", "getTaskResult"], client.session.requests)
+        self.assertEqual(len(client.session.requests), 5)
+
+
+class KojiMetadataCacheTests(unittest.TestCase):
+    def test_completed_metadata_is_reused_across_clients(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "koji.sqlite3"
+            handlers = {
+                "getBuild": lambda build_id, _strict: {"id": build_id, "state": 1, "task_id": 9},
+                "listTaskOutput": lambda _task_id, _stat: {"build.log": {}},
+            }
+            first = _client(handlers, cache=KojiMetadataCache(path))
+            first.get_builds([1])
+            first.list_task_output(9)
+            first.cache.close()
+
+            second = _client(handlers, cache=KojiMetadataCache(path))
+            build = second.get_build(1)
+            outputs = second.list_tasks_output([9])
+            summary = second.cache_summary()
+            second.cache.close()
+
+        self.assertEqual(build["task_id"], 9)
+        self.assertEqual(outputs, [({"build.log": {}}, None)])
+        self.assertEqual(second.session.requests, [])
+        self.assertEqual(summary["hits"], 2)
+        self.assertEqual(summary["hit_rate"], 1.0)
+
+    def test_building_build_and_missing_rpm_expire(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = KojiMetadataCache(Path(tmp) / "koji.sqlite3", mutable_ttl=-1, negative_ttl=3600)
+            client = _client(
+                {
+                    "getBuild": lambda build_id, _strict: {"id": build_id, "state": 0},
+                    "getRPM": lambda _info, _strict, _multi: None,
+                },
+                cache=cache,
+            )
+            client.get_build(1)
+            client.get_build(1)
+            client.get_rpms_optional(["missing-1-1.an23.noarch"])
+            client.get_rpms_optional(["missing-1-1.an23.noarch"])
+            summary = client.cache_summary()
+            cache.close()
+
+        self.assertEqual(client.session.requests, [["getBuild"], ["getBuild"], ["getRPM"]])
+        self.assertEqual(summary["negative_hits"], 1)
+        self.assertEqual(summary["misses"], 3)
+
+    def test_none_from_other_methods_is_not_a_negative_entry(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = KojiMetadataCache(Path(tmp) / "koji.sqlite3", mutable_ttl=-1, negative_ttl=3600)
+            client = _client({"getTaskResult": lambda _task_id, _raise: None}, cache=cache)
+            client.get_task_result(9)
+            client.get_task_result(9)
+            summary = client.cache_summary()
+            cache.close()
+
+        self.assertEqual(client.session.requests, [["getTaskResult"], ["getTaskResult"]])
+        self.assertEqual(summary["negative_hits"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import gzip
+import lzma
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from rpm_fixtures import build_rpm, cpio_payload, package_header
+
+from guanfu.koji_rebuild.compare import compare_published_and_rebuilt
+from guanfu.koji_rebuild.payload import SPOOL_PREFIX_BYTES, compare_payloads
+from guanfu.koji_rebuild.rpm_header import read_package
+
+
+class PayloadCompareTests(unittest.TestCase):
+    def _write(self, tmp, name, files, compressor="gzip", stripped=False):
+        compress = {"gzip": gzip.compress, "xz": lzma.compress}[compressor]
+        header = package_header(files=files, PAYLOADFORMAT="cpio", PAYLOADCOMPRESSOR=compressor)
+        path = Path(tmp) / name
+        path.write_bytes(build_rpm(header, payload=compress(cpio_payload(files, stripped))))
+        return path
+
+    def test_reports_bounded_ranges_for_differing_members_only(self):
+        library = bytearray(b"\x7fELF" + bytes(8000))
+        published_files = [("/usr/lib64/libz.so.1", bytes(library)), ("/usr/share/doc/zlib/README", b"same")]
+        library[100] = 1
+        library[105] = 2
+        library[6000] = 3
+        rebuilt_files = [("/usr/lib64/libz.so.1", bytes(library)), ("/usr/share/doc/zlib/README", b"same")]
+        with tempfile.TemporaryDirectory() as tmp:
+            published = self._write(tmp, "published.rpm", published_files)
+            rebuilt = self._write(tmp, "rebuilt.rpm", rebuilt_files, compressor="xz", stripped=True)
+
+            result = compare_payloads(read_package(published), read_package(rebuilt))
+
+        self.assertEqual(result["compressors"], {"published": "gzip", "rebuilt": "xz"})
+        self.assertEqual(result["members"]["identical"], 1)
+        self.assertEqual(result["members"]["different"], 1)
+        diff = result["different_files"][0]
+        self.assertEqual(diff["path"], "/usr/lib64/libz.so.1")
+        self.assertEqual([(item["offset"], item["length"]) for item in diff["ranges"]], [(100, 6), (6000, 1)])
+        self.assertEqual(diff["ranges"][0]["rebuilt"][:2], "01")
+        self.assertFalse(diff["ranges_truncated"])
+
+    def test_spooled_elf_members_are_handed_over_one_at_a_time(self):
+        files = [("/usr/lib64/lib%d.so" % index, b"\x7fELF" + bytes([index]) * 64) for index in range(3)]
+        rebuilt_files = [(path, content[:-1] + b"\xff") for path, content in files]
+        handed = []
+        with tempfile.TemporaryDirectory() as tmp:
+            published = self._write(tmp, "published.rpm", files)
+            rebuilt = self._write(tmp, "rebuilt.rpm", rebuilt_files)
+            spool_dir = Path(tmp) / "spool"
+            spool_dir.mkdir()
+
+            def elf_member(member):
+                # Only the pair being handed over is on disk.
+                handed.append((member[0], sorted(str(path) for path in spool_dir.iterdir())))
+                for path in member[1:]:
+                    Path(path).unlink()
+
+            result = compare_payloads(
+                read_package(published), read_package(rebuilt), spool_dir=spool_dir, elf_member=elf_member
+            )
+
+        self.assertEqual([path for path, _ in handed], [path for path, _ in files])
+        self.assertTrue(all(len(spooled) == 2 for _, spooled in handed))
+        self.assertNotIn("_elf_members", result)
+
+    def _spool(self, files, rebuilt_files, prefix_bytes=None):
+        created = []
+        spooled = {}
+        real_mkstemp = tempfile.mkstemp
+
+        def mkstemp(*args, **kwargs):
+            created.append(kwargs.get("prefix"))
+            return real_mkstemp(*args, **kwargs)
+
+        def elf_member(member):
+            spooled[member[0]] = [Path(path).read_bytes() for path in member[1:]]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            published = self._write(tmp, "published.rpm", files)
+            rebuilt = self._write(tmp, "rebuilt.rpm", rebuilt_files)
+            with patch("guanfu.koji_rebuild.payload.tempfile.mkstemp", side_effect=mkstemp), patch(
+                "guanfu.koji_rebuild.payload.SPOOL_PREFIX_BYTES", prefix_bytes or SPOOL_PREFIX_BYTES
+            ):
+                compare_payloads(read_package(published), read_package(rebuilt), spool_dir=tmp, elf_member=elf_member)
+        return created, spooled
+
+    def test_identical_elf_members_are_never_spooled(self):
+        # Members span several read chunks, so the identical prefix is back-filled.
+        same = b"\x7fELF" + bytes(range(256)) * 8192
+        created, spooled = self._spool(
+            [("/usr/lib64/liba.so", same), ("/usr/lib64/libb.so", same + b"old")],
+            [("/usr/lib64/liba.so", same), ("/usr/lib64/libb.so", same + b"new")],
+        )
+
+        self.assertEqual(created, ["published-", "rebuilt-"])
+        self.assertEqual(spooled, {"/usr/lib64/libb.so": [same + b"old", same + b"new"]})
+
+    def test_long_identical_prefix_is_kept_on_disk_once(self):
+        same = b"\x7fELF" + bytes(range(256)) * 8192
+        created, spooled = self._spool(
+            [("/usr/lib64/libb.so", same + b"old")], [("/usr/lib64/libb.so", same + b"new")], prefix_bytes=1024
+        )
+
+        self.assertEqual(created, ["prefix-", "published-", "rebuilt-"])
+        self.assertEqual(spooled, {"/usr/lib64/libb.so": [same + b"old", same + b"new"]})
+
+    def test_failed_payload_compare_is_not_reported_as_supported(self):
+        files = [("/usr/lib64/libz.so.1", b"\x7fELF" + bytes(64))]
+        with tempfile.TemporaryDirectory() as tmp:
+            published = self._write(tmp, "published.rpm", files)
+            changed = [("/usr/lib64/libz.so.1", b"\x7fELF" + bytes(63) + b"\x01")]
+            header = package_header(files=changed, PAYLOADFORMAT="cpio", PAYLOADCOMPRESSOR="gzip")
+            rebuilt = Path(tmp) / "rebuilt" / "published.rpm"
+            rebuilt.parent.mkdir()
+            rebuilt.write_bytes(build_rpm(header, payload=b"not gzip"))
+
+            result = compare_published_and_rebuilt(published, [rebuilt], "published.rpm", elf_workers=1)
+
+        analysis = result["analysis"]
+        self.assertEqual(dict((tier["tier"], tier["outcome"]) for tier in analysis["tiers"])["content"], "error")
+        self.assertFalse(analysis["capabilities"]["payload_decompression_compare"])
+        self.assertFalse(analysis["capabilities"]["elf_section_compare"])
+        self.assertTrue(analysis["capabilities"]["rpm_file_manifest"])
+        self.assertEqual(analysis["unsupported_precise_types"], ["BINARY_BUILDID", "BINARY_CODE", "DEBUG_INFO"])
+
+    @unittest.skipUnless(shutil.which("zstd"), "zstd CLI not available")
+    def test_content_tier_uses_payload_compare(self):
+        import subprocess
+
+        with tempfile.TemporaryDirectory() as tmp:
+            published = self._write(tmp, "published.rpm", [("/usr/bin/zz", b"one"), ("/usr/bin/zz-old", b"x")])
+            files = [("/usr/bin/zz", b"two")]
+            compressed = subprocess.run(
+                ["zstd", "-c", "-q"], input=cpio_payload(files), stdout=subprocess.PIPE, check=True
+            ).stdout
+            rebuilt = Path(tmp) / "rebuilt" / "published.rpm"
+            rebuilt.parent.mkdir()
+            rebuilt.write_bytes(build_rpm(package_header(files=files, PAYLOADFORMAT="cpio"), payload=compressed))
+
+            result = compare_published_and_rebuilt(published, [rebuilt], "published.rpm")
+
+        tiers = dict((tier["tier"], tier["outcome"]) for tier in result["analysis"]["tiers"])
+        self.assertEqual(tiers["content"], "different")
+        payload = result["analysis"]["payload_compare"]
+        self.assertEqual(payload["only_in_published"], ["/usr/bin/zz-old"])
+        self.assertEqual(payload["different_files"][0]["ranges"][0]["published"], b"one".hex())
+        self.assertTrue(result["analysis"]["capabilities"]["payload_decompression_compare"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from guanfu.koji_rebuild.assessment import build_light_assessment
+from guanfu.koji_rebuild.policy import DEFAULT_POLICY, default_policy, load_policy
+
+
+def _changed(path, mode="0100644"):
+    published = {"digest": "aa", "mode": mode, "isdoc": "0", "isconfig": "0"}
+    return {"path": path, "changed_fields": ["digest"], "published": published, "rebuilt": dict(published, digest="bb")}
+
+
+def _assess(changed, policy=None):
+    file_analysis = {"only_in_published": [], "only_in_rebuilt": [], "changed": changed}
+    return build_light_assessment(False, None, {"status": "compared"}, file_analysis, True, True, True, policy=policy)
+
+
+class PolicyTests(unittest.TestCase):
+    def test_default_policy_categories(self):
+        policy = default_policy()
+
+        self.assertEqual(policy.categories("/etc/sudoers"), {"highly_sensitive", "config"})
+        self.assertEqual(policy.categories("/etc/cron.d/job"), {"sensitive", "config"})
+        self.assertEqual(policy.categories("/usr/lib64/libz.so.1"), {"library_dir", "library_file"})
+        self.assertEqual(policy.categories("/usr/lib/debug/.build-id/ab/cd.debug"), {"library_dir", "debug", "buildid"})
+        self.assertEqual(policy.categories("/usr/share/doc/zlib/README.gz"), {"doc", "compressed"})
+        self.assertEqual(policy.categories("/opt/tool"), set())
+
+    def test_site_policy_routes_content_changes(self):
+        site = json.loads(json.dumps(DEFAULT_POLICY))
+        site["name"] = "site"
+        site["categories"]["locale"] = {"globs": ["/usr/share/locale/*.mo"], "diff_type": "DOC_CONTENT"}
+        changed = [_changed("/usr/share/locale/de/LC_MESSAGES/zlib.mo")]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "policy.json"
+            path.write_text(json.dumps(site))
+            policy = load_policy(path)
+
+        default = _assess(changed)
+        custom = _assess(changed, policy)
+
+        self.assertEqual(default["diff_items"][0]["diff_type"], "OTHER")
+        self.assertEqual(default["overall_assessment"]["trust_level"], "L0")
+        self.assertEqual(custom["diff_items"][0]["diff_type"], "DOC_CONTENT")
+        self.assertEqual(custom["overall_assessment"]["trust_level"], "L2")
+        self.assertEqual(custom["analysis"]["policy"]["name"], "site")
+
+    def test_sensitive_paths_keep_their_risk(self):
+        result = _assess([_changed("/usr/bin/zz", mode="0100755"), _changed("/etc/sudoers")])
+
+        risks = dict((item["diff_type"], item["risk_level"]) for item in result["diff_items"])
+        self.assertEqual(risks["CONFIG_CONTENT"], "critical")
+        self.assertEqual(result["overall_assessment"]["trust_level"], "L0")
+
+    def test_rejects_unknown_rule_keys(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "policy.json"
+            path.write_text(json.dumps({"categories": {"doc": {"prefix": ["/usr/share/doc/"]}}}))
+            with self.assertRaises(ValueError):
+                load_policy(path)
+
+
+    def test_rejects_unknown_risk_and_diff_type(self):
+        rules = [{"prefixes": ["/opt/"], "risk": "severe"}, {"prefixes": ["/opt/"], "diff_type": "LOCALE"}]
+        for rule in rules:
+            with self.subTest(rule=rule), tempfile.TemporaryDirectory() as tmp:
+                path = Path(tmp) / "policy.json"
+                path.write_text(json.dumps({"categories": {"vendor": rule}}))
+                with self.assertRaises(ValueError) as raised:
+                    load_policy(path)
+
+            self.assertIn(str(path), str(raised.exception))
+            self.assertIn("vendor", str(raised.exception))
+
+if __name__ == "__main__":
+    unittest.main()
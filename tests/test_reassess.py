@@ -0,0 +1,81 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from rpm_fixtures import build_rpm, package_header
+
+from guanfu.cli import main
+from guanfu.koji_rebuild.assessment import ASSESSMENT_VERSION
+from guanfu.koji_rebuild.policy import default_policy
+from guanfu.koji_rebuild.reassess import assessment_fingerprint, find_run_dirs
+
+
+class ReassessTests(unittest.TestCase):
+    def _run_dir(self, root, name):
+        target = "zlib-1.2.13-3.an23.x86_64.rpm"
+        run_dir = root / "zlib" / name
+        (run_dir / "inputs").mkdir(parents=True)
+        (run_dir / "results" / "result-run-1").mkdir(parents=True)
+        (run_dir / "inputs" / target).write_bytes(
+            build_rpm(package_header(files=[("/usr/share/doc/zlib/README", b"a")]), {1004: b"\x01" * 16})
+        )
+        (run_dir / "results" / "result-run-1" / target).write_bytes(
+            build_rpm(package_header(files=[("/usr/share/doc/zlib/README", b"b")]), {1004: b"\x02" * 16})
+        )
+        report = {
+            "version": "0",
+            "metadata": {"package_name": target},
+            "overall_assessment": {"trust_level": "L0"},
+        }
+        (run_dir / "report.json").write_text(json.dumps(report))
+        return run_dir
+
+    def test_reassesses_stored_runs_and_skips_unchanged_ones(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            first = self._run_dir(root, ".")
+            second = self._run_dir(root, "run-20260101000000")
+            (root / "zlib" / "run-20260102000000").mkdir()
+            (root / "zlib" / "run-20260102000000" / "report.json").write_text(json.dumps({"metadata": {}}))
+
+            self.assertEqual(len(find_run_dirs([root])), 3)
+            self.assertEqual(main(["assess", "--workers", "1", str(root)]), 0)
+            report = json.loads((second / "report.json").read_text())
+            fingerprint = report["assessment_fingerprint"]
+            self.assertEqual(report["overall_assessment"]["trust_level"], "L2")
+            self.assertEqual(report["version"], ASSESSMENT_VERSION)
+            self.assertIn("DOC_CONTENT", [item["diff_type"] for item in report["diff_items"]])
+            self.assertTrue((first / "manifest-diff.jsonl").exists())
+
+            (second / "report.json").write_text(json.dumps(dict(report, overall_assessment={"trust_level": "stale"})))
+            self.assertEqual(main(["assess", "--workers", "1", str(second)]), 0)
+            self.assertEqual(json.loads((second / "report.json").read_text())["overall_assessment"]["trust_level"], "stale")
+
+            published = second / "inputs" / report["metadata"]["package_name"]
+            partial = assessment_fingerprint(second, [published], default_policy(), fingerprint)
+            self.assertEqual(list(partial["inputs"]), ["inputs/zlib-1.2.13-3.an23.x86_64.rpm"])
+            self.assertNotEqual(partial["sha256"], fingerprint["sha256"])
+
+    def test_reports_from_an_older_engine_are_reassessed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = self._run_dir(Path(tmp), "run-20260101000000")
+            with patch("guanfu.koji_rebuild.reassess.ASSESSMENT_VERSION", "1.0.0"), patch(
+                "guanfu.koji_rebuild.compare.ASSESSMENT_VERSION", "1.0.0"
+            ):
+                self.assertEqual(main(["assess", "--workers", "1", str(run_dir)]), 0)
+            old = json.loads((run_dir / "report.json").read_text())
+            self.assertEqual(old["version"], "1.0.0")
+            (run_dir / "report.json").write_text(json.dumps(dict(old, overall_assessment={"trust_level": "stale"})))
+
+            self.assertEqual(main(["assess", "--workers", "1", str(run_dir)]), 0)
+            report = json.loads((run_dir / "report.json").read_text())
+
+        self.assertEqual(report["version"], ASSESSMENT_VERSION)
+        self.assertEqual(report["overall_assessment"]["trust_level"], "L2")
+        self.assertNotEqual(report["assessment_fingerprint"]["sha256"], old["assessment_fingerprint"]["sha256"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,54 @@
+import bz2
+import gzip
+import hashlib
+import sqlite3
 import tempfile
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
+from guanfu.koji_rebuild import repo_fallback
 from guanfu.koji_rebuild.repo_fallback import (
+    _external_repo_metadata,
+    _find_external_package,
+    _find_task_output,
     _packages_from_install_command,
+    _prefetch_task_outputs,
     _replace_repo_arch,
     parse_installed_pkgs,
     rewrite_mock_config_for_local_repo,
     summarize_fallback_report,
 )
 
+PRIMARY_XML = (
+    '<?xml version="1.0"?>'
+    '<metadata xmlns="http://linux.duke.edu/metadata/common" packages="2">'
+    '<package type="rpm"><name>bash</name><arch>x86_64</arch>'
+    '<version epoch="0" ver="5.2" rel="1.fc36"/>'
+    '<location href="Packages/b/bash-5.2-1.fc36.x86_64.rpm"/></package>'
+    '<package type="rpm"><name>make</name><arch>x86_64</arch>'
+    '<version epoch="1" ver="4.3" rel="2.fc36"/>'
+    '<location href="Packages/m/make-4.3-2.fc36.x86_64.rpm"/></package>'
+    "</metadata>"
+)
+
+
+def _repomd(*entries):
+    data = "".join(
+        '<data type="%s"><checksum type="sha256">%s</checksum><location href="%s"/></data>'
+        % (data_type, sha256, href)
+        for data_type, href, sha256 in entries
+    )
+    return '<?xml version="1.0"?><repomd xmlns="http://linux.duke.edu/metadata/repo">%s</repomd>' % data
+
+
+class _ExternalRepoClient:
+    def __init__(self, remote):
+        self.remote = remote
+
+    def get_external_repo_list(self, _tag, _event=None):
+        return [{"external_repo_name": "fc36", "url": "file://%s/" % self.remote}]
+
 
 class RepoFallbackTests(unittest.TestCase):
     def test_parse_installed_pkgs_strips_epoch_for_lookup(self):
@@ -180,6 +219,153 @@ class RepoFallbackTests(unittest.TestCase):
         self.assertFalse(summary["bootstrap_toolchain"]["use_bootstrap"])
         self.assertTrue(summary["bootstrap_toolchain"]["original_use_bootstrap"])
 
+    def test_prefetch_task_outputs_batches_children_and_outputs(self):
+        class Client:
+            def __init__(self):
+                self.calls = []
+
+            def get_tasks_children(self, task_ids):
+                self.calls.append(("getTaskChildren", list(task_ids)))
+                return [([{"id": task_id * 10}, {"id": None}], None) for task_id in task_ids]
+
+            def list_tasks_output(self, task_ids):
+                self.calls.append(("listTaskOutput", list(task_ids)))
+                return [
+                    (None, RuntimeError("gone")) if task_id == 1 else (["out-%s.rpm" % task_id], None)
+                    for task_id in task_ids
+                ]
+
+        client = Client()
+        cache = {}
+
+        _prefetch_task_outputs(client, [1, 2, 1], cache)
+        found = _find_task_output(client, 2, "out-20.rpm", cache)
+
+        self.assertEqual(found, 20)
+        self.assertEqual(cache[1], [(10, ["out-10.rpm"])])
+        self.assertEqual(
+            client.calls,
+            [("getTaskChildren", [1, 2]), ("listTaskOutput", [1, 10, 2, 20])],
+        )
+
+    def test_external_repo_index_is_reused_by_primary_checksum(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            remote = tmp / "remote"
+            (remote / "repodata").mkdir(parents=True)
+            primary_bytes = gzip.compress(PRIMARY_XML.encode())
+            (remote / "repodata" / "primary.xml.gz").write_bytes(primary_bytes)
+            (remote / "repodata" / "repomd.xml").write_text(
+                _repomd(("primary", "repodata/primary.xml.gz", hashlib.sha256(primary_bytes).hexdigest()))
+            )
+            client = _ExternalRepoClient(remote)
+            buildroot = {"tag_name": "dist-an23-build", "arch": "x86_64", "repo_create_event_id": 7}
+
+            downloads = []
+
+            def fake_download(url, dest):
+                downloads.append(Path(url).name)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.write_bytes((remote / url[len("file://") + len(str(remote)) + 1 :]).read_bytes())
+                return dest
+
+            with patch.object(repo_fallback, "download_url", side_effect=fake_download), patch.object(
+                repo_fallback, "_parse_primary_packages", wraps=repo_fallback._parse_primary_packages
+            ) as parse:
+                first, first_indexes = _external_repo_metadata(client, buildroot, tmp / "run1", tmp / "index")
+                second, second_indexes = _external_repo_metadata(client, buildroot, tmp / "run2", tmp / "index")
+                found = [
+                    _find_external_package(second, {"rpm_lookup": lookup}, second_indexes)
+                    for lookup in ("make-4.3-2.fc36.x86_64", "gcc-12-1.fc36.x86_64")
+                ]
+
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(downloads, ["repomd.xml", "primary.xml.gz", "repomd.xml"])
+        self.assertFalse(first[0]["index"]["reused"])
+        self.assertTrue(second[0]["index"]["reused"])
+        self.assertEqual(found[0][1]["href"], "Packages/m/make-4.3-2.fc36.x86_64.rpm")
+        self.assertEqual(found[0][1]["epoch"], "1")
+        self.assertEqual(found[1], (None, None))
+
+    def test_external_repo_prefers_primary_db(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            remote = tmp / "remote"
+            (remote / "repodata").mkdir(parents=True)
+            db_path = tmp / "primary.sqlite"
+            db = sqlite3.connect(str(db_path))
+            db.execute(
+                "CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT, arch TEXT, "
+                "version TEXT, epoch TEXT, release TEXT, time_file INTEGER, time_build INTEGER, "
+                "size_package INTEGER, size_installed INTEGER, size_archive INTEGER, "
+                "location_href TEXT, checksum_type TEXT)"
+            )
+            db.execute(
+                "INSERT INTO packages VALUES (1, 'abc', 'bash', 'x86_64', '5.2', '0', '1.fc36', "
+                "1, 2, 3, 4, 5, 'Packages/b/bash-5.2-1.fc36.x86_64.rpm', 'sha256')"
+            )
+            db.commit()
+            db.close()
+            compressed = bz2.compress(db_path.read_bytes())
+            (remote / "repodata" / "primary.sqlite.bz2").write_bytes(compressed)
+            (remote / "repodata" / "repomd.xml").write_text(
+                _repomd(
+                    ("primary", "repodata/missing-primary.xml.gz", "0"),
+                    ("primary_db", "repodata/primary.sqlite.bz2", hashlib.sha256(compressed).hexdigest()),
+                )
+            )
+            client = _ExternalRepoClient(remote)
+            buildroot = {"tag_name": "dist-an23-build", "arch": "x86_64"}
+
+            def fake_download(url, dest):
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.write_bytes((remote / url[len("file://") + len(str(remote)) + 1 :]).read_bytes())
+                return dest
+
+            with patch.object(repo_fallback, "download_url", side_effect=fake_download):
+                repos, indexes = _external_repo_metadata(client, buildroot, tmp / "run", tmp / "index")
+                _, package = _find_external_package(repos, {"rpm_lookup": "bash-5.2-1.fc36.x86_64"}, indexes)
+
+        self.assertEqual(repos[0]["index"]["source"], "primary_db")
+        self.assertNotIn("primary", repos[0])
+        self.assertEqual(package["installed_size"], "4")
+        self.assertEqual(package["checksum"], {"type": "sha256", "value": "abc"})
+
+    def test_external_repo_checksum_uses_the_named_algorithm(self):
+        primary_bytes = gzip.compress(PRIMARY_XML.encode())
+        cases = [
+            ("sha512", hashlib.sha512(primary_bytes).hexdigest(), "ready"),
+            ("sha512", hashlib.sha512(b"other").hexdigest(), "error"),
+            ("crc32", "0", "error"),
+        ]
+        for checksum_type, value, status in cases:
+            with self.subTest(checksum_type=checksum_type, status=status), tempfile.TemporaryDirectory() as tmp:
+                tmp = Path(tmp)
+                remote = tmp / "remote"
+                (remote / "repodata").mkdir(parents=True)
+                (remote / "repodata" / "primary.xml.gz").write_bytes(primary_bytes)
+                (remote / "repodata" / "repomd.xml").write_text(
+                    '<?xml version="1.0"?><repomd xmlns="http://linux.duke.edu/metadata/repo">'
+                    '<data type="primary"><checksum type="%s">%s</checksum>'
+                    '<location href="repodata/primary.xml.gz"/></data></repomd>' % (checksum_type, value)
+                )
+                buildroot = {"tag_name": "dist-an23-build", "arch": "x86_64"}
+
+                def fake_download(url, dest, remote=remote):
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    dest.write_bytes((remote / url[len("file://") + len(str(remote)) + 1 :]).read_bytes())
+                    return dest
+
+                with patch.object(repo_fallback, "download_url", side_effect=fake_download):
+                    repos, indexes = _external_repo_metadata(
+                        _ExternalRepoClient(remote), buildroot, tmp / "run", tmp / "index"
+                    )
+
+                self.assertEqual(repos[0]["status"], status)
+                self.assertEqual(list((tmp / "index").glob("*.sqlite")) != [], status == "ready")
+                if indexes[0] is not None:
+                    indexes[0].close()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,155 @@
+import struct
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from rpm_fixtures import build_rpm, package_header
+
+from guanfu.koji_rebuild.compare import _diff_files, _rpm_command_lines, _rpm_query
+from guanfu.koji_rebuild.manifest import record_from_file
+from guanfu.koji_rebuild.rpm_header import TYPE_INT16, format_dump_line, format_pgpsig, read_package, sigmd5_file
+
+
+def _v4_signature(created, keyid):
+    hashed = bytes([5, 2]) + struct.pack(">I", created)
+    unhashed = bytes([9, 16]) + keyid
+    body = (
+        bytes([4, 0, 1, 8])
+        + struct.pack(">H", len(hashed))
+        + hashed
+        + struct.pack(">H", len(unhashed))
+        + unhashed
+        + b"\0\0"
+    )
+    return bytes([0x89]) + struct.pack(">H", len(body)) + body
+
+
+class RpmHeaderTests(unittest.TestCase):
+    def _write(self, tmp, name, header, signature=None):
+        path = Path(tmp) / name
+        path.write_bytes(build_rpm(header, signature, payload=b"payload"))
+        return path
+
+    def test_reads_tags_dependencies_scriptlets_and_files(self):
+        header = package_header(
+            files=[("/usr/lib64/libz.so.1", b"elf"), ("/usr/share/doc/zlib/README", b"readme")],
+            REQUIRENAME=["/bin/sh", "libc.so.6()(64bit)", "rpmlib(CompressedFileNames)"],
+            REQUIREFLAGS=[0, 0, 2 | 8 | (1 << 24)],
+            REQUIREVERSION=["", "", "3.0.4-1"],
+            POSTIN="/sbin/ldconfig",
+            POSTINPROG=["/sbin/ldconfig"],
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self._write(tmp, "zlib.rpm", header, {1004: bytes(range(16)), 1000: 4096})
+            package = read_package(path)
+            sigmd5 = sigmd5_file(path)
+
+            self.assertEqual(package.nevra(), "zlib-1.2.13-3.an23.x86_64")
+            self.assertEqual(package.format_tag("SIGMD5"), bytes(range(16)).hex())
+            self.assertEqual(package.format_tag("SIGSIZE"), "4096")
+            self.assertEqual(package.format_tag("PAYLOADDIGEST"), "(none)")
+            self.assertEqual(
+                package.dependencies("requires"),
+                ["/bin/sh", "libc.so.6()(64bit)", "rpmlib(CompressedFileNames) <= 3.0.4-1"],
+            )
+            self.assertEqual(
+                package.scriptlets(),
+                [{"name": "postinstall", "program": "/sbin/ldconfig", "script": "/sbin/ldconfig"}],
+            )
+            files = package.files()
+            self.assertEqual([item["path"] for item in files], ["/usr/lib64/libz.so.1", "/usr/share/doc/zlib/README"])
+            self.assertEqual(files[1]["size"], 6)
+            self.assertEqual(package.payload_offset, path.stat().st_size - len(b"payload"))
+            self.assertEqual(len(sigmd5), 32)
+
+    def test_scripts_match_rpm_query_format(self):
+        header = package_header(
+            POSTIN="/sbin/ldconfig",
+            POSTINPROG=["/bin/sh"],
+            PREUN="echo bye",
+            POSTUNPROG=["/sbin/ldconfig"],
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            lines = _rpm_command_lines(self._write(tmp, "zlib.rpm", header), "--scripts")
+
+        self.assertEqual(
+            lines,
+            sorted(
+                [
+                    "postinstall scriptlet (using /bin/sh):",
+                    "/sbin/ldconfig",
+                    "preuninstall scriptlet:",
+                    "echo bye",
+                    "postuninstall program: /sbin/ldconfig",
+                ]
+            ),
+        )
+
+    def test_dump_lines_match_rpm_for_directories_and_devices(self):
+        # Expected lines are `rpm -qp --dump` output for the same header.
+        header = package_header(
+            files=[("/usr/share/zlib", b""), ("/dev/zz", b"")],
+            FILESIZES=[4096, 0],
+            FILEMODES=(TYPE_INT16, [0o40755, 0o20660]),
+            FILEDIGESTS=["", ""],
+            FILERDEVS=(TYPE_INT16, [0, 0x0103]),
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            files = read_package(self._write(tmp, "zlib.rpm", header)).files()
+
+        zeros = "0" * 64
+        expected = [
+            "/usr/share/zlib 4096 1700000000 %s 040755 root root 0 0 0 X" % zeros,
+            "/dev/zz 0 1700000000 %s 020660 root root 0 0 259 X" % zeros,
+        ]
+        self.assertEqual([format_dump_line(item) for item in files], expected)
+        self.assertEqual(
+            [" ".join([record.path] + list(record.brief().values())) for record in map(record_from_file, files)],
+            expected,
+        )
+
+    def test_formats_v4_pgp_signature_like_rpm(self):
+        created = 1700000000
+        formatted = format_pgpsig(_v4_signature(created, bytes.fromhex("0123456789abcdef")))
+
+        self.assertEqual(
+            formatted,
+            "RSA/SHA256, %s, Key ID 0123456789abcdef" % time.strftime("%c", time.localtime(created)),
+        )
+
+    def test_compare_queries_do_not_spawn_rpm(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            published = self._write(tmp, "published.rpm", package_header(files=[("/usr/bin/zz", b"one")]))
+            rebuilt = self._write(
+                tmp,
+                "rebuilt.rpm",
+                package_header(files=[("/usr/bin/zz", b"two")], BUILDHOST="rebuild-vm"),
+            )
+            with patch("subprocess.run", side_effect=AssertionError("rpm CLI should not run")):
+                headers = _rpm_query(published)
+                requires = _rpm_command_lines(published, "--requires")
+                files_diff, _ = _diff_files(published, rebuilt)
+
+        self.assertEqual(headers["NVRA"], "zlib-1.2.13-3.an23.x86_64")
+        self.assertEqual(headers["RSAHEADER"], "(none)")
+        self.assertEqual(requires, [])
+        self.assertEqual(files_diff["changed"]["items"][0]["changed_fields"], ["digest"])
+
+    def test_compare_falls_back_to_rpm_cli_for_unreadable_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "broken.rpm"
+            path.write_bytes(b"not an rpm")
+            with patch(
+                "guanfu.koji_rebuild.compare._run_text",
+                return_value=("NVRA=zlib-1.2.13-3.an23.x86_64\n", None),
+            ) as run_text:
+                headers = _rpm_query(path)
+
+        self.assertEqual(headers, {"NVRA": "zlib-1.2.13-3.an23.x86_64"})
+        self.assertEqual(run_text.call_args[0][0][:3], ["rpm", "-qp", "--qf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,8 @@
+import shutil
+import subprocess
 import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
 from types import SimpleNamespace
@@ -6,10 +10,21 @@ from unittest.mock import patch
 
 from guanfu.koji_rebuild.vm_executor import (
     DEFAULT_AN23_VM_IMAGE_URL,
+    _build_job_disks,
+    _build_seed_disk,
+    _preflight_vm_host_dependencies,
+    _prepare_golden_image,
+    _read_results_disk,
     _select_acceleration,
+    _select_seed_binaries,
+    _select_share_mode,
+    _virtiofs_socket_path,
+    _vm_rebuild_script,
     build_qemu_command,
     detect_target_os,
+    golden_image_key,
     parse_koji_recorded_environment,
+    parse_vm_share_benchmark,
     prepare_vm_image,
     prepare_vm_mock_config,
     run_vm_rebuild,
@@ -101,6 +116,183 @@ class VmExecutorTests(unittest.TestCase):
         self.assertNotIn("-virtfs", command)
         self.assertIn("-drive", command)
 
+    def test_build_qemu_command_attaches_job_and_results_disks(self):
+        args = SimpleNamespace(vm_image="/tmp/an23.qcow2", vm_image_format="qcow2")
+        command = build_qemu_command(
+            args,
+            qemu_binary="/usr/bin/qemu-system-x86_64",
+            profile={"qemu_cpu": "Cascadelake-Server-v1"},
+            acceleration="kvm",
+            shared_dir=Path("/tmp/run"),
+            share_mode="job-disk",
+        )
+        drives = [command[index + 1] for index, item in enumerate(command) if item == "-drive"]
+
+        self.assertNotIn("-virtfs", command)
+        self.assertEqual(drives[1], "file=/tmp/run/metadata/vm-seed.img,if=virtio,format=raw,readonly=on")
+        self.assertEqual(drives[2], "file=/tmp/run/metadata/vm-job.img,if=virtio,format=raw,readonly=on")
+        self.assertEqual(drives[3], "file=/tmp/run/metadata/vm-results.img,if=virtio,format=raw")
+
+    def test_build_qemu_command_shares_run_dir_over_virtiofs(self):
+        args = SimpleNamespace(vm_image="/tmp/an23.qcow2", vm_image_format="qcow2", vm_memory="2048M")
+        command = build_qemu_command(
+            args,
+            qemu_binary="/usr/bin/qemu-system-x86_64",
+            profile={"qemu_cpu": "Cascadelake-Server-v1"},
+            acceleration="kvm",
+            shared_dir=Path("/tmp/run"),
+            share_mode="virtiofs",
+        )
+
+        self.assertNotIn("-virtfs", command)
+        self.assertEqual(command[command.index("-m") + 1], "2048M")
+        self.assertIn("memory-backend-memfd,id=guanfu_mem,size=2048M,share=on", command)
+        self.assertIn("node,memdev=guanfu_mem", command)
+        self.assertIn("socket,id=guanfu_virtiofs,path=%s" % _virtiofs_socket_path("/tmp/run"), command)
+        self.assertIn("vhost-user-fs-pci,chardev=guanfu_virtiofs,tag=guanfu_work", command)
+        self.assertLess(len(str(_virtiofs_socket_path("/tmp/" + "x" * 200))), 108)
+
+    def test_auto_share_mode_prefers_virtiofs_then_9p(self):
+        args = SimpleNamespace(vm_share_mode="auto", vm_virtiofsd_binary="/bin/echo")
+        devices = "name \"vhost-user-fs-pci\"\nname \"virtio-9p-pci\"\n"
+        with patch("guanfu.koji_rebuild.vm_executor._qemu_devices", return_value=devices), patch.dict(
+            "guanfu.koji_rebuild.vm_executor._VIRTIOFSD_PROBES", {"/bin/echo": True}
+        ):
+            self.assertEqual(_select_share_mode(args, "qemu"), "virtiofs")
+        # /bin/echo exits without creating the socket, like a virtiofsd that cannot run here.
+        with patch("guanfu.koji_rebuild.vm_executor._qemu_devices", return_value=devices), patch.dict(
+            "guanfu.koji_rebuild.vm_executor._VIRTIOFSD_PROBES", clear=True
+        ):
+            self.assertEqual(_select_share_mode(args, "qemu"), "9p")
+        with patch("guanfu.koji_rebuild.vm_executor._qemu_devices", return_value='name "virtio-9p-pci"\n'):
+            self.assertEqual(_select_share_mode(args, "qemu"), "9p")
+        with patch("guanfu.koji_rebuild.vm_executor._qemu_devices", return_value=""):
+            self.assertEqual(_select_share_mode(args, "qemu"), "image-copy")
+
+    def test_guest_script_mounts_virtiofs_and_reports_share_benchmark(self):
+        script = _vm_rebuild_script(
+            "/mnt/guanfu-work", "/mnt/guanfu-work/inputs/mock-vm.cfg", "/mnt/guanfu-work/inputs/pkg.src.rpm",
+            "/mnt/guanfu-work/results", 1, "simple", share_mode="virtiofs", share_benchmark=True,
+        )
+        default_script = _vm_rebuild_script(
+            "/mnt/guanfu-work", "/mnt/guanfu-work/inputs/mock-vm.cfg", "/mnt/guanfu-work/inputs/pkg.src.rpm",
+            "/mnt/guanfu-work/results", 1, "simple", share_mode="virtiofs",
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            log = Path(tmp) / "vm-rebuild.log"
+            log.write_text("VM_BATCH_START now\nVM_SHARE_BENCH files=12 bytes=4096 seconds=0.250\n")
+
+            benchmark = parse_vm_share_benchmark(log)
+
+        self.assertIn('mount -t virtiofs "guanfu_work" "/mnt/guanfu-work"', script)
+        self.assertIn("VM_SHARE_BENCH", script)
+        self.assertNotIn("VM_SHARE_BENCH", default_script)
+        self.assertEqual(benchmark, {"files": 12, "bytes": 4096, "seconds": 0.25})
+
+    @unittest.skipUnless(shutil.which("mke2fs") and shutil.which("debugfs"), "e2fsprogs is not installed")
+    def test_job_disk_refuses_direct_init_boot(self):
+        args = SimpleNamespace(
+            vm_image="/tmp/an23.raw", vm_image_format="raw", vm_kernel="/tmp/vmlinuz", vm_initrd="/tmp/initrd.img"
+        )
+
+        with self.assertRaisesRegex(RuntimeError, "job-disk cannot boot"):
+            _preflight_vm_host_dependencies(args, {}, "/usr/bin/qemu-system-x86_64", share_mode="job-disk")
+        _preflight_vm_host_dependencies(args, {}, "/usr/bin/qemu-system-x86_64", share_mode="9p")
+
+    def test_job_disks_round_trip_inputs_and_results_without_root(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = Path(tmp).resolve()
+            (run_dir / "inputs").mkdir()
+            (run_dir / "inputs" / "pkg.src.rpm").write_bytes(b"srpm")
+            (run_dir / "fallback-repo" / "repodata").mkdir(parents=True)
+            (run_dir / "fallback-repo" / "repodata" / "repomd.xml").write_text("<repomd/>")
+            (run_dir / "metadata").mkdir()
+            (run_dir / "results").mkdir()
+
+            with patch("guanfu.koji_rebuild.vm_executor._build_seed_disk", return_value="iso9660"):
+                transfer = _build_job_disks(run_dir, "#!/bin/bash\necho rebuild\n")
+            job_disk = Path(transfer["job_disk"])
+            listing = subprocess.run(
+                ["debugfs", "-R", "ls -p /", str(job_disk)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                text=True,
+            ).stdout
+            for name in ("inputs", "fallback-repo", "guanfu-vm-rebuild.sh"):
+                self.assertIn("/%s/" % name, listing)
+            self.assertNotIn("/user-data/", listing)
+
+            # Stand in for the guest writing to the results disk.
+            built = run_dir / "built.rpm"
+            built.write_bytes(b"rpm")
+            (run_dir / "exit").write_text("0")
+            commands = run_dir / "guest.cmds"
+            commands.write_text(
+                "mkdir results\nmkdir results/result-run-1\nmkdir metadata\n"
+                "write %s results/result-run-1/pkg.x86_64.rpm\n"
+                "write %s results/result-run-1/mock.exit\n"
+                "write %s metadata/vm-rebuild.log\n" % (built, run_dir / "exit", run_dir / "exit")
+            )
+            subprocess.run(
+                ["debugfs", "-w", "-f", str(commands), transfer["results_disk"]],
+                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+
+            copy_out = _read_results_disk(run_dir)
+
+            self.assertEqual((run_dir / "results" / "result-run-1" / "pkg.x86_64.rpm").read_bytes(), b"rpm")
+            self.assertEqual((run_dir / "metadata" / "vm-rebuild.log").read_text(), "0")
+            self.assertFalse(job_disk.exists())
+            self.assertFalse(Path(transfer["results_disk"]).exists())
+            self.assertEqual(sorted(path.name for path in (run_dir / "metadata").iterdir()), ["vm-rebuild.log"])
+        self.assertEqual(copy_out["paths"], ["results", "metadata"])
+
+    @unittest.skipUnless(
+        any(shutil.which(name) for name in ("genisoimage", "xorriso", "mkisofs"))
+        or (shutil.which("mkfs.vfat") and shutil.which("mcopy")),
+        "no iso9660 or vfat tools are installed",
+    )
+    def test_seed_disk_is_a_cidata_filesystem_cloud_init_accepts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            seed_disk = Path(tmp) / "vm-seed.img"
+            seed_format = _build_seed_disk(seed_disk)
+            data = seed_disk.read_bytes()
+
+        self.assertEqual(seed_format, _select_seed_binaries()[0])
+        if seed_format == "iso9660":
+            # Primary volume descriptor at sector 16.
+            self.assertEqual(data[0x8001:0x8006], b"CD001")
+            self.assertEqual(data[0x8028:0x8048].strip().lower(), b"cidata")
+        else:
+            self.assertEqual(data[0x36:0x39], b"FAT")
+            self.assertEqual(data[0x2B:0x36].strip(), b"CIDATA")
+
+    def test_seed_disk_is_never_ext4(self):
+        tools = {"xorriso": "/usr/bin/xorriso"}
+        commands = []
+
+        def build(seed_disk):
+            with patch(
+                "guanfu.koji_rebuild.vm_executor.shutil.which", side_effect=lambda name, path=None: tools.get(name)
+            ), patch(
+                "guanfu.koji_rebuild.vm_executor.subprocess.run", side_effect=lambda cmd, **kwargs: commands.append(cmd)
+            ):
+                return _build_seed_disk(seed_disk)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            iso_format = build(Path(tmp) / "vm-seed.img")
+            tools = {"mkfs.vfat": "/usr/sbin/mkfs.vfat", "mcopy": "/usr/bin/mcopy"}
+            vfat_format = build(Path(tmp) / "vm-seed.img")
+            tools = {"mke2fs": "/usr/sbin/mke2fs"}
+            with self.assertRaises(RuntimeError):
+                build(Path(tmp) / "vm-seed.img")
+
+        self.assertEqual((iso_format, vfat_format), ("iso9660", "vfat"))
+        self.assertEqual(commands[0][:3], ["/usr/bin/xorriso", "-as", "mkisofs"])
+        self.assertEqual(commands[0][commands[0].index("-volid") + 1], "cidata")
+        self.assertEqual([Path(path).name for path in commands[0][-2:]], ["user-data", "meta-data"])
+        self.assertEqual(commands[1], ["/usr/sbin/mkfs.vfat", "-n", "CIDATA", str(Path(tmp) / "vm-seed.img")])
+        self.assertEqual(commands[2][:4], ["/usr/bin/mcopy", "-o", "-i", str(Path(tmp) / "vm-seed.img")])
+        self.assertEqual(len(commands), 3)
+
     def test_prepare_vm_image_downloads_default_qcow2_to_cache_and_creates_overlay(self):
         with tempfile.TemporaryDirectory() as tmp:
             run_dir = Path(tmp).resolve() / "pkg"
@@ -110,9 +302,10 @@ class VmExecutorTests(unittest.TestCase):
                 vm_image=None,
                 vm_image_format="auto",
                 vm_qemu_img_binary="/bin/echo",
+                vm_golden_image="none",
             )
 
-            def fake_download(_url, dest):
+            def fake_download(_url, dest, expected_sha256=None):
                 dest.parent.mkdir(parents=True)
                 dest.write_bytes(b"qcow2")
                 return dest
@@ -134,6 +327,87 @@ class VmExecutorTests(unittest.TestCase):
         self.assertTrue(image["path"].endswith("vm-overlay.qcow2"))
         run.assert_called_once()
 
+    def test_prepare_vm_image_builds_golden_image_once_and_backs_overlays_with_it(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp) / "base.qcow2"
+            base.write_bytes(b"qcow2")
+            args = SimpleNamespace(
+                vm_image=str(base),
+                vm_image_format="auto",
+                vm_qemu_img_binary="/bin/echo",
+                vm_virt_customize_binary="/bin/echo",
+                vm_prepare_packages="rpm-build,mock",
+            )
+            profile = {"name": "an23-koji-cascadelake"}
+
+            def fake_run(command, **_kwargs):
+                if command[1] == "convert":
+                    Path(command[-1]).write_bytes(b"golden")
+                return SimpleNamespace(returncode=0)
+
+            images = []
+            with patch("subprocess.run", side_effect=fake_run) as run:
+                for name in ("first", "second"):
+                    run_dir = Path(tmp) / "pkg" / name
+                    (run_dir / "metadata").mkdir(parents=True)
+                    images.append(prepare_vm_image(args, run_dir, profile))
+            commands = [call.args[0] for call in run.call_args_list]
+            golden = Path(images[0]["golden"]["path"])
+
+            self.assertTrue(golden.exists())
+            self.assertEqual(golden.stat().st_mode & 0o777, 0o444)
+            self.assertEqual(
+                sorted(path.name for path in golden.parent.iterdir()), [".%s.lock" % golden.name, golden.name]
+            )
+
+        self.assertEqual(images[0]["golden"]["status"], "built")
+        self.assertEqual(images[1]["golden"]["status"], "reused")
+        self.assertEqual(images[0]["golden"]["packages"], ["mock", "rpm-build"])
+        self.assertEqual(golden.parent, Path(tmp) / "pkg" / "vm-cache" / "golden")
+        self.assertEqual([command[1] for command in commands], ["convert", "-a", "create", "create"])
+        self.assertIn("dnf -y install rpm-build mock", commands[1][-1])
+        self.assertEqual(commands[2][commands[2].index("-b") + 1], str(golden))
+        self.assertEqual(commands[3][commands[3].index("-b") + 1], str(golden))
+        self.assertEqual(
+            golden_image_key("abc", "mock rpm-build", profile),
+            golden_image_key("abc", "rpm-build,mock", profile),
+        )
+        self.assertNotEqual(
+            golden_image_key("abc", "mock", profile),
+            golden_image_key("abc", "mock", {"name": "other"}),
+        )
+
+    def test_concurrent_runs_build_one_golden_image(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            args = SimpleNamespace(vm_prepare_packages="mock", vm_virt_customize_binary="/bin/echo")
+            source = {"sha256": "b" * 64}
+            converted = []
+
+            def fake_run(command, **_kwargs):
+                if command[1] == "convert":
+                    converted.append(command[-1])
+                    time.sleep(0.2)
+                    Path(command[-1]).write_bytes(b"golden")
+                return SimpleNamespace(returncode=0)
+
+            results = []
+            with patch("subprocess.run", side_effect=fake_run):
+                threads = [
+                    threading.Thread(
+                        target=lambda: results.append(
+                            _prepare_golden_image(args, tmp, {"name": "an23"}, "base.qcow2", source, "qemu-img")
+                        )
+                    )
+                    for _ in range(2)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+        self.assertEqual(len(converted), 1)
+        self.assertEqual(sorted(result["status"] for result in results), ["built", "reused"])
+
     def test_vm_summary_marks_partial_cpu_match_and_degraded_tcg(self):
         summary = vm_executor_summary(
             profile={
@@ -234,6 +508,78 @@ class VmExecutorTests(unittest.TestCase):
         self.assertEqual(result["executor"]["actual_vm"]["kernel"], "5.10")
         self.assertEqual(result["rebuilds"][0]["rpms"][0]["file"], "pkg.x86_64.rpm")
 
+    def test_run_vm_rebuild_records_phase_timeline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = Path(tmp).resolve()
+            inputs = run_dir / "inputs"
+            results = run_dir / "results"
+            inputs.mkdir()
+            (run_dir / "metadata").mkdir()
+            mock_cfg = inputs / "mock.cfg"
+            srpm = inputs / "pkg.src.rpm"
+            mock_cfg.write_text("config_opts['root'] = 'pkg'\n")
+            srpm.write_text("srpm")
+            image = run_dir / "vm.raw"
+            kernel = run_dir / "vmlinuz"
+            initrd = run_dir / "initrd.img"
+            for path in (image, kernel, initrd):
+                path.write_text("x")
+            args = SimpleNamespace(
+                vm_image=str(image),
+                vm_image_format="raw",
+                vm_kernel=str(kernel),
+                vm_initrd=str(initrd),
+                vm_qemu_binary=str(kernel),
+                vm_timeout=60,
+                vm_workdir="/mnt/guanfu-work",
+                vm_share_mode="9p",
+                runs=1,
+                isolation="simple",
+            )
+
+            def fake_run(_command, timeout=None):
+                resultdir = results / "result-run-1"
+                resultdir.mkdir(parents=True)
+                (resultdir / "mock.exit").write_text("0")
+                (resultdir / "state.log").write_text(
+                    "2026-01-01 08:00:00,000 - Start(bootstrap): chroot init\n"
+                    "2026-01-01 08:00:05,000 - Finish(bootstrap): chroot init\n"
+                    "2026-01-01 08:00:05,000 - Start: chroot init\n"
+                    "2026-01-01 08:00:30,500 - Finish: chroot init\n"
+                    "2026-01-01 08:00:31,000 - Start: rpmbuild pkg.src.rpm\n"
+                    "2026-01-01 08:02:31,000 - Finish: rpmbuild pkg.src.rpm\n"
+                )
+                now = time.time()
+                (run_dir / "metadata" / "vm-rebuild.log").write_text(
+                    "VM_TIME %.3f script_start\n"
+                    "VM_TIME %.3f batch_start\n"
+                    "VM_TIME %.3f mock_ready\n"
+                    "VM_TIME %.3f run_start 1\n"
+                    "VM_TIME %.3f run_end 1\n"
+                    "VM_TIME %.3f batch_end\n" % (now, now + 2, now + 3, now + 4, now + 160, now + 161)
+                )
+                return SimpleNamespace(returncode=0)
+
+            with patch("guanfu.koji_rebuild.vm_executor._inject_vm_script_raw"), patch(
+                "subprocess.run", side_effect=fake_run
+            ):
+                result = run_vm_rebuild(args, run_dir, mock_cfg, srpm, results, "an23")
+
+        phases = dict(
+            ((item["phase"], item.get("run")), item) for item in result["executor"]["timeline"]["phases"]
+        )
+        self.assertIn(("preflight", None), phases)
+        self.assertIn(("qemu", None), phases)
+        self.assertAlmostEqual(phases[("mock_install", None)]["seconds"], 1, places=2)
+        self.assertAlmostEqual(phases[("run", 1)]["seconds"], 156, places=2)
+        self.assertEqual(phases[("bootstrap_mock_root_init", 1)]["seconds"], 5)
+        self.assertEqual(phases[("mock_root_init", 1)]["seconds"], 25.5)
+        self.assertEqual(phases[("rpmbuild", 1)]["seconds"], 120)
+        self.assertAlmostEqual(phases[("results", 1)]["seconds"], 5, places=2)
+        self.assertEqual(phases[("rpmbuild", 1)]["source"], "mock")
+        self.assertEqual(result["rebuilds"][0]["elapsed_seconds"], 156)
+        self.assertEqual(result["rebuilds"][0]["stages"][-1]["stage"], "rpmbuild")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,194 @@
+import socket
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from guanfu.koji_rebuild.vm_executor import _vm_agent_script, build_qemu_command
+from guanfu.koji_rebuild.vm_pool import PoolGuest, VmPool
+
+
+def fake_agent(sock, exit_codes, batch=1):
+    # Answers jobs once `batch` of them are in flight, newest first.
+    reader = sock.makefile("r")
+    pending = []
+    for line in reader:
+        parts = line.split()
+        if parts[0] != "JOB":
+            break
+        pending.append(parts)
+        if len(pending) < batch:
+            continue
+        for job in reversed(pending):
+            rc = exit_codes.pop(0)
+            sock.sendall(
+                (
+                    "JOB_MARK {id} VM_REBUILD_PKG_RUN_START 1 now\n"
+                    "JOB_MARK {id} VM_REBUILD_PKG_RUN_EXIT 1 {rc} now\n"
+                    "JOB_DONE {id} {rc}\n".format(id=job[1], rc=rc)
+                ).encode()
+            )
+        pending = []
+    sock.close()
+
+
+class VmPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.workdir = Path(self.tmp.name).resolve()
+        self.args = SimpleNamespace(workdir=str(self.workdir), vm_workdir="/mnt/guanfu-work", vm_timeout=5)
+        self.exit_codes = []
+        self.booted = []
+        self.batch = 1
+
+        def fake_boot(guest, target_os):
+            host, agent = socket.socketpair()
+            guest._socket = host
+            guest._reader = host.makefile("r", encoding="utf-8", newline="\n")
+            guest.info = {"share_mode": "virtiofs"}
+            guest.boot_seconds = 0.1
+            threading.Thread(target=fake_agent, args=(agent, self.exit_codes, self.batch), daemon=True).start()
+            self.booted.append(guest.name)
+            guest.start_dispatcher()
+
+        patcher = patch.object(PoolGuest, "boot", fake_boot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def run_job(self, pool):
+        run_dir = self.workdir / "zlib.rpm"
+        (run_dir / "inputs").mkdir(parents=True, exist_ok=True)
+        return pool.run_job(
+            "an23",
+            pool.new_job(run_dir),
+            mock_cfg=run_dir / "inputs" / "mock-vm.cfg",
+            srpm=run_dir / "inputs" / "zlib.src.rpm",
+            results_dir=run_dir / "results",
+            runs=1,
+            isolation="simple",
+            log=run_dir / "metadata" / "vm-rebuild.log",
+        )
+
+    def test_guests_are_reused_until_recycle_limit(self):
+        self.exit_codes.extend([0, 0, 0])
+        pool = VmPool(self.args, size=1, recycle_after=2)
+
+        results = [self.run_job(pool) for _ in range(3)]
+        pool.close()
+
+        self.assertEqual([result["exit_code"] for result in results], [0, 0, 0])
+        self.assertEqual([result["pool"]["guest"] for result in results], ["guest-1", "guest-1", "guest-2"])
+        self.assertEqual(self.booted, ["guest-1", "guest-2"])
+        self.assertEqual(results[0]["markers"][1], "VM_REBUILD_PKG_RUN_EXIT 1 0 now")
+        self.assertEqual(pool.summary()["boots"], 2)
+        self.assertEqual(pool.summary()["recycled"], 1)
+
+    def test_failed_job_recycles_guest(self):
+        self.exit_codes.extend([1, 0])
+        pool = VmPool(self.args, size=1, recycle_after=10)
+
+        failed = self.run_job(pool)
+        passed = self.run_job(pool)
+        pool.close()
+
+        self.assertEqual(failed["exit_code"], 1)
+        self.assertEqual(passed["pool"]["guest"], "guest-2")
+
+    def test_guest_runs_concurrent_jobs_in_separate_mock_roots(self):
+        self.exit_codes.extend([0, 0])
+        self.batch = 2
+        self.args.vm_guest_jobs = 2
+        pool = VmPool(self.args, size=1)
+
+        results = [None, None]
+        threads = [
+            threading.Thread(target=lambda index=index: results.__setitem__(index, self.run_job(pool)))
+            for index in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        pool.close()
+
+        self.assertEqual(self.booted, ["guest-1"])
+        self.assertEqual([result["exit_code"] for result in results], [0, 0])
+        self.assertEqual(sorted(result["uniqueext"] for result in results), ["job-1", "job-2"])
+        self.assertEqual(sorted(result["pool"]["guest_job"] for result in results), [1, 2])
+        self.assertEqual(pool.summary()["guest_jobs"], 2)
+
+    def test_guest_paths_are_mapped_below_the_job_directory(self):
+        pool = VmPool(self.args)
+        job = pool.new_job(self.workdir / "zlib.rpm")
+
+        self.assertEqual(job["dir"], self.workdir / "vm-pool" / "jobs" / "job-1")
+        self.assertEqual(
+            pool.guest_path(job, self.workdir / "zlib.rpm" / "inputs" / "mock-vm.cfg"),
+            Path("/mnt/guanfu-work/job-1/inputs/mock-vm.cfg"),
+        )
+        with self.assertRaises(RuntimeError):
+            pool.guest_path(job, self.workdir / "cache" / "koji-metadata.sqlite3")
+
+    def test_jobs_see_links_to_their_inputs_and_return_results(self):
+        self.exit_codes.append(0)
+        run_dir = self.workdir / "zlib.rpm"
+        (run_dir / "inputs").mkdir(parents=True)
+        (run_dir / "inputs" / "zlib.src.rpm").write_bytes(b"srpm")
+        (run_dir / "fallback-repo").mkdir()
+        (run_dir / "fallback-repo" / "dep.rpm").write_bytes(b"dep")
+        pool = VmPool(self.args)
+        job = pool.new_job(run_dir)
+        staged = {}
+
+        def fake_run(guest_self, job_id, fields, timeout):
+            # The guest writes into its job directory only.
+            staged["files"] = sorted(str(path.relative_to(job["dir"])) for path in job["dir"].rglob("*"))
+            staged["inode"] = (job["dir"] / "inputs" / "zlib.src.rpm").stat().st_ino
+            (job["dir"] / "results" / "run-1").mkdir()
+            (job["dir"] / "results" / "run-1" / "zlib.rpm").write_bytes(b"rpm")
+            (job["dir"] / "metadata" / "vm-rebuild.log").write_text("VM_BATCH_END now\n")
+            return {"exit_code": 0, "timed_out": False, "elapsed_seconds": 1.0, "markers": [], "guest": {}}
+
+        with patch.object(PoolGuest, "run_job", fake_run):
+            pool.run_job(
+                "an23",
+                job,
+                mock_cfg=run_dir / "inputs" / "mock-vm.cfg",
+                srpm=run_dir / "inputs" / "zlib.src.rpm",
+                results_dir=run_dir / "results",
+                runs=1,
+                isolation="simple",
+                log=run_dir / "metadata" / "vm-rebuild.log",
+            )
+        pool.close()
+
+        self.assertEqual(
+            staged["files"],
+            ["fallback-repo", "fallback-repo/dep.rpm", "inputs", "inputs/zlib.src.rpm", "metadata", "results"],
+        )
+        # Inputs are hard links, not copies; the guest only gets them read-only.
+        self.assertEqual(staged["inode"], (run_dir / "inputs" / "zlib.src.rpm").stat().st_ino)
+        self.assertIn("refusing to build", _vm_agent_script("/mnt/guanfu-work", "9p"))
+        self.assertEqual((run_dir / "results" / "run-1" / "zlib.rpm").read_bytes(), b"rpm")
+        self.assertEqual((run_dir / "metadata" / "vm-rebuild.log").read_text(), "VM_BATCH_END now\n")
+        self.assertEqual(list((self.workdir / "vm-pool" / "jobs").iterdir()), [])
+
+    def test_pool_guests_get_an_agent_port(self):
+        command = build_qemu_command(
+            SimpleNamespace(vm_image="/tmp/an23.qcow2", vm_image_format="qcow2"),
+            qemu_binary="/usr/bin/qemu-system-x86_64",
+            profile={"qemu_cpu": "Cascadelake-Server-v1"},
+            acceleration="kvm",
+            shared_dir=Path("/tmp/work"),
+            agent_socket="/tmp/agent.sock",
+        )
+
+        self.assertIn("socket,id=guanfu_agent,path=/tmp/agent.sock,server=on,wait=off", command)
+        self.assertIn("virtserialport,chardev=guanfu_agent,name=org.guanfu.agent", command)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from guanfu.koji_rebuild.vm_executor import _sized_vm_args
+from guanfu.koji_rebuild.vm_scheduler import (
+    VmScheduler,
+    parse_hw_info_resources,
+    parse_memory_mib,
+    pinned_command,
+    vm_resource_request,
+)
+
+
+HW_INFO = """CPU info:
+Architecture:                    x86_64
+CPU(s):                          16
+Model name:                      Intel(R) Xeon(R) Platinum 8269CY CPU @ 2.50GHz
+
+Memory:
+               total        used        free      shared  buff/cache   available
+Mem:        32778164     1372040    29410348        1268     1995776    30990540
+Swap:              0           0           0
+"""
+
+
+def capacity(cpus=8, memory_mib=16384, disk_bytes=100 << 30, nodes=None):
+    return {
+        "cpus": list(range(cpus)),
+        "memory_mib": memory_mib,
+        "disk_bytes": disk_bytes,
+        "numa_nodes": nodes or [],
+    }
+
+
+class VmSchedulerTests(unittest.TestCase):
+    def test_parses_koji_hw_info_and_qemu_memory_sizes(self):
+        self.assertEqual(parse_hw_info_resources(HW_INFO), {"cpus": 16, "memory_mib": 32009})
+        self.assertEqual(parse_hw_info_resources("Mem:  15Gi  1Gi\n")["memory_mib"], 15360)
+        self.assertEqual(parse_memory_mib("4096M"), 4096)
+        self.assertEqual(parse_memory_mib("8G"), 8192)
+        with self.assertRaises(ValueError):
+            parse_memory_mib("lots")
+
+    def test_request_sizes_from_hw_info_then_cost_model(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            inputs_dir = Path(tmp)
+            srpm = inputs_dir / "zlib.src.rpm"
+            srpm.write_bytes(b"x" * 1024)
+            args = SimpleNamespace(vm_sizing="koji", vm_smp="2", vm_memory="4096M")
+
+            self.assertEqual(vm_resource_request(args, inputs_dir, srpm)["sizing"], "cost")
+            (inputs_dir / "hw_info.log").write_text(HW_INFO)
+            koji = vm_resource_request(args, inputs_dir, srpm)
+            fixed = vm_resource_request(args, inputs_dir, srpm, sizing="fixed")
+
+        self.assertEqual((koji["sizing"], koji["smp"], koji["memory_mib"]), ("koji", 16, 32009))
+        self.assertEqual((fixed["sizing"], fixed["smp"], fixed["memory_mib"]), ("fixed", 2, 4096))
+
+    def test_vms_that_do_not_fit_wait_in_order(self):
+        scheduler = VmScheduler(capacity(cpus=4))
+        request = {"smp": 3, "memory_mib": 1024, "disk_bytes": 1 << 30}
+        first = scheduler.reserve(request)
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(scheduler.reserve(request)))
+        waiter.start()
+        time.sleep(0.2)
+
+        self.assertEqual(admitted, [])
+        scheduler.release(first)
+        waiter.join(5)
+
+        self.assertEqual(len(admitted), 1)
+        self.assertEqual(scheduler.summary()["queued"], 1)
+        self.assertEqual(scheduler.summary()["max_running"], 1)
+
+    def test_oversized_vm_is_clamped_to_the_host(self):
+        scheduler = VmScheduler(capacity(cpus=4, memory_mib=2048))
+
+        request = {"sizing": "fixed", "smp": 16, "memory_mib": 32768, "disk_bytes": 1 << 30}
+        reservation = scheduler.reserve(request)
+        args = _sized_vm_args(SimpleNamespace(vm_smp="16", vm_memory="32G"), request, reservation)
+
+        self.assertEqual((reservation["smp"], reservation["memory_mib"]), (4, 2048))
+        self.assertEqual((args.vm_smp, args.vm_memory), ("4", "2048M"))
+
+    def test_pinning_keeps_a_vm_on_one_numa_node(self):
+        nodes = [{"node": 0, "cpus": [0, 1, 2, 3]}, {"node": 1, "cpus": [4, 5, 6, 7]}]
+        scheduler = VmScheduler(capacity(nodes=nodes), pin_cpus=True)
+        request = {"smp": 3, "memory_mib": 1024, "disk_bytes": 1 << 30}
+
+        first = scheduler.reserve(request)
+        second = scheduler.reserve(request)
+
+        self.assertEqual((first["numa_node"], first["cpus"]), (0, [0, 1, 2]))
+        self.assertEqual((second["numa_node"], second["cpus"]), (1, [4, 5, 6]))
+        with patch("guanfu.koji_rebuild.vm_scheduler.shutil.which", side_effect=lambda name: "/usr/bin/" + name):
+            self.assertEqual(
+                pinned_command(["qemu-system-x86_64"], second),
+                ["/usr/bin/numactl", "--physcpubind=4,5,6", "--membind=1", "qemu-system-x86_64"],
+            )
+        self.assertEqual(pinned_command(["qemu-system-x86_64"], None), ["qemu-system-x86_64"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import json
+import socket
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from guanfu.koji_rebuild.vm_executor import _vm_agent_script
+from guanfu.koji_rebuild.vm_snapshot import (
+    SNAPSHOT_DISK,
+    SNAPSHOT_MEMORY,
+    QmpClient,
+    load_ready_snapshot,
+    ready_snapshot_key,
+    save_ready_snapshot,
+)
+
+
+class FakeQmp:
+    def __init__(self):
+        self.commands = []
+        self.statuses = ["active", "completed"]
+
+    def execute(self, command, arguments=None):
+        self.commands.append(command)
+        if command == "migrate":
+            # The real QEMU runs the exec: command; only the target file matters here.
+            Path(arguments["uri"].split("> ", 1)[1].strip("'")).write_bytes(b"ram")
+        if command == "query-migrate":
+            return {"status": self.statuses.pop(0)}
+        return {}
+
+
+class VmSnapshotTests(unittest.TestCase):
+    def info(self, **vm_image):
+        return {
+            "vm_image": dict({"golden": {"key": "g" * 64}}, **vm_image),
+            "profile": {"name": "an23-x86_64", "qemu_cpu": "Cascadelake-Server-v1"},
+            "qemu_binary": "/usr/bin/qemu-system-x86_64",
+            "acceleration": "kvm",
+            "share_mode": "9p",
+        }
+
+    @patch("guanfu.koji_rebuild.vm_snapshot.qemu_version", return_value="QEMU emulator version 8.2.0")
+    def test_key_covers_image_hardware_and_agent(self, _qemu_version):
+        args = SimpleNamespace(vm_smp=2, vm_memory="4096M")
+        key = ready_snapshot_key(args, self.info(), "agent")
+
+        self.assertEqual(key, ready_snapshot_key(args, self.info(), "agent"))
+        self.assertNotEqual(key, ready_snapshot_key(SimpleNamespace(vm_smp=4, vm_memory="4096M"), self.info(), "agent"))
+        self.assertNotEqual(key, ready_snapshot_key(args, self.info(golden={"key": "h" * 64}), "agent"))
+        self.assertNotEqual(key, ready_snapshot_key(args, self.info(), "agent v2"))
+
+    def test_save_freezes_memory_and_disk_then_load_reuses_it(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = Path(tmp) / "vm-cache"
+            disk = Path(tmp) / "vm-overlay.qcow2"
+            disk.write_bytes(b"disk")
+            qmp = FakeQmp()
+            process = SimpleNamespace(wait=lambda timeout=None: 0)
+
+            self.assertIsNone(load_ready_snapshot(cache_dir, "a" * 64))
+            saved = save_ready_snapshot(qmp, process, cache_dir, "a" * 64, disk, 12.5)
+            loaded = load_ready_snapshot(cache_dir, "a" * 64)
+
+            self.assertEqual(qmp.commands, ["stop", "migrate", "query-migrate", "query-migrate", "quit"])
+            self.assertEqual(saved["status"], "built")
+            self.assertEqual(loaded["status"], "reused")
+            self.assertEqual(loaded["boot_seconds"], 12.5)
+            self.assertFalse(disk.exists())
+            self.assertEqual((Path(loaded["path"]) / SNAPSHOT_DISK).read_bytes(), b"disk")
+            self.assertEqual((Path(loaded["path"]) / SNAPSHOT_MEMORY).read_bytes(), b"ram")
+            self.assertEqual(list((cache_dir / "snapshots").iterdir()), [Path(loaded["path"])])
+
+    def test_second_save_of_a_key_keeps_the_first_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = Path(tmp) / "vm-cache"
+            process = SimpleNamespace(wait=lambda timeout=None: 0)
+            for content in (b"first", b"second"):
+                disk = Path(tmp) / "vm-overlay.qcow2"
+                disk.write_bytes(content)
+                save_ready_snapshot(FakeQmp(), process, cache_dir, "a" * 64, disk, 1.0)
+            loaded = load_ready_snapshot(cache_dir, "a" * 64)
+            content = (Path(loaded["path"]) / SNAPSHOT_DISK).read_bytes()
+            entries = list((cache_dir / "snapshots").iterdir())
+
+        self.assertEqual(content, b"first")
+        self.assertEqual(entries, [Path(loaded["path"])])
+
+    def test_qmp_client_negotiates_and_skips_events(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / "qmp.sock")
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(1)
+            received = []
+
+            def serve():
+                conn, _ = server.accept()
+                reader = conn.makefile("r")
+                conn.sendall(b'{"QMP": {"version": {}}}\n')
+                for line in reader:
+                    received.append(json.loads(line)["execute"])
+                    if received[-1] == "stop":
+                        conn.sendall(b'{"event": "STOP"}\n')
+                    conn.sendall(b'{"return": {}}\n')
+                conn.close()
+
+            threading.Thread(target=serve, daemon=True).start()
+            qmp = QmpClient(path, deadline=0)
+            self.assertEqual(qmp.execute("stop"), {})
+            qmp.close()
+            server.close()
+
+            self.assertEqual(received, ["qmp_capabilities", "stop"])
+
+    def test_snapshot_agent_pauses_before_mounting_the_share(self):
+        script = _vm_agent_script("/mnt/guanfu-work", "9p", snapshot=True)
+
+        self.assertLess(script.index("AGENT_SNAPSHOT_READY"), script.index("mount -t 9p"))
+        self.assertLess(script.index("mount -t 9p"), script.index("\"AGENT_READY\""))
+        self.assertIn("RESUME", script)
+
+
+if __name__ == "__main__":
+    unittest.main()